@@ -42,17 +42,24 @@ from openfermioncirq.primitives.bogoliubov_transform import bogoliubov_transform
 
 from openfermioncirq.primitives.swap_network import swap_network
 
+from openfermioncirq.preprocessing_cache import PreprocessingCache
+
 from openfermioncirq.trotter import simulate_trotter
 
 from openfermioncirq.variational import (
+    ClusterExecutor,
+    FermionicLinearOperator,
     HamiltonianObjective,
     LowRankTrotterAnsatz,
     SplitOperatorTrotterAnsatz,
+    StoppingPolicy,
+    SuccessiveHalving,
     SwapNetworkTrotterAnsatz,
     SwapNetworkTrotterHubbardAnsatz,
     VariationalAnsatz,
     VariationalObjective,
     VariationalStudy,
+    run_cluster_worker,
 )
 
 # Import modules last to avoid circular dependencies
@@ -12,21 +12,43 @@
 
 """Optimization algorithms and related classes."""
 
+from openfermioncirq.optimization.ask_tell import (
+    AskTellOptimizer,
+    EvaluationRequest,
+    ThreadedAskTellOptimizer,
+    optimize_in_parallel)
+
 from openfermioncirq.optimization.algorithm import (
     OptimizationAlgorithm,
     OptimizationParams)
 
 from openfermioncirq.optimization.black_box import (
     BlackBox,
+    EvaluationBudgetExhausted,
+    EvaluationCache,
     StatefulBlackBox)
 
+from openfermioncirq.optimization.profiling import (
+    Profiler,
+    SpanHistogram)
+
 from openfermioncirq.optimization.result import (
     OptimizationResult,
     OptimizationTrialResult)
 
+from openfermioncirq.optimization.trace import (
+    FunctionValueBuffer,
+    FunctionValueTrace)
+
 from openfermioncirq.optimization.scipy import (
     COBYLA,
     L_BFGS_B,
     NELDER_MEAD,
     SLSQP,
     ScipyOptimizationAlgorithm)
+
+from openfermioncirq.optimization.cma_es import (
+    CMAES)
+
+from openfermioncirq.optimization.spsa import (
+    SPSA)
@@ -12,12 +12,14 @@
 
 """Defines the interface for black box optimization algorithms."""
 
-from typing import Any, Optional
+from typing import Any, Optional, Sequence, Tuple
 
 import abc
 
 import numpy
 
+from openfermioncirq.optimization.ask_tell import (
+        AskTellOptimizer, ThreadedAskTellOptimizer)
 from openfermioncirq.optimization.black_box import BlackBox
 from openfermioncirq.optimization.result import OptimizationResult
 
@@ -69,6 +71,34 @@ class OptimizationAlgorithm(metaclass=abc.ABCMeta):
                 representing one initial point.
         """
 
+    def ask_tell(self,
+                 black_box: BlackBox,
+                 initial_guess: Optional[numpy.ndarray]=None,
+                 initial_guess_array: Optional[numpy.ndarray]=None
+                 ) -> AskTellOptimizer:
+        """Start an optimization that is driven by asking and telling.
+
+        Instead of evaluating the black box itself, the returned optimizer
+        hands out the points to evaluate and is told their values, which
+        lets the caller evaluate several points in parallel (see
+        `optimize_in_parallel`). The black box is used only for its
+        dimension, bounds, cost of evaluation and noise bounds.
+
+        By default, `optimize` is run in a background thread, so only the
+        points of batch evaluations are handed out together. Override this
+        method for algorithms that can propose points asynchronously.
+
+        Args:
+            black_box: A BlackBox describing the objective function.
+            initial_guess: An initial point at which to evaluate the objective
+                function.
+            initial_guess_array: An array of initial points at which to
+                evaluate the objective function, for algorithms that can use
+                multiple initial points.
+        """
+        return ThreadedAskTellOptimizer(self, black_box, initial_guess,
+                                        initial_guess_array)
+
     @property
     def name(self) -> str:
         """A name for the optimization algorithm."""
@@ -87,15 +117,48 @@ class OptimizationParams:
         cost_of_evaluate: A cost value associated with the `evaluate`
             method of the BlackBox to be optimized. For use with black boxes
             with a noise and cost model.
+        cache_size: The number of noiseless function values that the
+            BlackBox to be optimized should cache. Set this to 0 to disable
+            caching.
     """
 
     def __init__(self,
                  algorithm: OptimizationAlgorithm,
                  initial_guess: Optional[numpy.ndarray]=None,
                  initial_guess_array: Optional[numpy.ndarray]=None,
-                 cost_of_evaluate: Optional[float]=None) -> None:
+                 cost_of_evaluate: Optional[float]=None,
+                 cache_size: int=0) -> None:
         """Construct a parameters object by setting its attributes."""
         self.algorithm = algorithm
         self.initial_guess = initial_guess
         self.initial_guess_array = initial_guess_array
         self.cost_of_evaluate = cost_of_evaluate
+        self.cache_size = cache_size
+
+    def __setstate__(self, state):
+        # Parameters pickled before caching was added have no cache size
+        state.setdefault('cache_size', 0)
+        self.__dict__.update(state)
+
+
+def bounds_arrays(bounds: Optional[Sequence[Tuple[float, float]]],
+                  dimension: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Arrays of the lower and upper bounds of the variables.
+
+    Args:
+        bounds: The bounds of a black box, as pairs (low, high) in which
+            either bound may be None, or None if there are no bounds.
+        dimension: The number of variables.
+
+    Returns:
+        The lower bounds and the upper bounds, which are infinite where a
+        bound is absent.
+    """
+    lower = numpy.full(dimension, -numpy.inf)
+    upper = numpy.full(dimension, numpy.inf)
+    for i, (low, high) in enumerate(bounds or []):
+        if low is not None:
+            lower[i] = low
+        if high is not None:
+            upper[i] = high
+    return lower, upper
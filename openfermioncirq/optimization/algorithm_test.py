@@ -10,10 +10,14 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import pickle
+
 import numpy
 import pytest
 
-from openfermioncirq.optimization import OptimizationAlgorithm
+from openfermioncirq.optimization import (
+        OptimizationAlgorithm, OptimizationParams)
+from openfermioncirq.optimization.algorithm import bounds_arrays
 from openfermioncirq.testing import ExampleAlgorithm, ExampleBlackBox
 
 
@@ -55,3 +59,22 @@ def test_optimization_algorithm_is_abstract_can_implement():
             pass
 
     assert isinstance(Included(), OptimizationAlgorithm)
+
+
+def test_bounds_arrays():
+    lower, upper = bounds_arrays([(-1.0, None), (None, 2.0)], 2)
+    numpy.testing.assert_equal(lower, [-1.0, -numpy.inf])
+    numpy.testing.assert_equal(upper, [numpy.inf, 2.0])
+
+    lower, upper = bounds_arrays(None, 3)
+    numpy.testing.assert_equal(lower, [-numpy.inf] * 3)
+    numpy.testing.assert_equal(upper, [numpy.inf] * 3)
+
+
+def test_optimization_params_pickle_without_cache_size():
+    params = OptimizationParams(ExampleAlgorithm(), numpy.zeros(2))
+    # Parameters pickled before the cache size was added
+    del params.cache_size
+    unpickled = pickle.loads(pickle.dumps(params))
+    assert unpickled.cache_size == 0
+    numpy.testing.assert_equal(unpickled.initial_guess, numpy.zeros(2))
@@ -0,0 +1,361 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Optimizations driven by asking for points and telling their values."""
+
+from typing import (
+        Any, Dict, NamedTuple, Optional, Sequence, TYPE_CHECKING, Tuple)
+
+import abc
+import collections
+import concurrent.futures
+import multiprocessing
+import multiprocessing.pool
+import queue
+import threading
+
+import numpy
+
+from openfermioncirq.optimization.black_box import BlackBox, StatefulBlackBox
+from openfermioncirq.optimization.result import OptimizationResult
+
+if TYPE_CHECKING:
+    # pylint: disable=unused-import
+    from openfermioncirq.optimization.algorithm import OptimizationAlgorithm
+
+
+EvaluationRequest = NamedTuple('EvaluationRequest', [
+    ('x', numpy.ndarray),
+    ('cost', Optional[float])])
+EvaluationRequest.__doc__ = """A point that an optimizer asks to evaluate.
+
+Attributes:
+    x: The point to evaluate.
+    cost: The cost to evaluate the point with, or None to evaluate it
+        without a cost.
+"""
+
+
+class AskTellOptimizer(metaclass=abc.ABCMeta):
+    """An optimization in progress that is driven by its caller.
+
+    The caller repeatedly asks the optimizer for points to evaluate and tells
+    it their values. An optimizer may hand out several points before it is
+    told any of their values, which lets the caller evaluate them in
+    parallel, and it must accept the values in any order.
+    """
+
+    @abc.abstractmethod
+    def ask(self) -> Optional[EvaluationRequest]:
+        """The next point to evaluate.
+
+        Returns None if the optimizer can't propose a point until it is told
+        the values of the points that it has already handed out, or if it is
+        done.
+        """
+
+    @abc.abstractmethod
+    def tell(self, request: EvaluationRequest, value: float) -> None:
+        """Report the value of a point returned by `ask`."""
+
+    @abc.abstractproperty
+    def done(self) -> bool:
+        """Whether the optimization has finished."""
+
+    @abc.abstractmethod
+    def result(self) -> OptimizationResult:
+        """The result of the optimization, once it is done."""
+
+    def close(self) -> None:
+        """Abandon the optimization if it isn't done.
+
+        This releases any resources held by an unfinished optimization. The
+        values of points that were handed out are no longer accepted.
+        """
+
+
+class ThreadedAskTellOptimizer(AskTellOptimizer):
+    """Drives the `optimize` method of an algorithm by asking and telling.
+
+    The algorithm runs in a background thread on a black box that forwards
+    each evaluation to the caller of `ask` and waits for the value to be
+    told. The points of a batch evaluation are all handed out before any
+    value is needed, so algorithms that evaluate points in batches can have
+    them evaluated in parallel. Gradients are not available to the
+    algorithm.
+    """
+
+    def __init__(self,
+                 algorithm: 'OptimizationAlgorithm',
+                 black_box: BlackBox,
+                 initial_guess: Optional[numpy.ndarray]=None,
+                 initial_guess_array: Optional[numpy.ndarray]=None) -> None:
+        """
+        Args:
+            algorithm: The algorithm to run.
+            black_box: The black box whose dimension, bounds, cost of
+                evaluation and noise bounds are seen by the algorithm. It is
+                not evaluated.
+            initial_guess: The initial guess passed to the algorithm.
+            initial_guess_array: The initial guess array passed to the
+                algorithm.
+        """
+        self._condition = threading.Condition()
+        self._requests = collections.deque() \
+            # type: collections.deque
+        # The requests handed out and the futures of their values, by the id
+        # of the request
+        self._futures = {} \
+            # type: Dict[int, Tuple[EvaluationRequest, concurrent.futures.Future]]
+        # The number of values that the algorithm is waiting for
+        self._num_awaited = 0
+        self._finished = False
+        self._closed = False
+        self._result = None  # type: Optional[OptimizationResult]
+        self._error = None  # type: Optional[BaseException]
+        proxy = _AskTellBlackBox(black_box, self)
+        self._thread = threading.Thread(
+                target=self._run,
+                args=(algorithm, proxy, initial_guess, initial_guess_array),
+                daemon=True)
+        self._thread.start()
+
+    def _run(self,
+             algorithm: 'OptimizationAlgorithm',
+             black_box: BlackBox,
+             initial_guess: Optional[numpy.ndarray],
+             initial_guess_array: Optional[numpy.ndarray]) -> None:
+        try:
+            self._result = algorithm.optimize(
+                    black_box, initial_guess, initial_guess_array)
+        except BaseException as error:  # pylint: disable=broad-except
+            self._error = error
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def _evaluate(self,
+                  X: numpy.ndarray,
+                  cost: Optional[float]) -> numpy.ndarray:
+        """Hand out points and wait for their values.
+
+        Called by the algorithm's thread.
+        """
+        futures = []
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The optimization was closed.')
+            for x in X:
+                request = EvaluationRequest(numpy.array(x), cost)
+                future = concurrent.futures.Future()  # type: Any
+                self._futures[id(request)] = (request, future)
+                self._requests.append(request)
+                futures.append(future)
+            self._num_awaited += len(futures)
+            self._condition.notify_all()
+        return numpy.array([future.result() for future in futures])
+
+    def ask(self) -> Optional[EvaluationRequest]:
+        with self._condition:
+            while True:
+                if self._requests:
+                    return self._requests.popleft()
+                if self._finished or self._num_awaited:
+                    return None
+                # The algorithm is working out its next points
+                self._condition.wait()
+
+    def tell(self, request: EvaluationRequest, value: float) -> None:
+        with self._condition:
+            _, future = self._futures.pop(id(request))
+            self._num_awaited -= 1
+        future.set_result(value)
+
+    @property
+    def done(self) -> bool:
+        with self._condition:
+            return self._finished and not self._requests
+
+    def result(self) -> OptimizationResult:
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            futures = [future for _, future in self._futures.values()]
+            self._futures.clear()
+            self._requests.clear()
+        # The algorithm stops with an error at its pending evaluation
+        for future in futures:
+            future.set_exception(
+                    RuntimeError('The optimization was closed.'))
+        self._thread.join()
+
+
+class _AskTellBlackBox(BlackBox):
+    """A black box whose evaluations are performed by the caller of `ask`."""
+
+    def __init__(self,
+                 black_box: BlackBox,
+                 optimizer: ThreadedAskTellOptimizer) -> None:
+        self._black_box = black_box
+        self._optimizer = optimizer
+        super().__init__(cost_of_evaluate=black_box.cost_of_evaluate)
+
+    @property
+    def dimension(self) -> int:
+        return self._black_box.dimension
+
+    @property
+    def bounds(self) -> Optional[Sequence[Tuple[float, float]]]:
+        return self._black_box.bounds
+
+    def _evaluate(self, x: numpy.ndarray) -> float:
+        return self._optimizer._evaluate(numpy.array([x]), None)[0]
+
+    def _evaluate_with_cost(self, x: numpy.ndarray, cost: float) -> float:
+        return self._optimizer._evaluate(numpy.array([x]), cost)[0]
+
+    def _evaluate_batch(self, X: numpy.ndarray) -> numpy.ndarray:
+        return self._optimizer._evaluate(X, None)
+
+    def _evaluate_batch_with_cost(self,
+                                  X: numpy.ndarray,
+                                  cost: float) -> numpy.ndarray:
+        return self._optimizer._evaluate(X, cost)
+
+    def noise_bounds(self,
+                     cost: float,
+                     confidence: Optional[float]=None
+                     ) -> Tuple[float, float]:
+        return self._black_box.noise_bounds(cost, confidence)
+
+
+def optimize_in_parallel(algorithm: 'OptimizationAlgorithm',
+                         black_box: BlackBox,
+                         initial_guess: Optional[numpy.ndarray]=None,
+                         initial_guess_array: Optional[numpy.ndarray]=None,
+                         max_in_flight: Optional[int]=None,
+                         executor: Optional[concurrent.futures.Executor]=None
+                         ) -> OptimizationResult:
+    """Optimize a black box with its evaluations run in parallel.
+
+    The algorithm is driven through its `ask_tell` method. Points are
+    evaluated in worker processes, keeping up to `max_in_flight` evaluations
+    in progress, and each value is told to the optimizer as soon as it is
+    available. The workers evaluate copies of the black box. If the black box
+    is a StatefulBlackBox, each evaluation is recorded in it as it completes,
+    but its evaluation cache is not used.
+
+    Before each evaluation, the worker seeds numpy's random number generator
+    with a seed drawn from the calling process, so that noisy evaluations are
+    independent.
+
+    Args:
+        algorithm: The optimization algorithm.
+        black_box: The black box to optimize. It must be picklable unless a
+            thread executor is used.
+        initial_guess: An initial point at which to evaluate the objective
+            function.
+        initial_guess_array: An array of initial points, for algorithms that
+            can use multiple initial points.
+        max_in_flight: The maximum number of evaluations in progress at
+            once. It defaults to the number of CPUs.
+        executor: A concurrent.futures.Executor to evaluate the points with.
+            The black box is sent with each evaluation. By default, a
+            temporary pool of `max_in_flight` worker processes is created, to
+            which the black box is sent once. Threads share numpy's random
+            state, so noisy evaluations in threads may not be independent.
+    """
+    if max_in_flight is None:
+        # coverage: ignore
+        max_in_flight = multiprocessing.cpu_count()
+
+    pool = None  # type: Optional[multiprocessing.pool.Pool]
+    if executor is None:
+        pool = multiprocessing.Pool(max_in_flight,
+                                    initializer=_initialize_worker,
+                                    initargs=(black_box,))
+
+    def submit(request: EvaluationRequest) -> concurrent.futures.Future:
+        seed = numpy.random.randint(4294967296)
+        if pool is None:
+            return executor.submit(_evaluate_request,
+                                   black_box, request, seed)
+        future = concurrent.futures.Future()  # type: Any
+        future.set_running_or_notify_cancel()
+        pool.apply_async(_evaluate_request_in_worker,
+                         (request, seed),
+                         callback=future.set_result,
+                         error_callback=future.set_exception)
+        return future
+
+    optimizer = algorithm.ask_tell(black_box, initial_guess,
+                                   initial_guess_array)
+    in_flight = {}  # type: Dict[concurrent.futures.Future, EvaluationRequest]
+    completed = queue.Queue()  # type: queue.Queue
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                request = optimizer.ask()
+                if request is None:
+                    break
+                future = submit(request)
+                in_flight[future] = request
+                future.add_done_callback(completed.put)
+            if not in_flight:
+                if not optimizer.done:
+                    raise RuntimeError('The optimizer proposed no points but '
+                                       'is not done.')
+                break
+            future = completed.get()
+            request = in_flight.pop(future)
+            value = future.result()
+            if isinstance(black_box, StatefulBlackBox):
+                black_box.record(request.x, value, request.cost)
+            optimizer.tell(request, value)
+        return optimizer.result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        optimizer.close()
+        if pool is not None:
+            pool.terminate()
+
+
+# The black box of a worker process, set by _initialize_worker
+_worker_black_box = None  # type: Optional[BlackBox]
+
+
+def _initialize_worker(black_box: BlackBox) -> None:
+    """Store the black box in a newly started worker process."""
+    global _worker_black_box
+    _worker_black_box = black_box
+
+
+def _evaluate_request_in_worker(request: EvaluationRequest,
+                                seed: int) -> float:
+    return _evaluate_request(_worker_black_box, request, seed)
+
+
+def _evaluate_request(black_box: BlackBox,
+                      request: EvaluationRequest,
+                      seed: int) -> float:
+    """Evaluate a point without updating the state of the black box."""
+    numpy.random.seed(seed)
+    if request.cost is None:
+        return black_box._evaluate(request.x)
+    return black_box._evaluate_with_cost(request.x, request.cost)
@@ -0,0 +1,177 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import concurrent.futures
+import threading
+import time
+
+import numpy
+import pytest
+
+from openfermioncirq.optimization import (
+        COBYLA,
+        L_BFGS_B,
+        AskTellOptimizer,
+        OptimizationAlgorithm,
+        OptimizationResult,
+        ThreadedAskTellOptimizer,
+        optimize_in_parallel)
+from openfermioncirq.testing import (
+        ExampleBlackBox,
+        ExampleBlackBoxNoisy,
+        ExampleStatefulBlackBox)
+
+
+class BatchAlgorithm(OptimizationAlgorithm):
+    """Evaluates two batches of random points and returns the best one."""
+
+    def optimize(self, black_box, initial_guess=None,
+                 initial_guess_array=None):
+        X = numpy.random.RandomState(0).randn(8, black_box.dimension)
+        vals = numpy.concatenate([black_box.evaluate_batch(X[:4]),
+                                  black_box.evaluate_batch(X[4:])])
+        return OptimizationResult(optimal_value=numpy.min(vals),
+                                  optimal_parameters=X[numpy.argmin(vals)],
+                                  num_evaluations=len(X))
+
+
+class FailingAlgorithm(OptimizationAlgorithm):
+
+    def optimize(self, black_box, initial_guess=None,
+                 initial_guess_array=None):
+        _ = black_box.evaluate(numpy.zeros(black_box.dimension))
+        raise ValueError('failed')
+
+
+class ConcurrencyBlackBox(ExampleBlackBox):
+    """Records the largest number of evaluations in progress at once."""
+
+    def __init__(self, **kwargs):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        super().__init__(**kwargs)
+
+    def _evaluate(self, x):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return super()._evaluate(x)
+
+
+def test_threaded_ask_tell_optimizer():
+    black_box = ExampleBlackBox()
+    optimizer = BatchAlgorithm().ask_tell(black_box)
+    assert isinstance(optimizer, ThreadedAskTellOptimizer)
+
+    for _ in range(2):
+        requests = [optimizer.ask() for _ in range(4)]
+        assert optimizer.ask() is None
+        assert not optimizer.done
+        # Values are accepted in any order
+        for request in reversed(requests):
+            assert request.cost is None
+            optimizer.tell(request, black_box.evaluate(request.x))
+
+    assert optimizer.ask() is None
+    assert optimizer.done
+    result = optimizer.result()
+    X = numpy.random.RandomState(0).randn(8, 2)
+    assert result.optimal_value == numpy.min(numpy.sum(X**2, axis=1))
+
+
+def test_threaded_ask_tell_optimizer_cost():
+    black_box = ExampleBlackBoxNoisy(cost_of_evaluate=3.0)
+    optimizer = COBYLA.ask_tell(black_box, numpy.ones(2))
+    request = optimizer.ask()
+    assert request.cost == 3.0
+    numpy.testing.assert_allclose(request.x, numpy.ones(2))
+
+    # Closing stops the algorithm
+    optimizer.close()
+    assert optimizer.done
+    with pytest.raises(RuntimeError):
+        _ = optimizer.result()
+
+
+def test_optimize_in_parallel_pool():
+    black_box = ExampleStatefulBlackBox(cost_of_evaluate=2.0)
+    result = optimize_in_parallel(COBYLA, black_box, numpy.ones(2),
+                                  max_in_flight=2)
+    assert result.optimal_value == pytest.approx(0.0, abs=1e-6)
+    assert black_box.num_evaluations == result.num_evaluations
+    assert black_box.cost_spent == 2.0 * result.num_evaluations
+
+    result = optimize_in_parallel(BatchAlgorithm(), ExampleBlackBoxNoisy(),
+                                  max_in_flight=3)
+    assert result.num_evaluations == 8
+
+
+def test_optimize_in_parallel_executor():
+    black_box = ConcurrencyBlackBox()
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        result = optimize_in_parallel(BatchAlgorithm(), black_box,
+                                      max_in_flight=4, executor=executor)
+    assert black_box.max_active == 4
+    assert result.num_evaluations == 8
+
+    # The displacements of finite difference gradients are evaluated in
+    # parallel
+    black_box = ConcurrencyBlackBox()
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        result = optimize_in_parallel(L_BFGS_B, black_box,
+                                      numpy.array([0.5, -0.5]),
+                                      max_in_flight=3, executor=executor)
+    assert black_box.max_active == 2
+    assert result.optimal_value == pytest.approx(0.0, abs=1e-8)
+
+    with pytest.raises(ValueError):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            _ = optimize_in_parallel(FailingAlgorithm(), black_box,
+                                     max_in_flight=2, executor=executor)
+
+
+class StuckOptimizer(AskTellOptimizer):
+
+    def ask(self):
+        return None
+
+    def tell(self, request, value):
+        pass  # coverage: ignore
+
+    @property
+    def done(self):
+        return False
+
+    def result(self):
+        pass  # coverage: ignore
+
+
+class StuckAlgorithm(OptimizationAlgorithm):
+
+    def optimize(self, black_box, initial_guess=None,
+                 initial_guess_array=None):
+        pass  # coverage: ignore
+
+    def ask_tell(self, black_box, initial_guess=None,
+                 initial_guess_array=None):
+        return StuckOptimizer()
+
+
+def test_optimize_in_parallel_stuck_optimizer():
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        with pytest.raises(RuntimeError):
+            _ = optimize_in_parallel(StuckAlgorithm(), ExampleBlackBox(),
+                                     max_in_flight=1, executor=executor)
@@ -12,13 +12,17 @@
 
 """Defines the interface for a black box objective function."""
 
-from typing import Optional, Sequence, TYPE_CHECKING, Tuple
+from typing import Callable, Optional, Sequence, TYPE_CHECKING, Tuple
 
 import abc
+import collections
 import time
 
 import numpy
 
+from openfermioncirq.optimization import profiling
+from openfermioncirq.optimization.trace import FunctionValueBuffer
+
 if TYPE_CHECKING:
     # pylint: disable=unused-import
     from typing import List
@@ -92,6 +96,45 @@ class BlackBox(metaclass=abc.ABCMeta):
         # Default: defer to `_evaluate`
         return self._evaluate(x)
 
+    def _evaluate_batch(self,
+                        X: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate the objective function at each row of a 2d array.
+
+        Override this method when the objective function can be evaluated
+        more efficiently at many points at once.
+        """
+        # Default: defer to `_evaluate`
+        return numpy.array([self._evaluate(x) for x in X])
+
+    def _evaluate_batch_with_cost(self,
+                                  X: numpy.ndarray,
+                                  cost: float) -> numpy.ndarray:
+        """Evaluate the objective function at each row of a 2d array with a
+        specified cost per evaluation.
+
+        Override this method when the objective function can be evaluated
+        more efficiently at many points at once.
+        """
+        # Default: defer to `_evaluate_with_cost`
+        return numpy.array([self._evaluate_with_cost(x, cost) for x in X])
+
+    @property
+    def has_gradient(self) -> bool:
+        """Whether `evaluate_with_gradient` is supported."""
+        # Default: no gradient
+        return False
+
+    def _evaluate_with_gradient(self,
+                                x: numpy.ndarray
+                                ) -> Tuple[float, numpy.ndarray]:
+        """Evaluate the objective function and its gradient.
+
+        Override this method and `has_gradient` when the gradient of the
+        objective function can be computed.
+        """
+        raise NotImplementedError(
+                '{} does not compute gradients.'.format(type(self).__name__))
+
     def evaluate(self,
                  x: numpy.ndarray) -> float:
         """Evaluate the objective function."""
@@ -109,6 +152,48 @@ class BlackBox(metaclass=abc.ABCMeta):
         """
         return self._evaluate_with_cost(x, cost)
 
+    def evaluate_with_gradient(self,
+                               x: numpy.ndarray
+                               ) -> Tuple[float, numpy.ndarray]:
+        """Evaluate the objective function and its gradient.
+
+        The evaluation is noiseless; `cost_of_evaluate` is ignored.
+
+        Returns:
+            A tuple (value, gradient) containing the function value and the
+            gradient of the objective function at the point.
+        """
+        return self._evaluate_with_gradient(x)
+
+    def evaluate_batch(self,
+                       X: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate the objective function at many points.
+
+        Args:
+            X: A 2d array whose rows are the points to evaluate.
+
+        Returns:
+            A 1d array containing the function value of each point.
+        """
+        if self.cost_of_evaluate is not None:
+            return self.evaluate_batch_with_cost(X, self.cost_of_evaluate)
+        return self._evaluate_batch(X)
+
+    def evaluate_batch_with_cost(self,
+                                 X: numpy.ndarray,
+                                 cost: float) -> numpy.ndarray:
+        """Evaluate the objective function at many points with a specified
+        cost per evaluation.
+
+        Args:
+            X: A 2d array whose rows are the points to evaluate.
+            cost: The cost of evaluating each point.
+
+        Returns:
+            A 1d array containing the function value of each point.
+        """
+        return self._evaluate_batch_with_cost(X, cost)
+
     def noise_bounds(self,
                      cost: float,
                      confidence: Optional[float]=None
@@ -130,6 +215,91 @@ class BlackBox(metaclass=abc.ABCMeta):
         return -numpy.inf, numpy.inf
 
 
+class EvaluationCache:
+    """A bounded cache of function values keyed on the evaluated points.
+
+    Points are identified by the bytes of their values, so only points that
+    are bit-identical share an entry. When the cache is full, the least
+    recently used entry is discarded.
+
+    Attributes:
+        max_size: The maximum number of function values stored.
+        hits: The number of lookups that found a cached value.
+        misses: The number of lookups that did not find a cached value.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """
+        Args:
+            max_size: The maximum number of function values to store.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = collections.OrderedDict() \
+            # type: collections.OrderedDict[bytes, float]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def evaluate(self,
+                 x: numpy.ndarray,
+                 function: Callable[[numpy.ndarray], float]) -> float:
+        """Look up the value of a point, calling `function` on a miss."""
+        key = _cache_key(x)
+        if key in self._values:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+        self.misses += 1
+        val = function(x)
+        self._store(key, val)
+        return val
+
+    def evaluate_batch(self,
+                       X: numpy.ndarray,
+                       function: Callable[[numpy.ndarray], numpy.ndarray]
+                       ) -> numpy.ndarray:
+        """Look up the values of many points.
+
+        The points that are not in the cache are passed to `function` in a
+        single 2d array.
+        """
+        X = numpy.asarray(X)
+        vals = [None] * len(X)  # type: List[Optional[float]]
+        missing = []  # type: List[int]
+        for i, x in enumerate(X):
+            key = _cache_key(x)
+            if key in self._values:
+                self.hits += 1
+                self._values.move_to_end(key)
+                vals[i] = self._values[key]
+            else:
+                self.misses += 1
+                missing.append(i)
+        if missing:
+            for i, val in zip(missing, function(X[missing])):
+                vals[i] = val
+                self._store(_cache_key(X[i]), val)
+        return numpy.array(vals)
+
+    def _store(self, key: bytes, val: float) -> None:
+        if self.max_size <= 0:
+            return
+        self._values[key] = val
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+
+def _cache_key(x: numpy.ndarray) -> bytes:
+    return numpy.asarray(x, dtype=float).tobytes()
+
+
+class EvaluationBudgetExhausted(Exception):
+    """Raised when a black box is asked for more evaluations than its budget.
+    """
+
+
 class StatefulBlackBox(BlackBox):
     """A black box function with memory of evaluations.
 
@@ -143,19 +313,31 @@ class StatefulBlackBox(BlackBox):
         cost_spent: The total cost that has been spent on function evaluations.
         cost_of_evaluate: An optional cost associated with the
             ``evaluate`` method.
-        function_values: A list of tuples storing function values of evaluated
-            points. The tuples contain three objects. The first is a function
-            value, the second is the cost that was used for the evaluation
-            (or None if there was no cost), and the third is the point that
-            was evaluated (or None if the black box was initialized with
-            ``save_x_vals`` set to False.
-        wait_times: A list of floats. The i-th float float represents the time
-            elapsed between the i-th and (i+1)-th times that the black box
-            was queried. Time is recorded using ``time.time()``.
+        function_values: A FunctionValueBuffer storing function values of
+            evaluated points. It behaves like a list of tuples containing
+            three objects. The first is a function value, the second is the
+            cost that was used for the evaluation (or None if there was no
+            cost), and the third is the point that was evaluated (or None if
+            the black box was initialized with ``save_x_vals`` set to False.
+        wait_times: A 1d array of floats. The i-th float float represents the
+            time elapsed between the i-th and (i+1)-th times that the black
+            box was queried. Time is recorded using ``time.time()``. If the
+            buffer doesn't retain all evaluations, only the wait times of
+            the retained evaluations are included.
+        cache: An EvaluationCache storing the values returned by
+            ``evaluate``, or None if caching is disabled.
+        max_evaluations: The maximum number of evaluations, or None if the
+            number of evaluations is not limited.
+        best_value: The smallest function value returned so far, or None if
+            there have been no evaluations.
+        best_point: The point at which ``best_value`` was returned.
     """
 
     def __init__(self,
                  save_x_vals: bool=False,
+                 cache_size: int=0,
+                 function_values: Optional[FunctionValueBuffer]=None,
+                 max_evaluations: Optional[int]=None,
                  **kwargs) -> None:
         """
         Args:
@@ -164,19 +346,47 @@ class StatefulBlackBox(BlackBox):
                 black box to consume a lot more memory. This does not affect
                 whether the function values (y values) are saved (they are
                 saved no matter what).
+            cache_size: The number of values of ``evaluate`` to remember.
+                A point that is evaluated again while its value is cached is
+                not recomputed, but it is still recorded in
+                ``function_values``. Evaluations with a cost are noisy and are
+                never cached. Set this to 0 to disable caching.
+            function_values: The FunctionValueBuffer to record evaluations
+                in, which can limit the number of evaluations retained or
+                store them on disk. By default, an unbounded buffer kept in
+                memory is used.
+            max_evaluations: The maximum number of evaluations. Once it is
+                reached, further evaluations raise EvaluationBudgetExhausted
+                without being performed, which lets an optimization be cut
+                short and its best point so far be recovered from
+                ``best_value`` and ``best_point``. Of a batch that doesn't
+                fit in the budget, the points that fit are evaluated before
+                the error is raised, so that an optimization whose batches
+                are larger than the budget still has a best point.
+                Evaluations recorded with ``record`` count towards the budget
+                but are never refused.
         """
-        self.function_values = [] \
-            # type: List[Tuple[float, Optional[float], Optional[numpy.ndarray]]]
+        if function_values is None:
+            function_values = FunctionValueBuffer()
+        self.function_values = function_values
         self.cost_spent = 0.0
-        self.wait_times = []  # type: List[float]
         self._save_x_vals = save_x_vals
         self._time_of_last_query = None  # type: Optional[float]
+        self.cache = EvaluationCache(cache_size) if cache_size > 0 else None
+        self.max_evaluations = max_evaluations
+        self.best_value = None  # type: Optional[float]
+        self.best_point = None  # type: Optional[numpy.ndarray]
         super().__init__(**kwargs)
 
     @property
     def num_evaluations(self) -> float:
         """The number of times the objective function has been evaluated."""
-        return len(self.function_values)
+        return self.function_values.num_recorded
+
+    @property
+    def wait_times(self) -> numpy.ndarray:
+        wait_times = self.function_values.wait_times
+        return wait_times[~numpy.isnan(wait_times)]
 
     def evaluate(self,
                  x: numpy.ndarray) -> float:
@@ -185,27 +395,165 @@ class StatefulBlackBox(BlackBox):
         if self.cost_of_evaluate is not None:
             return self.evaluate_with_cost(x, self.cost_of_evaluate)
 
-        if self._time_of_last_query is not None:
-            self.wait_times.append(time.time() - self._time_of_last_query)
-
-        val = self._evaluate(x)
-        self.function_values.append(
-                (val, None, x if self._save_x_vals else None)
-        )
-        self._time_of_last_query = time.time()
+        self._check_budget(1)
+        wait_time = self._wait_time()
+        if self.cache is None:
+            val = self._evaluate(x)
+        else:
+            val = self.cache.evaluate(x, self._evaluate)
+        self._record(val, None, x, wait_time)
         return val
 
     def evaluate_with_cost(self,
                            x: numpy.ndarray,
                            cost: float) -> float:
         """Evaluate the objective function with a cost and update state."""
-        if self._time_of_last_query is not None:
-            self.wait_times.append(time.time() - self._time_of_last_query)
-
+        self._check_budget(1)
+        wait_time = self._wait_time()
         val = self._evaluate_with_cost(x, cost)
-        self.function_values.append(
-                (val, cost, x if self._save_x_vals else None)
-        )
+        self._record(val, cost, x, wait_time)
         self.cost_spent += cost
-        self._time_of_last_query = time.time()
         return val
+
+    def evaluate_with_gradient(self,
+                               x: numpy.ndarray
+                               ) -> Tuple[float, numpy.ndarray]:
+        """Evaluate the objective function and its gradient and update state.
+
+        This counts as one evaluation without a cost.
+        """
+        self._check_budget(1)
+        wait_time = self._wait_time()
+        val, gradient = self._evaluate_with_gradient(x)
+        self._record(val, None, x, wait_time)
+        return val, gradient
+
+    def evaluate_batch(self,
+                       X: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate the objective function at many points and update state.
+
+        Each point counts as one evaluation. The points are considered to be
+        queried at the same time, so the wait times between them are zero.
+        """
+        if self.cost_of_evaluate is not None:
+            return self.evaluate_batch_with_cost(X, self.cost_of_evaluate)
+
+        self._check_batch_budget(X, self.evaluate_batch)
+        wait_time = self._wait_time()
+        if self.cache is None:
+            vals = self._evaluate_batch(X)
+        else:
+            vals = self.cache.evaluate_batch(X, self._evaluate_batch)
+        self._record_batch(vals, None, X, wait_time)
+        return vals
+
+    def evaluate_batch_with_cost(self,
+                                 X: numpy.ndarray,
+                                 cost: float) -> numpy.ndarray:
+        """Evaluate the objective function at many points with a cost and
+        update state.
+
+        Each point counts as one evaluation with the specified cost.
+        """
+        self._check_batch_budget(
+                X, lambda X: self.evaluate_batch_with_cost(X, cost))
+        wait_time = self._wait_time()
+        vals = self._evaluate_batch_with_cost(X, cost)
+        self._record_batch(vals, cost, X, wait_time)
+        self.cost_spent += cost * len(X)
+        return vals
+
+    def record(self,
+               x: numpy.ndarray,
+               val: float,
+               cost: Optional[float]=None) -> None:
+        """Record an evaluation performed by a copy of the black box.
+
+        This updates the state as if the point had been evaluated, for
+        evaluations performed elsewhere, such as in another process. No wait
+        time is recorded.
+
+        Args:
+            x: The point that was evaluated.
+            val: The function value.
+            cost: The cost of the evaluation, or None if it had no cost.
+        """
+        self._time_of_last_query = time.time()
+        self.function_values.append(
+                (val, cost, x if self._save_x_vals else None),
+                None,
+                self._time_of_last_query)
+        self._update_best(val, x)
+        if cost is not None:
+            self.cost_spent += cost
+
+    def _check_budget(self, num_evaluations: int) -> None:
+        """Raise an error if the evaluations would exceed the budget."""
+        if (self.max_evaluations is not None and
+                self.num_evaluations + num_evaluations > self.max_evaluations):
+            raise EvaluationBudgetExhausted(
+                    'The budget of {} evaluations is exhausted.'.format(
+                        self.max_evaluations))
+
+    def _check_batch_budget(
+            self,
+            X: numpy.ndarray,
+            evaluate_batch: Callable[[numpy.ndarray], numpy.ndarray]
+            ) -> None:
+        """Raise an error if a batch would exceed the budget, after
+        evaluating the points of the batch that fit in it."""
+        if self.max_evaluations is None:
+            return
+        num_remaining = self.max_evaluations - self.num_evaluations
+        if 0 < num_remaining < len(X):
+            _ = evaluate_batch(X[:num_remaining])
+        self._check_budget(len(X))
+
+    def _update_best(self, val: float, x: numpy.ndarray) -> None:
+        if self.best_value is None or val < self.best_value:
+            self.best_value = val
+            self.best_point = numpy.array(x)
+
+    def _wait_time(self) -> Optional[float]:
+        """The time elapsed since the last query, if any.
+
+        It is recorded as the 'optimizer' span of the active profiler.
+        """
+        if self._time_of_last_query is None:
+            return None
+        wait_time = time.time() - self._time_of_last_query
+        profiling.current_profiler().record(
+                'optimizer', self._time_of_last_query, wait_time)
+        return wait_time
+
+    def _record(self,
+                val: float,
+                cost: Optional[float],
+                x: numpy.ndarray,
+                wait_time: Optional[float]) -> None:
+        self._time_of_last_query = time.time()
+        self.function_values.append(
+                (val, cost, x if self._save_x_vals else None),
+                wait_time,
+                self._time_of_last_query)
+        self._update_best(val, x)
+
+    def _record_batch(self,
+                      vals: numpy.ndarray,
+                      cost: Optional[float],
+                      X: numpy.ndarray,
+                      wait_time: Optional[float]) -> None:
+        self._time_of_last_query = time.time()
+        if not len(X):
+            return
+        # The points of a batch are queried at the same time
+        wait_times = numpy.zeros(len(X))
+        wait_times[0] = numpy.nan if wait_time is None else wait_time
+        self.function_values.append_batch(
+                vals,
+                cost,
+                X if self._save_x_vals else None,
+                wait_times,
+                self._time_of_last_query)
+        best_index = int(numpy.argmin(vals))
+        self._update_best(vals[best_index], X[best_index])
@@ -13,7 +13,12 @@
 import numpy
 import pytest
 
-from openfermioncirq.optimization.black_box import BlackBox, StatefulBlackBox
+from openfermioncirq.optimization import FunctionValueBuffer
+from openfermioncirq.optimization.black_box import (
+        BlackBox,
+        EvaluationBudgetExhausted,
+        EvaluationCache,
+        StatefulBlackBox)
 from openfermioncirq.testing import (
         ExampleBlackBox,
         ExampleBlackBoxNoisy,
@@ -41,6 +46,24 @@ def test_black_box_evaluate_with_cost():
     assert 5.0 < noisy_val < 6.0
 
 
+def test_black_box_evaluate_batch():
+    black_box = ExampleBlackBox()
+    X = numpy.array([[1.0, 2.0], [0.0, 3.0]])
+    numpy.testing.assert_allclose(black_box.evaluate_batch(X), [5.0, 9.0])
+    numpy.testing.assert_allclose(
+            black_box.evaluate_batch_with_cost(X, 1.0), [5.0, 9.0])
+
+    black_box = ExampleBlackBox(cost_of_evaluate=1.0)
+    numpy.testing.assert_allclose(black_box.evaluate_batch(X), [5.0, 9.0])
+
+
+def test_black_box_evaluate_with_gradient_not_implemented():
+    black_box = ExampleBlackBox()
+    assert not black_box.has_gradient
+    with pytest.raises(NotImplementedError):
+        _ = black_box.evaluate_with_gradient(numpy.array([1.0, 2.0]))
+
+
 def test_black_box_noise_bounds():
     black_box = ExampleBlackBox()
     assert black_box.noise_bounds(100) == (-numpy.inf, numpy.inf)
@@ -142,3 +165,155 @@ def test_stateful_black_box_is_abstract_can_implement():
             pass
 
     assert isinstance(Included(), StatefulBlackBox)
+
+
+def test_stateful_black_box_evaluate_batch():
+    stateful_black_box = ExampleStatefulBlackBox(save_x_vals=True)
+    X = numpy.random.randn(3, 2)
+    vals = stateful_black_box.evaluate_batch(X)
+    numpy.testing.assert_allclose(vals, numpy.sum(X**2, axis=1))
+    _ = stateful_black_box.evaluate_batch_with_cost(X[:2], 2.0)
+
+    assert stateful_black_box.num_evaluations == 5
+    assert stateful_black_box.cost_spent == 4.0
+    y, z, x = stateful_black_box.function_values[1]
+    assert y == vals[1]
+    assert z is None
+    numpy.testing.assert_allclose(x, X[1])
+    assert stateful_black_box.function_values[4][1] == 2.0
+
+    assert len(stateful_black_box.wait_times) == 4
+    assert stateful_black_box.wait_times[0] == 0.0
+    assert stateful_black_box.wait_times[1] == 0.0
+    assert stateful_black_box.wait_times[3] == 0.0
+
+    stateful_black_box = ExampleStatefulBlackBox(cost_of_evaluate=1.0)
+    _ = stateful_black_box.evaluate_batch(X)
+    assert stateful_black_box.cost_spent == 3.0
+    assert len(stateful_black_box.wait_times) == 2
+
+
+def test_stateful_black_box_function_value_buffer():
+    stateful_black_box = ExampleStatefulBlackBox(
+            save_x_vals=True,
+            function_values=FunctionValueBuffer(max_length=3))
+    X = numpy.random.randn(4, 2)
+    _ = stateful_black_box.evaluate(X[0])
+    _ = stateful_black_box.evaluate_batch_with_cost(X[1:], 2.0)
+    _ = stateful_black_box.evaluate_batch(X[:0])
+
+    assert stateful_black_box.num_evaluations == 4
+    assert len(stateful_black_box.function_values) == 3
+    numpy.testing.assert_allclose(stateful_black_box.function_values.x_vals,
+                                  X[1:])
+    numpy.testing.assert_equal(stateful_black_box.wait_times[1:], [0.0, 0.0])
+    assert len(stateful_black_box.wait_times) == 3
+
+
+def test_stateful_black_box_max_evaluations():
+    stateful_black_box = ExampleStatefulBlackBox(max_evaluations=4)
+    assert stateful_black_box.best_value is None
+    _ = stateful_black_box.evaluate(numpy.array([1.0, 1.0]))
+    _ = stateful_black_box.evaluate_batch(numpy.array([[2.0, 0.0],
+                                                       [0.5, 0.0]]))
+    assert stateful_black_box.best_value == 0.25
+    numpy.testing.assert_allclose(stateful_black_box.best_point, [0.5, 0.0])
+
+    # Of a batch that doesn't fit in the budget, the points that fit are
+    # evaluated
+    with pytest.raises(EvaluationBudgetExhausted):
+        _ = stateful_black_box.evaluate_batch(numpy.array([[0.1, 0.0],
+                                                           [0.0, 0.0]]))
+    assert stateful_black_box.num_evaluations == 4
+    assert stateful_black_box.best_value == pytest.approx(0.01)
+    numpy.testing.assert_allclose(stateful_black_box.best_point, [0.1, 0.0])
+    for evaluate in [
+            stateful_black_box.evaluate,
+            lambda x: stateful_black_box.evaluate_with_cost(x, 1.0),
+            lambda x: stateful_black_box.evaluate_batch(numpy.array([x])),
+            lambda x: stateful_black_box.evaluate_batch_with_cost(
+                numpy.array([x]), 1.0)]:
+        with pytest.raises(EvaluationBudgetExhausted):
+            _ = evaluate(numpy.zeros(2))
+    assert stateful_black_box.num_evaluations == 4
+
+    # Recorded evaluations are never refused
+    stateful_black_box.record(numpy.zeros(2), 0.0)
+    assert stateful_black_box.num_evaluations == 5
+    assert stateful_black_box.best_value == 0.0
+
+    stateful_black_box = ExampleStatefulBlackBox(max_evaluations=2)
+    with pytest.raises(EvaluationBudgetExhausted):
+        _ = stateful_black_box.evaluate_batch_with_cost(numpy.ones((3, 2)),
+                                                        2.0)
+    assert stateful_black_box.num_evaluations == 2
+    assert stateful_black_box.cost_spent == 4.0
+    assert stateful_black_box.best_value is not None
+
+
+def test_evaluation_cache():
+    cache = EvaluationCache(2)
+    calls = []
+
+    def function(x):
+        calls.append(x)
+        return numpy.sum(x)
+
+    a, b, c = numpy.eye(3)
+    assert cache.evaluate(a, function) == 1.0
+    assert cache.evaluate(a.copy(), function) == 1.0
+    assert cache.evaluate(b, function) == 1.0
+    assert cache.evaluate(a, function) == 1.0
+    # c evicts b, the least recently used point
+    assert cache.evaluate(c, function) == 1.0
+    assert cache.evaluate(b, function) == 1.0
+    assert len(calls) == 4
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    def batch_function(X):
+        calls.append(X)
+        return numpy.sum(X, axis=1)
+
+    vals = cache.evaluate_batch(numpy.array([b, 2 * a, c]), batch_function)
+    numpy.testing.assert_allclose(vals, [1.0, 2.0, 1.0])
+    numpy.testing.assert_allclose(calls[-1], [2 * a])
+    assert (cache.hits, cache.misses) == (4, 5)
+
+
+def test_stateful_black_box_cache():
+    stateful_black_box = ExampleStatefulBlackBox(cache_size=10)
+    x = numpy.array([1.0, 2.0])
+    assert stateful_black_box.evaluate(x) == 5.0
+    assert stateful_black_box.evaluate(x.copy()) == 5.0
+    _ = stateful_black_box.evaluate_with_cost(x, 1.0)
+    numpy.testing.assert_allclose(
+            stateful_black_box.evaluate_batch(numpy.array([x, 2 * x])),
+            [5.0, 20.0])
+
+    assert stateful_black_box.num_evaluations == 5
+    assert stateful_black_box.cache.hits == 2
+    assert stateful_black_box.cache.misses == 2
+    assert ExampleStatefulBlackBox().cache is None
+
+
+def test_stateful_black_box_evaluate_with_gradient():
+
+    class GradientStatefulBlackBox(ExampleStatefulBlackBox):
+
+        @property
+        def has_gradient(self):
+            return True
+
+        def _evaluate_with_gradient(self, x):
+            return numpy.sum(x**2), 2 * x
+
+    stateful_black_box = GradientStatefulBlackBox(save_x_vals=True)
+    x = numpy.array([1.0, 2.0])
+    _ = stateful_black_box.evaluate(x)
+    val, gradient = stateful_black_box.evaluate_with_gradient(x)
+    assert val == 5.0
+    numpy.testing.assert_allclose(gradient, [2.0, 4.0])
+    assert stateful_black_box.num_evaluations == 2
+    assert stateful_black_box.function_values[1][0] == 5.0
+    assert len(stateful_black_box.wait_times) == 1
@@ -0,0 +1,252 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""The covariance matrix adaptation evolution strategy."""
+
+from typing import Optional, Tuple
+
+import numpy
+
+from openfermioncirq.optimization.algorithm import (
+        OptimizationAlgorithm, bounds_arrays)
+from openfermioncirq.optimization.black_box import BlackBox
+from openfermioncirq.optimization.result import OptimizationResult
+
+
+class CMAES(OptimizationAlgorithm):
+    """The covariance matrix adaptation evolution strategy (CMA-ES).
+
+    Each generation samples a population of points from a multivariate
+    normal distribution and evaluates them with a single call to the black
+    box's `evaluate_batch` method, so black boxes that evaluate batches in
+    parallel, as well as `optimize_in_parallel`, evaluate a whole generation
+    at once. The distribution's mean moves towards the best points of each
+    generation and its covariance adapts to the shape of the objective
+    function. See N. Hansen, "The CMA Evolution Strategy: A Tutorial",
+    arXiv:1604.00772.
+
+    If the black box has a cost of evaluation, every point is evaluated with
+    that cost. Since the best of many noisy values is biased downwards, the
+    final mean of the distribution is then evaluated once more and returned
+    as the optimal point instead of the best point that was sampled.
+
+    Points are clipped to the bounds of the black box before they are
+    evaluated. Among points with equal values, the ones that were clipped
+    less are preferred, which draws the distribution back inside the bounds.
+
+    If an `initial_guess_array` is given, its rows are evaluated as the
+    first batch; the mean starts at the best of them and, if there are
+    several rows, the initial step size is their average spread along each
+    coordinate. Otherwise, the initial mean of the distribution is
+    `initial_guess`, and without either, the center of the bounds.
+
+    The options are:
+        sigma: The initial step size, which is used if it cannot be
+            determined from `initial_guess_array`. Default 0.5.
+        population_size: The number of points in each generation. Defaults
+            to 4 + floor(3 log(dimension)).
+        maxfev: The maximum number of evaluations. Default 1000.
+        ftol: Stop when the values of a generation differ by less than this.
+            Default 1e-11.
+        xtol: Stop when the step size along every axis of the distribution
+            is less than this. Default 1e-11.
+        seed: A seed for the random number generator. By default, numpy's
+            global random number generator is used.
+    """
+
+    def default_options(self):
+        return {'sigma': 0.5,
+                'population_size': None,
+                'maxfev': 1000,
+                'ftol': 1e-11,
+                'xtol': 1e-11,
+                'seed': None}
+
+    def optimize(self,
+                 black_box: BlackBox,
+                 initial_guess: Optional[numpy.ndarray]=None,
+                 initial_guess_array: Optional[numpy.ndarray]=None
+                 ) -> OptimizationResult:
+        options = self.default_options()
+        options.update(self.options)
+        seed = options['seed']
+        random_state = (numpy.random if seed is None
+                        else numpy.random.RandomState(seed))
+        lower, upper = bounds_arrays(black_box.bounds, black_box.dimension)
+
+        def evaluate(X: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+            """Evaluate the clipped points and return the values and the
+            squared distances that the points were clipped by."""
+            clipped = numpy.clip(X, lower, upper)
+            return (numpy.asarray(black_box.evaluate_batch(clipped)),
+                    numpy.sum((X - clipped)**2, axis=1))
+
+        state = _CMAState(black_box.dimension,
+                          options['population_size'],
+                          options['sigma'])
+        num_evaluations = 0
+        best_value = numpy.inf
+        best_point = None  # type: Optional[numpy.ndarray]
+
+        if initial_guess_array is not None:
+            initial_guess_array = numpy.array(initial_guess_array,
+                                              dtype=float)
+            vals, _ = evaluate(initial_guess_array)
+            num_evaluations += len(vals)
+            best_index = int(numpy.argmin(vals))
+            best_value = vals[best_index]
+            best_point = numpy.clip(initial_guess_array[best_index],
+                                    lower, upper)
+            state.mean = initial_guess_array[best_index].copy()
+            spread = numpy.mean(numpy.std(initial_guess_array, axis=0))
+            if len(initial_guess_array) > 1 and spread > 0:
+                state.sigma = spread
+        elif initial_guess is not None:
+            state.mean = numpy.array(initial_guess, dtype=float)
+        elif numpy.all(numpy.isfinite(lower)) and numpy.all(
+                numpy.isfinite(upper)):
+            state.mean = (lower + upper) / 2
+        else:
+            raise ValueError('CMA-ES requires an initial guess or finite '
+                             'bounds.')
+
+        # Leave room for the final evaluation of the mean of noisy values
+        max_evaluations = options['maxfev']
+        if black_box.cost_of_evaluate is not None:
+            max_evaluations -= 1
+        status = 1
+        message = 'Maximum number of evaluations reached.'
+        while num_evaluations + state.population_size <= max_evaluations:
+            X, Y = state.sample(random_state)
+            vals, clipping = evaluate(X)
+            num_evaluations += len(vals)
+            # Sort by value, then by how much the point was clipped
+            order = numpy.lexsort((clipping, vals))
+            if vals[order[0]] < best_value:
+                best_value = vals[order[0]]
+                best_point = numpy.clip(X[order[0]], lower, upper)
+            state.update(Y[order])
+            if vals[order[-1]] - vals[order[0]] < options['ftol']:
+                status = 0
+                message = 'The values of a generation converged.'
+                break
+            if state.sigma * numpy.max(state.axis_lengths) < options['xtol']:
+                status = 0
+                message = 'The step size converged.'
+                break
+            if not state.well_conditioned:
+                status = 2
+                message = 'The covariance matrix became ill-conditioned.'
+                break
+
+        if black_box.cost_of_evaluate is not None or best_point is None:
+            best_point = numpy.clip(state.mean, lower, upper)
+            best_value = black_box.evaluate(best_point)
+            num_evaluations += 1
+
+        return OptimizationResult(optimal_value=best_value,
+                                  optimal_parameters=best_point,
+                                  num_evaluations=num_evaluations,
+                                  status=status,
+                                  message=message)
+
+
+class _CMAState:
+    """The search distribution of CMA-ES and its evolution paths."""
+
+    def __init__(self,
+                 dimension: int,
+                 population_size: Optional[int],
+                 sigma: float) -> None:
+        n = dimension
+        if population_size is None:
+            population_size = 4 + int(3 * numpy.log(n))
+        self.population_size = population_size
+        self.mean = numpy.zeros(n)
+        self.sigma = sigma
+
+        self.num_parents = population_size // 2
+        weights = (numpy.log(self.num_parents + 0.5)
+                   - numpy.log(numpy.arange(1, self.num_parents + 1)))
+        self.weights = weights / numpy.sum(weights)
+        mueff = 1 / numpy.sum(self.weights**2)
+        self.mueff = mueff
+
+        self.cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+        self.cs = (mueff + 2) / (n + mueff + 5)
+        self.c1 = 2 / ((n + 1.3)**2 + mueff)
+        self.cmu = min(1 - self.c1,
+                       2 * (mueff - 2 + 1 / mueff) / ((n + 2)**2 + mueff))
+        self.damps = (1 + 2 * max(0, numpy.sqrt((mueff - 1) / (n + 1)) - 1)
+                      + self.cs)
+        # The expected norm of a standard normal vector
+        self.chi_n = numpy.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n**2))
+
+        self.pc = numpy.zeros(n)
+        self.ps = numpy.zeros(n)
+        self.covariance = numpy.eye(n)
+        self.axes = numpy.eye(n)
+        self.axis_lengths = numpy.ones(n)
+        self.generation = 0
+
+    @property
+    def well_conditioned(self) -> bool:
+        return (numpy.min(self.axis_lengths) > 0 and
+                numpy.max(self.axis_lengths) / numpy.min(self.axis_lengths)
+                < 1e7)
+
+    def sample(self, random_state) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Sample a generation.
+
+        Returns:
+            The points of the generation and their displacements from the
+            mean divided by the step size.
+        """
+        Z = random_state.randn(self.population_size, len(self.mean))
+        Y = (Z * self.axis_lengths).dot(self.axes.T)
+        return self.mean + self.sigma * Y, Y
+
+    def update(self, Y: numpy.ndarray) -> None:
+        """Update the distribution from displacements sorted best first."""
+        n = len(self.mean)
+        self.generation += 1
+        Y_parents = Y[:self.num_parents]
+        y_w = self.weights.dot(Y_parents)
+        self.mean = self.mean + self.sigma * y_w
+
+        # C^(-1/2) y_w
+        whitened = self.axes.dot(self.axes.T.dot(y_w) / self.axis_lengths)
+        self.ps = ((1 - self.cs) * self.ps
+                   + numpy.sqrt(self.cs * (2 - self.cs) * self.mueff)
+                   * whitened)
+        ps_norm = numpy.linalg.norm(self.ps)
+        hsig = (ps_norm
+                / numpy.sqrt(1 - (1 - self.cs)**(2 * self.generation))
+                / self.chi_n) < 1.4 + 2 / (n + 1)
+        self.pc = ((1 - self.cc) * self.pc
+                   + hsig * numpy.sqrt(self.cc * (2 - self.cc) * self.mueff)
+                   * y_w)
+
+        rank_mu = (Y_parents.T * self.weights).dot(Y_parents)
+        self.covariance = (
+                (1 - self.c1 - self.cmu
+                 + (1 - hsig) * self.c1 * self.cc * (2 - self.cc))
+                * self.covariance
+                + self.c1 * numpy.outer(self.pc, self.pc)
+                + self.cmu * rank_mu)
+        self.sigma *= numpy.exp(
+                (self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+
+        # Keep the covariance symmetric and decompose it for sampling
+        self.covariance = (self.covariance + self.covariance.T) / 2
+        eigenvalues, self.axes = numpy.linalg.eigh(self.covariance)
+        self.axis_lengths = numpy.sqrt(numpy.maximum(eigenvalues, 0))
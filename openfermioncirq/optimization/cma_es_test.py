@@ -0,0 +1,116 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import pytest
+
+from openfermioncirq.optimization import CMAES, optimize_in_parallel
+from openfermioncirq.testing import (
+        ExampleBlackBoxNoisy,
+        ExampleStatefulBlackBox)
+
+
+class RosenbrockBlackBox(ExampleStatefulBlackBox):
+
+    def __init__(self, bounds=None, **kwargs):
+        self._bounds = bounds
+        self.batch_sizes = []
+        super().__init__(**kwargs)
+
+    @property
+    def dimension(self):
+        return 4
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    def _evaluate(self, x):
+        raise AssertionError('Points should be evaluated in batches.')
+
+    def _evaluate_batch(self, X):
+        self.batch_sizes.append(len(X))
+        return numpy.sum(100 * (X[:, 1:] - X[:, :-1]**2)**2
+                         + (1 - X[:, :-1])**2, axis=1)
+
+
+def test_cma_es_minimizes_rosenbrock():
+    black_box = RosenbrockBlackBox()
+    algorithm = CMAES(options={'seed': 1, 'maxfev': 10000})
+    result = algorithm.optimize(black_box, numpy.zeros(4))
+
+    assert result.status == 0
+    assert result.optimal_value == pytest.approx(0.0, abs=1e-8)
+    numpy.testing.assert_allclose(result.optimal_parameters, numpy.ones(4),
+                                  atol=1e-4)
+    assert result.num_evaluations == black_box.num_evaluations
+    # Each generation is one batch
+    assert set(black_box.batch_sizes) == {4 + int(3 * numpy.log(4))}
+
+
+def test_cma_es_is_reproducible():
+    results = [CMAES(options={'seed': 3, 'maxfev': 200}).optimize(
+                   RosenbrockBlackBox(), numpy.zeros(4))
+               for _ in range(2)]
+    assert results[0].optimal_value == results[1].optimal_value
+    assert results[0].num_evaluations <= 200
+    assert results[0].status == 1
+
+
+def test_cma_es_respects_bounds():
+    bounds = [(-1.0, 0.5)] * 4
+    black_box = RosenbrockBlackBox(bounds=bounds, save_x_vals=True)
+    result = CMAES(options={'seed': 2}).optimize(black_box)
+    X = numpy.array([x for _, _, x in black_box.function_values])
+    assert numpy.all(X >= -1.0) and numpy.all(X <= 0.5)
+    assert numpy.all(result.optimal_parameters <= 0.5)
+
+
+def test_cma_es_initial_guess_array():
+    black_box = RosenbrockBlackBox()
+    initial_guess_array = numpy.array([[5.0, 5.0, 5.0, 5.0],
+                                       [0.9, 0.8, 0.6, 0.4],
+                                       [-3.0, 2.0, 0.0, 1.0]])
+    result = CMAES(options={'seed': 0, 'maxfev': 3}).optimize(
+            black_box, initial_guess_array=initial_guess_array)
+    assert black_box.batch_sizes[0] == 3
+    numpy.testing.assert_allclose(result.optimal_parameters,
+                                  initial_guess_array[1])
+
+    # The array takes precedence over the initial guess
+    black_box = RosenbrockBlackBox()
+    result = CMAES(options={'seed': 0, 'maxfev': 3}).optimize(
+            black_box, numpy.zeros(4), initial_guess_array)
+    assert black_box.batch_sizes[0] == 3
+    numpy.testing.assert_allclose(result.optimal_parameters,
+                                  initial_guess_array[1])
+
+    with pytest.raises(ValueError):
+        _ = CMAES().optimize(black_box)
+
+
+def test_cma_es_noisy():
+    numpy.random.seed(0)
+    black_box = ExampleBlackBoxNoisy(cost_of_evaluate=100.0)
+    algorithm = CMAES(options={'maxfev': 500, 'population_size': 20})
+    result = algorithm.optimize(black_box, numpy.array([1.0, -1.0]))
+    assert result.num_evaluations == 481
+    # The final mean is returned rather than a lucky sample
+    assert numpy.sum(result.optimal_parameters**2) < 0.01
+
+
+def test_cma_es_in_parallel():
+    black_box = ExampleStatefulBlackBox()
+    result = optimize_in_parallel(CMAES(options={'seed': 0, 'maxfev': 60}),
+                                  black_box, numpy.ones(2), max_in_flight=2)
+    assert black_box.num_evaluations == result.num_evaluations == 60
+    assert result.optimal_value < 0.1
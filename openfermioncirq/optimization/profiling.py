@@ -0,0 +1,265 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Timing of the phases of black box evaluations.
+
+Code that evaluates black boxes marks its phases with named spans::
+
+    with profiling.span('simulate'):
+        final_state = ...
+
+The time spent in each span is recorded by the profiler that is active in
+the current thread, which is set with `profiling.profile`. When no profiler
+is active, which is the default, a span does nothing and costs less than
+a microsecond.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+import numpy
+
+
+# Durations shorter than 2**_MIN_EXPONENT seconds share the smallest bin
+_MIN_EXPONENT = -30
+
+
+class SpanHistogram:
+    """The durations of a span, aggregated into logarithmic bins.
+
+    The bin with exponent e counts the durations between 2**(e - 1) and 2**e
+    seconds.
+
+    Attributes:
+        count: The number of durations.
+        total: The sum of the durations, in seconds.
+        min: The shortest duration.
+        max: The longest duration.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self._bins = {}  # type: Dict[int, int]
+
+    def add(self, duration: float) -> None:
+        """Add a duration, in seconds."""
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        # A duration d lies in the bin whose exponent frexp returns
+        exponent = (max(math.frexp(duration)[1], _MIN_EXPONENT)
+                    if duration > 0 else _MIN_EXPONENT)
+        self._bins[exponent] = self._bins.get(exponent, 0) + 1
+
+    def merge(self, other: 'SpanHistogram') -> None:
+        """Add the durations of another histogram to this one."""
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for exponent, count in other._bins.items():
+            self._bins[exponent] = self._bins.get(exponent, 0) + count
+
+    @property
+    def mean(self) -> float:
+        """The mean duration, or NaN if there are none."""
+        return self.total / self.count if self.count else math.nan
+
+    def histogram(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """The counts of the bins and their edges, as from numpy.histogram.
+
+        The bins cover the range of the durations, including empty bins
+        in between.
+        """
+        if not self._bins:
+            return numpy.zeros(0, dtype=int), numpy.zeros(0)
+        exponents = numpy.arange(min(self._bins), max(self._bins) + 1)
+        counts = numpy.array([self._bins.get(e, 0) for e in exponents])
+        edges = numpy.ldexp(1.0, numpy.append(exponents - 1, exponents[-1]))
+        return counts, edges
+
+    def __repr__(self) -> str:
+        return 'SpanHistogram(count={}, mean={:.3g}s)'.format(
+                self.count, self.mean)
+
+
+class Profiler:
+    """Records the time spent in named spans.
+
+    The durations of each span are aggregated into a SpanHistogram. The
+    individual spans can also be kept as events for a timeline.
+
+    Attributes:
+        histograms: A dictionary from span names to SpanHistograms.
+        events: The recorded spans as tuples (name, start, duration, thread
+            id), if events are recorded. Times are in seconds since the
+            epoch, so that the timelines of different processes line up.
+    """
+
+    enabled = True
+
+    def __init__(self, record_events: bool=False) -> None:
+        """
+        Args:
+            record_events: Whether to keep each span as an event, in
+                addition to the histograms, for `export_chrome_trace`.
+        """
+        self.record_events = record_events
+        self.histograms = {}  # type: Dict[str, SpanHistogram]
+        self.events = []  # type: List[Tuple[str, float, float, int]]
+
+    def span(self, name: str) -> '_Span':
+        """A context manager that records the time spent in it."""
+        return _Span(self, name)
+
+    def record(self, name: str, start: float, duration: float) -> None:
+        """Record a span that started at `start` and lasted `duration`."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = SpanHistogram()
+        histogram.add(duration)
+        if self.record_events:
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def chrome_trace_events(self) -> List[Dict[str, Union[str, int, float]]]:
+        """The events in the Trace Event Format of Chrome's trace viewer."""
+        pid = os.getpid()
+        return [{'name': name,
+                 'ph': 'X',
+                 'ts': start * 1e6,
+                 'dur': duration * 1e6,
+                 'pid': pid,
+                 'tid': tid}
+                for name, start, duration, tid in self.events]
+
+    def export_chrome_trace(self, filename: str) -> None:
+        """Append the events to a trace file and forget them.
+
+        The file holds a JSON array of events that can be opened with
+        chrome://tracing or Perfetto. The array is left unterminated, which
+        the viewers accept, so that a process can keep appending events to
+        its file and the file stays readable if the process is interrupted.
+        """
+        lines = [json.dumps(event) + ',\n'
+                 for event in self.chrome_trace_events()]
+        with _export_lock, open(filename, 'a') as f:
+            if not f.tell():
+                f.write('[\n')
+            f.writelines(lines)
+        self.events = []
+
+
+class _Span:
+    __slots__ = ('_profiler', '_name', '_start', '_counter')
+
+    def __init__(self, profiler: Profiler, name: str) -> None:
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self) -> None:
+        # The wall clock time places the span in a timeline, while the
+        # duration is measured with the monotonic, high-resolution counter
+        self._start = time.time()
+        self._counter = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._profiler.record(self._name, self._start,
+                              time.perf_counter() - self._counter)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class _NullProfiler:
+    """The profiler of threads without an active profiler."""
+
+    enabled = False
+
+    def span(self, name: str) -> _NullSpan:
+        return _NULL_SPAN
+
+    def record(self, name: str, start: float, duration: float) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_NULL_PROFILER = _NullProfiler()
+
+
+class _Local(threading.local):
+    # A class attribute, so that threads without an active profiler find the
+    # null profiler without raising and catching an AttributeError
+    profiler = _NULL_PROFILER  # type: Union[Profiler, _NullProfiler]
+
+
+_local = _Local()
+
+# Serializes the profilers of different threads appending to a trace file
+_export_lock = threading.Lock()
+
+
+def current_profiler() -> Union[Profiler, _NullProfiler]:
+    """The profiler that is active in the current thread.
+
+    If no profiler is active, a profiler that records nothing is returned.
+    """
+    return _local.profiler
+
+
+def span(name: str) -> Union[_Span, _NullSpan]:
+    """A context manager that records the time spent in it with the
+    profiler that is active in the current thread."""
+    return _local.profiler.span(name)
+
+
+@contextlib.contextmanager
+def profile(profiler: Optional[Profiler]) -> Iterator[None]:
+    """Make a profiler active in the current thread.
+
+    Args:
+        profiler: The profiler to activate, or None to record nothing.
+    """
+    previous = _local.profiler
+    _local.profiler = profiler or _NULL_PROFILER
+    try:
+        yield
+    finally:
+        _local.profiler = previous
+
+
+def merge_histograms(profiles: Iterable[Optional[Dict[str, SpanHistogram]]]
+                     ) -> Dict[str, SpanHistogram]:
+    """Merge the histograms of several profiles by span name."""
+    merged = {}  # type: Dict[str, SpanHistogram]
+    for histograms in profiles:
+        for name, histogram in (histograms or {}).items():
+            merged.setdefault(name, SpanHistogram()).merge(histogram)
+    return merged
@@ -0,0 +1,135 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+import numpy
+import pytest
+
+from openfermioncirq.optimization import (
+        OptimizationParams,
+        OptimizationResult,
+        OptimizationTrialResult,
+        Profiler,
+        SpanHistogram,
+        profiling)
+from openfermioncirq.testing import ExampleStatefulBlackBox, LazyAlgorithm
+
+
+def test_span_histogram():
+    histogram = SpanHistogram()
+    assert numpy.isnan(histogram.mean)
+    counts, edges = histogram.histogram()
+    assert len(counts) == len(edges) == 0
+
+    for duration in [0.3, 0.4, 3.0, 0.0]:
+        histogram.add(duration)
+    assert histogram.count == 4
+    assert histogram.total == pytest.approx(3.7)
+    assert histogram.mean == pytest.approx(3.7 / 4)
+    assert histogram.min == 0.0
+    assert histogram.max == 3.0
+
+    other = SpanHistogram()
+    other.add(0.75)
+    histogram.merge(other)
+    counts, edges = histogram.histogram()
+    assert edges[0] == 2.0**-31
+    numpy.testing.assert_equal(edges[-5:], [0.25, 0.5, 1.0, 2.0, 4.0])
+    assert counts[0] == 1
+    # 0.3 and 0.4 lie in [0.25, 0.5), 0.75 in [0.5, 1) and 3.0 in [2, 4)
+    numpy.testing.assert_equal(counts[-4:], [2, 1, 0, 1])
+    assert sum(counts) == 5
+    assert 'count=5' in repr(histogram)
+
+
+def test_profiler_spans():
+    assert not profiling.current_profiler().enabled
+    with profiling.span('ignored'):
+        pass
+
+    profiler = Profiler(record_events=True)
+    with profiling.profile(profiler):
+        assert profiling.current_profiler() is profiler
+        for _ in range(3):
+            with profiling.span('outer'):
+                with profiling.span('inner'):
+                    time.sleep(0.001)
+        with pytest.raises(ValueError):
+            with profiling.span('failing'):
+                raise ValueError
+        # Other threads don't see the profiler
+        thread = threading.Thread(
+                target=lambda: profiling.span('other').__enter__())
+        thread.start()
+        thread.join()
+    assert not profiling.current_profiler().enabled
+
+    assert set(profiler.histograms) == {'outer', 'inner', 'failing'}
+    assert profiler.histograms['inner'].count == 3
+    assert profiler.histograms['inner'].min >= 0.001
+    assert (profiler.histograms['outer'].total
+            >= profiler.histograms['inner'].total)
+    assert [event[0] for event in profiler.events[:2]] == ['inner', 'outer']
+
+
+def test_profiler_export_chrome_trace(tmpdir):
+    filename = os.path.join(str(tmpdir), 'trace.json')
+    profiler = Profiler(record_events=True)
+    profiler.record('a', 10.0, 0.5)
+    profiler.export_chrome_trace(filename)
+    assert not profiler.events
+    profiler.record('b', 11.0, 0.25)
+    profiler.export_chrome_trace(filename)
+
+    with open(filename) as f:
+        text = f.read()
+    # The unterminated array is completed to parse it
+    events = json.loads(text.rstrip().rstrip(',') + ']')
+    assert [event['name'] for event in events] == ['a', 'b']
+    assert events[0]['ph'] == 'X'
+    assert events[0]['ts'] == 10.0e6
+    assert events[1]['dur'] == 0.25e6
+    assert events[0]['pid'] == os.getpid()
+
+    # Events are only kept on request
+    profiler = Profiler()
+    profiler.record('a', 0.0, 1.0)
+    assert not profiler.events
+    assert profiler.histograms['a'].count == 1
+
+
+def test_profiler_records_optimizer_time():
+    black_box = ExampleStatefulBlackBox()
+    profiler = Profiler()
+    with profiling.profile(profiler):
+        for _ in range(3):
+            _ = black_box.evaluate(numpy.zeros(2))
+    assert profiler.histograms['optimizer'].count == 2
+
+
+def test_trial_result_profile():
+    histograms = []
+    for duration in [1.0, 2.0]:
+        histogram = SpanHistogram()
+        histogram.add(duration)
+        histograms.append({'simulate': histogram})
+    results = [OptimizationResult(0.0, numpy.zeros(2), profile=profile)
+               for profile in histograms + [None]]
+    trial_result = OptimizationTrialResult(
+            results, OptimizationParams(LazyAlgorithm()))
+    profile = trial_result.profile
+    assert profile['simulate'].count == 2
+    assert profile['simulate'].total == 3.0
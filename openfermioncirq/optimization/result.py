@@ -12,11 +12,14 @@
 
 """Classes for storing the results of running an optimization algorithm."""
 
-from typing import Iterable, List, Optional, TYPE_CHECKING, Tuple
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING, Tuple
 
 import numpy
 import pandas
 
+from openfermioncirq.optimization.profiling import (
+        SpanHistogram, merge_histograms)
+
 if TYPE_CHECKING:
     # pylint: disable=unused-import
     from openfermioncirq.optimization.algorithm import OptimizationParams
@@ -39,14 +42,23 @@ class OptimizationResult:
             value, the second is the cost that was used for the evaluation
             (or None if there was no cost), and the third is the point that
             was evaluated (or None if the black box was initialized with
-            `save_x_vals` set to False).
-        wait_times: A list of floats. The i-th float float represents the time
-            elapsed between the i-th and (i+1)-th times that the black box
-            was queried. Time is recorded using ``time.time()``.
+            `save_x_vals` set to False). Results loaded from a study saved
+            with columnar traces store a FunctionValueTrace instead, which
+            behaves like the list.
+        wait_times: A 1d numpy array of floats. The i-th float represents
+            the time elapsed between the i-th and (i+1)-th times that the
+            black box was queried. Time is recorded using ``time.time()``.
         time: The time, in seconds, it took to obtain the result.
         seed: A random number generator seed used to produce the result.
         status: A status flag set by the optimizer.
         message: A message returned by the optimizer.
+        cache_hits: For black boxes with an evaluation cache, the number of
+            evaluations whose value was found in the cache.
+        cache_misses: For black boxes with an evaluation cache, the number of
+            evaluations whose value was not found in the cache.
+        profile: If the run was profiled, a dictionary from the names of the
+            timed phases of the evaluations to SpanHistograms of their
+            durations.
     """
 
     def __init__(self,
@@ -57,11 +69,14 @@ class OptimizationResult:
                  function_values: Optional[List[Tuple[
                      float, Optional[float], Optional[numpy.ndarray]
                      ]]]=None,
-                 wait_times: Optional[List[float]]=None,
+                 wait_times: Optional[numpy.ndarray]=None,
                  time: Optional[int]=None,
                  seed: Optional[int]=None,
                  status: Optional[int]=None,
-                 message: Optional[str]=None) -> None:
+                 message: Optional[str]=None,
+                 cache_hits: Optional[int]=None,
+                 cache_misses: Optional[int]=None,
+                 profile: Optional[Dict[str, SpanHistogram]]=None) -> None:
         self.optimal_value = optimal_value
         self.optimal_parameters = optimal_parameters
         self.num_evaluations = num_evaluations
@@ -72,12 +87,22 @@ class OptimizationResult:
         self.seed = seed
         self.status = status
         self.message = message
+        self.cache_hits = cache_hits
+        self.cache_misses = cache_misses
+        self.profile = profile
 
 
 class OptimizationTrialResult:
     """The results from multiple repetitions of an optimization run.
 
+    The optimal value of each repetition is kept in an array as the results
+    are added, so that the optimal value over all repetitions is available in
+    constant time. The data frame is built from the results when it is first
+    accessed after results were added.
+
     Attributes:
+        results: The OptimizationResult of each repetition.
+        optimal_values: A 1d array of the optimal value of each repetition.
         data_frame: A pandas DataFrame storing the results of each repetition
             of the optimization run. It has the following columns:
                 optimal_value: The optimal value found.
@@ -98,48 +123,106 @@ class OptimizationTrialResult:
         optimal_value: The optimal value over all repetitions of the run.
         optimal_parameters: The function parameters corresponding to the
             optimal value.
+        profile: The histograms of the profiled repetitions, merged by
+            phase.
     """
 
     def __init__(self,
                  results: Iterable[OptimizationResult],
                  params: 'OptimizationParams') -> None:
-        self.results = list(results)
+        self.results = []  # type: List[OptimizationResult]
         self.params = params
-        self.data_frame = pandas.DataFrame(
-                {'optimal_value': result.optimal_value,
-                 'optimal_parameters': result.optimal_parameters,
-                 'num_evaluations': result.num_evaluations,
-                 'cost_spent': result.cost_spent,
-                 'time': result.time,
-                 'seed': result.seed,
-                 'status': result.status,
-                 'message': result.message}
-                for result in results)
+        self._init_columns()
+        self.extend(results)
+
+    def _init_columns(self) -> None:
+        # The optimal values of the results, with spare capacity at the end
+        self._optimal_values = numpy.empty(0)
+        # The index of the result with the smallest optimal value
+        self._optimal_index = None  # type: Optional[int]
+        self._data_frame = None  # type: Optional[pandas.DataFrame]
+
+    @property
+    def data_frame(self) -> pandas.DataFrame:
+        """The results as a DataFrame, built when first accessed."""
+        if self._data_frame is None:
+            self._data_frame = pandas.DataFrame(
+                    [{'optimal_value': result.optimal_value,
+                      'optimal_parameters': result.optimal_parameters,
+                      'num_evaluations': result.num_evaluations,
+                      'cost_spent': result.cost_spent,
+                      'time': result.time,
+                      'seed': result.seed,
+                      'status': result.status,
+                      'message': result.message}
+                     for result in self.results])
+        return self._data_frame
+
+    @property
+    def optimal_values(self) -> numpy.ndarray:
+        """A 1d array of the optimal value of each repetition."""
+        return self._optimal_values[:len(self.results)]
 
     @property
     def repetitions(self) -> int:
-        return len(self.data_frame)
+        return len(self.results)
 
     @property
     def optimal_value(self) -> float:
-        return self.data_frame['optimal_value'].min()
+        if self._optimal_index is None:
+            return numpy.nan
+        return self.results[self._optimal_index].optimal_value
+
+    @property
+    def optimal_parameters(self) -> Optional[numpy.ndarray]:
+        if self._optimal_index is None:
+            return None
+        return self.results[self._optimal_index].optimal_parameters
 
     @property
-    def optimal_parameters(self) -> numpy.ndarray:
-        return self.data_frame['optimal_parameters'][
-                self.data_frame['optimal_value'].idxmin()]
+    def profile(self) -> Dict[str, SpanHistogram]:
+        # Results pickled before profiling was added have no profile
+        return merge_histograms(getattr(result, 'profile', None)
+                                for result in self.results)
 
     def extend(self,
                results: Iterable[OptimizationResult]) -> None:
-        new_data_frame = pandas.DataFrame(
-                {'optimal_value': result.optimal_value,
-                 'optimal_parameters': result.optimal_parameters,
-                 'num_evaluations': result.num_evaluations,
-                 'cost_spent': result.cost_spent,
-                 'time': result.time,
-                 'seed': result.seed,
-                 'status': result.status,
-                 'message': result.message}
-                for result in results)
-        self.data_frame = pandas.concat([self.data_frame, new_data_frame])
+        results = list(results)
+        start = len(self.results)
+        stop = start + len(results)
+        if stop > len(self._optimal_values):
+            # Grow the capacity geometrically so that extending is amortized
+            # constant time per result
+            optimal_values = numpy.empty(max(stop,
+                                             2 * len(self._optimal_values)))
+            optimal_values[:start] = self._optimal_values[:start]
+            self._optimal_values = optimal_values
+        for i, result in enumerate(results, start):
+            value = result.optimal_value
+            self._optimal_values[i] = numpy.nan if value is None else value
+            # Results with NaN optimal values are never optimal
+            if self._optimal_index is None or (
+                    self._optimal_values[i]
+                    < self._optimal_values[self._optimal_index]):
+                if not numpy.isnan(self._optimal_values[i]):
+                    self._optimal_index = i
         self.results.extend(results)
+        self._data_frame = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The data frame is rebuilt when needed
+        state['_data_frame'] = None
+        state['_optimal_values'] = self.optimal_values.copy()
+        return state
+
+    def __setstate__(self, state):
+        if '_optimal_values' in state:
+            self.__dict__.update(state)
+            return
+        # Results pickled before the optimal values were tracked store a
+        # data frame instead
+        self.params = state['params']
+        self.results = []
+        self._init_columns()
+        self.extend(state['results'])
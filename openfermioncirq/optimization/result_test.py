@@ -10,6 +10,8 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import pickle
+
 import numpy
 
 from openfermioncirq.optimization import (
@@ -136,3 +138,49 @@ def test_optimization_trial_result_data_methods():
     assert trial.optimal_value == 4.7
     numpy.testing.assert_allclose(trial.optimal_parameters,
                                   numpy.array([1.7, 2.1]))
+
+
+def test_optimization_trial_result_incremental_optimum():
+    params = OptimizationParams(ExampleAlgorithm())
+    trial = OptimizationTrialResult([], params)
+    assert trial.repetitions == 0
+    assert numpy.isnan(trial.optimal_value)
+    assert trial.optimal_parameters is None
+    assert trial.data_frame.empty
+
+    values = [3.0, numpy.nan, 1.0, 2.0, 1.0] * 20
+    for i, value in enumerate(values):
+        trial.extend([OptimizationResult(value, numpy.array([i]))])
+    assert trial.repetitions == 100
+    assert trial.optimal_value == 1.0
+    numpy.testing.assert_equal(trial.optimal_parameters, [2])
+    numpy.testing.assert_equal(trial.optimal_values, values)
+
+    data_frame = trial.data_frame
+    assert trial.data_frame is data_frame
+    assert len(data_frame) == 100
+    trial.extend([OptimizationResult(-1.0, numpy.array([100]))])
+    assert len(trial.data_frame) == 101
+    assert trial.optimal_value == -1.0
+
+
+def test_optimization_trial_result_pickle():
+    results = [OptimizationResult(value, numpy.array([value]))
+               for value in [2.0, 1.0, 3.0]]
+    params = OptimizationParams(ExampleAlgorithm())
+    trial = OptimizationTrialResult(results, params)
+    _ = trial.data_frame
+    unpickled = pickle.loads(pickle.dumps(trial))
+    assert unpickled._data_frame is None
+    assert unpickled.optimal_value == 1.0
+    unpickled.extend(results)
+    assert unpickled.repetitions == 6
+
+    # Trial results pickled with a data frame instead of optimal values
+    old_trial = OptimizationTrialResult.__new__(OptimizationTrialResult)
+    old_trial.__setstate__({'results': results,
+                            'params': params,
+                            'data_frame': trial.data_frame})
+    assert old_trial.repetitions == 3
+    assert old_trial.optimal_value == 1.0
+    numpy.testing.assert_equal(old_trial.optimal_parameters, [1.0])
@@ -12,7 +12,7 @@
 
 """A wrapper around the local optimization routines implemented in Scipy."""
 
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import numpy
 import scipy.optimize
@@ -28,7 +28,8 @@ class ScipyOptimizationAlgorithm(OptimizationAlgorithm):
     def __init__(self,
                  options: Optional[Dict]=None,
                  kwargs: Optional[Dict]=None,
-                 uses_bounds: bool=True) -> None:
+                 uses_bounds: bool=True,
+                 uses_gradient: bool=False) -> None:
         """
         Args:
             options: The `options` dictionary passed to scipy.optimize.minimize.
@@ -38,9 +39,22 @@ class ScipyOptimizationAlgorithm(OptimizationAlgorithm):
             uses_bounds: Whether the algorithm uses bounds on the input
                 variables. Set this to False to prevent scipy.optimize.minimize
                 from raising a warning if the chosen method does not use bounds.
+            uses_gradient: Whether the algorithm uses the gradient of the
+                objective function. If True and the black box can compute its
+                gradient (and has no cost of evaluation), the gradient is
+                passed to scipy.optimize.minimize as `jac`. Otherwise, unless
+                `jac` is given in `kwargs`, the gradient is estimated with
+                forward differences whose displacements are evaluated in a
+                single call to `evaluate_batch`, so that black boxes with a
+                parallel batch path compute a gradient in about the time of
+                one evaluation. The value at the point itself is reused from
+                the last evaluation if it was at the same point, so points
+                at which only the value is needed, as in line searches, cost
+                one evaluation.
         """
         self.kwargs = kwargs or {}
         self.uses_bounds = uses_bounds
+        self.uses_gradient = uses_gradient
         super().__init__(options)
 
     def optimize(self,
@@ -52,11 +66,53 @@ class ScipyOptimizationAlgorithm(OptimizationAlgorithm):
             raise ValueError('The chosen optimization algorithm requires an '
                              'initial guess.')
         bounds = black_box.bounds if self.uses_bounds else None
-        result = scipy.optimize.minimize(black_box.evaluate,
-                                         initial_guess,
-                                         bounds=bounds,
-                                         options=self.options,
-                                         **self.kwargs)
+        if (self.uses_gradient and black_box.has_gradient
+                and black_box.cost_of_evaluate is None
+                and 'jac' not in self.kwargs):
+            result = scipy.optimize.minimize(black_box.evaluate_with_gradient,
+                                             initial_guess,
+                                             jac=True,
+                                             bounds=bounds,
+                                             options=self.options,
+                                             **self.kwargs)
+        elif self.uses_gradient and 'jac' not in self.kwargs:
+            num_evaluations = [0]
+            # The last point whose value was computed, and its value
+            last_evaluation = [None, None]  # type: List[Any]
+
+            def fun(x: numpy.ndarray) -> float:
+                val = black_box.evaluate(x)
+                num_evaluations[0] += 1
+                last_evaluation[:] = [numpy.array(x), val]
+                return val
+
+            def jac(x: numpy.ndarray) -> numpy.ndarray:
+                X = _forward_difference_points(x, bounds)
+                if numpy.array_equal(last_evaluation[0], x):
+                    # Only the displacements need to be evaluated
+                    vals = numpy.concatenate(
+                            [[last_evaluation[1]],
+                             black_box.evaluate_batch(X[1:])])
+                    num_evaluations[0] += len(X) - 1
+                else:
+                    vals = black_box.evaluate_batch(X)
+                    num_evaluations[0] += len(X)
+                    last_evaluation[:] = [numpy.array(x), vals[0]]
+                return _forward_difference(X, vals)[1]
+
+            result = scipy.optimize.minimize(fun,
+                                             initial_guess,
+                                             jac=jac,
+                                             bounds=bounds,
+                                             options=self.options,
+                                             **self.kwargs)
+            result.nfev = num_evaluations[0]
+        else:
+            result = scipy.optimize.minimize(black_box.evaluate,
+                                             initial_guess,
+                                             bounds=bounds,
+                                             options=self.options,
+                                             **self.kwargs)
         return OptimizationResult(optimal_value=result.fun,
                                   optimal_parameters=result.x,
                                   num_evaluations=result.nfev,
@@ -68,16 +124,50 @@ class ScipyOptimizationAlgorithm(OptimizationAlgorithm):
         return self.kwargs.get('method', 'ScipyOptimizationAlgorithm')
 
 
+def _forward_difference_points(
+        x: numpy.ndarray,
+        bounds: Optional[Sequence[Tuple[float, float]]]) -> numpy.ndarray:
+    """The point x followed by its forward difference displacements.
+
+    The step sizes are the ones used by scipy.optimize.approx_derivative. A
+    step that would leave the bounds is taken in the opposite direction.
+    """
+    x = numpy.asarray(x, dtype=float)
+    steps = (numpy.sqrt(numpy.finfo(float).eps)
+             * numpy.where(x >= 0, 1.0, -1.0)
+             * numpy.maximum(1.0, numpy.abs(x)))
+    if bounds is not None:
+        upper = numpy.array([b[1] if b[1] is not None else numpy.inf
+                             for b in bounds])
+        lower = numpy.array([b[0] if b[0] is not None else -numpy.inf
+                             for b in bounds])
+        outside = (x + steps > upper) | (x + steps < lower)
+        steps[outside] *= -1
+    X = numpy.tile(x, (len(x) + 1, 1))
+    X[numpy.arange(1, len(x) + 1), numpy.arange(len(x))] += steps
+    return X
+
+
+def _forward_difference(X: numpy.ndarray,
+                        vals: numpy.ndarray) -> Tuple[float, numpy.ndarray]:
+    """The value at X[0] and the forward difference gradient there."""
+    # Divide by the displacements that are actually representable
+    steps = numpy.diagonal(X[1:]) - X[0]
+    return vals[0], (vals[1:] - vals[0]) / steps
+
+
 COBYLA = ScipyOptimizationAlgorithm(
         kwargs={'method': 'COBYLA'},
         uses_bounds=False)
 
 L_BFGS_B = ScipyOptimizationAlgorithm(
-        kwargs={'method': 'L-BFGS-B'})
+        kwargs={'method': 'L-BFGS-B'},
+        uses_gradient=True)
 
 NELDER_MEAD = ScipyOptimizationAlgorithm(
         kwargs={'method': 'Nelder-Mead'},
         uses_bounds=False)
 
 SLSQP = ScipyOptimizationAlgorithm(
-        kwargs={'method': 'SLSQP'})
+        kwargs={'method': 'SLSQP'},
+        uses_gradient=True)
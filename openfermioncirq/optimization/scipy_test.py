@@ -19,7 +19,7 @@ from openfermioncirq.optimization.scipy import (
         NELDER_MEAD,
         SLSQP,
         ScipyOptimizationAlgorithm)
-from openfermioncirq.testing import ExampleBlackBox
+from openfermioncirq.testing import ExampleBlackBox, ExampleStatefulBlackBox
 
 
 @pytest.mark.parametrize('algorithm', [COBYLA, L_BFGS_B, NELDER_MEAD, SLSQP])
@@ -35,6 +35,119 @@ def test_scipy_algorithm(algorithm):
     assert isinstance(result.message, (str, bytes))
 
 
+class GradientBlackBox(ExampleBlackBox):
+
+    def __init__(self, **kwargs):
+        self.gradient_evaluations = 0
+        super().__init__(**kwargs)
+
+    @property
+    def has_gradient(self):
+        return True
+
+    def _evaluate_with_gradient(self, x):
+        self.gradient_evaluations += 1
+        return numpy.sum(x**2), 2 * x
+
+
+@pytest.mark.parametrize('algorithm', [L_BFGS_B, SLSQP])
+def test_scipy_algorithm_uses_gradient(algorithm):
+    black_box = GradientBlackBox()
+    result = algorithm.optimize(black_box, numpy.array([1.0, -2.0]))
+    assert black_box.gradient_evaluations == result.num_evaluations
+    assert result.optimal_value == pytest.approx(0.0, abs=1e-8)
+
+    black_box = GradientBlackBox(cost_of_evaluate=1.0)
+    _ = algorithm.optimize(black_box, numpy.array([1.0, -2.0]))
+    assert black_box.gradient_evaluations == 0
+
+
+class BatchCountingBlackBox(ExampleStatefulBlackBox):
+
+    def __init__(self, **kwargs):
+        self.batch_sizes = []
+        super().__init__(**kwargs)
+
+    def _evaluate_batch(self, X):
+        self.batch_sizes.append(len(X))
+        return numpy.sum(X**2, axis=1)
+
+
+@pytest.mark.parametrize('algorithm', [L_BFGS_B, SLSQP])
+def test_scipy_algorithm_batches_finite_differences(algorithm):
+    black_box = BatchCountingBlackBox()
+    result = algorithm.optimize(black_box, numpy.array([1.0, -2.0]))
+    assert result.optimal_value == pytest.approx(0.0, abs=1e-8)
+    # Each gradient is one batch of the displacements, or of the point and
+    # its displacements if the point's value is not known
+    assert black_box.batch_sizes
+    assert set(black_box.batch_sizes) <= {2, 3}
+    assert black_box.num_evaluations == result.num_evaluations
+
+    black_box = ExampleStatefulBlackBox(cost_of_evaluate=2.0)
+    result = algorithm.optimize(black_box, numpy.array([1.0, -2.0]))
+    assert black_box.num_evaluations == result.num_evaluations
+    assert black_box.cost_spent == 2.0 * result.num_evaluations
+
+
+def test_scipy_algorithm_line_search_points_cost_one_evaluation():
+
+    def rosenbrock(X):
+        return numpy.sum(100 * (X[:, 1:] - X[:, :-1]**2)**2
+                         + (1 - X[:, :-1])**2, axis=1)
+
+    class RosenbrockBlackBox(BatchCountingBlackBox):
+        num_single_evaluations = 0
+
+        @property
+        def dimension(self):
+            return 6
+
+        def _evaluate(self, x):
+            self.num_single_evaluations += 1
+            return rosenbrock(numpy.array([x]))[0]
+
+        def _evaluate_batch(self, X):
+            self.batch_sizes.append(len(X))
+            return rosenbrock(X)
+
+    for algorithm in [SLSQP, L_BFGS_B]:
+        black_box = RosenbrockBlackBox()
+        result = algorithm.optimize(black_box, numpy.zeros(6))
+        assert result.optimal_value < 1e-6
+        assert result.num_evaluations == black_box.num_evaluations
+        # The value at each point is computed once, and the gradients only
+        # evaluate the displacements
+        assert set(black_box.batch_sizes) == {6}
+        assert black_box.num_evaluations == (
+                black_box.num_single_evaluations
+                + 6 * len(black_box.batch_sizes))
+
+
+def test_scipy_algorithm_finite_differences_respect_bounds():
+
+    class BoundedBlackBox(BatchCountingBlackBox):
+
+        @property
+        def bounds(self):
+            return [(1.0, 2.0), (-3.0, 0.0)]
+
+        def _evaluate_batch(self, X):
+            assert numpy.all(X[:, 0] >= 1.0) and numpy.all(X[:, 0] <= 2.0)
+            assert numpy.all(X[:, 1] >= -3.0) and numpy.all(X[:, 1] <= 0.0)
+            return super()._evaluate_batch(X)
+
+    result = L_BFGS_B.optimize(BoundedBlackBox(), numpy.array([2.0, 0.0]))
+    numpy.testing.assert_allclose(result.optimal_parameters, [1.0, 0.0],
+                                  atol=1e-6)
+
+
+def test_scipy_algorithm_ignores_gradient():
+    black_box = GradientBlackBox()
+    _ = COBYLA.optimize(black_box, numpy.array([1.0, -2.0]))
+    assert black_box.gradient_evaluations == 0
+
+
 def test_scipy_algorithm_requires_initial_guess():
     black_box = ExampleBlackBox()
     with pytest.raises(ValueError):
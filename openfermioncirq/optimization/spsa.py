@@ -0,0 +1,167 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Simultaneous perturbation stochastic approximation."""
+
+from typing import List, Optional
+
+import numpy
+
+from openfermioncirq.optimization.algorithm import (
+        OptimizationAlgorithm, bounds_arrays)
+from openfermioncirq.optimization.black_box import BlackBox
+from openfermioncirq.optimization.result import OptimizationResult
+
+
+class SPSA(OptimizationAlgorithm):
+    """Simultaneous perturbation stochastic approximation (SPSA).
+
+    Each iteration estimates the gradient from the values at two points,
+    x + c_k Δ and x - c_k Δ, where Δ is a random vector of ±1 entries, so an
+    iteration takes two evaluations whatever the dimension. The two points
+    are evaluated with one call to `evaluate_batch_with_cost`, and x then
+    takes a step of size a_k against the estimated gradient. The gains
+    decrease as a_k = a / (k + 1 + A)^alpha and c_k = c / (k + 1)^gamma. See
+    J. C. Spall, "Implementation of the simultaneous perturbation algorithm
+    for stochastic optimization", IEEE Trans. Aerosp. Electron. Syst. 34,
+    817 (1998).
+
+    Noisy black boxes are evaluated with a cost that increases over the run.
+    The cost starts at `initial_cost`, or else at the black box's
+    `cost_of_evaluate`. After every `window` iterations at the same cost,
+    the mean absolute difference between the two values of those iterations
+    is compared with the half-width of the black box's noise bounds at that
+    cost. If it is smaller, the gradient estimates are dominated by noise,
+    and the cost is multiplied by `cost_growth`.
+    Early iterations are therefore cheap, and precision is only bought once
+    the optimization approaches a minimum. The cost stays fixed for black
+    boxes whose noise bounds are infinite. If neither cost is set, the black
+    box is evaluated without a cost.
+
+    The options are:
+        maxiter: The maximum number of iterations. Default 100.
+        max_cost_spent: Stop before an iteration whose evaluations would
+            bring the total cost spent above this. Default None.
+        a, c, A, alpha, gamma: The parameters of the gain sequences. Default
+            0.5, 0.2, 10% of maxiter, 0.602 and 0.101.
+        initial_cost: The initial cost of each evaluation. Default None.
+        cost_growth: The factor by which the cost is increased. Default 2.
+        window: The number of iterations between checks of the cost.
+            Default 10.
+        max_cost: The largest cost to evaluate with. Default None.
+        confidence: The confidence passed to `noise_bounds`. Default None.
+        seed: A seed for the random number generator. By default, numpy's
+            global random number generator is used.
+
+    The final point is evaluated once more at the final cost to report its
+    value. This evaluation counts towards `max_cost_spent`.
+    """
+
+    def default_options(self):
+        return {'maxiter': 100,
+                'max_cost_spent': None,
+                'a': 0.5,
+                'c': 0.2,
+                'A': None,
+                'alpha': 0.602,
+                'gamma': 0.101,
+                'initial_cost': None,
+                'cost_growth': 2.0,
+                'window': 10,
+                'max_cost': None,
+                'confidence': None,
+                'seed': None}
+
+    def optimize(self,
+                 black_box: BlackBox,
+                 initial_guess: Optional[numpy.ndarray]=None,
+                 initial_guess_array: Optional[numpy.ndarray]=None
+                 ) -> OptimizationResult:
+        if initial_guess is None:
+            raise ValueError('The chosen optimization algorithm requires an '
+                             'initial guess.')
+        options = self.default_options()
+        options.update(self.options)
+        seed = options['seed']
+        random_state = (numpy.random if seed is None
+                        else numpy.random.RandomState(seed))
+        maxiter = options['maxiter']
+        stability = options['A']
+        if stability is None:
+            stability = 0.1 * maxiter
+        max_cost_spent = options['max_cost_spent']
+        if max_cost_spent is None:
+            max_cost_spent = numpy.inf
+        max_cost = options['max_cost']
+        if max_cost is None:
+            max_cost = numpy.inf
+        cost = options['initial_cost']
+        if cost is None:
+            cost = black_box.cost_of_evaluate
+        lower, upper = bounds_arrays(black_box.bounds, black_box.dimension)
+
+        x = numpy.clip(numpy.array(initial_guess, dtype=float), lower, upper)
+        num_evaluations = 0
+        cost_spent = 0.0
+        differences = []  # type: List[float]
+        status = 1
+        message = 'Maximum number of iterations reached.'
+        for k in range(maxiter):
+            # Leave room for the two evaluations and the final evaluation
+            if cost is not None and cost_spent + 3 * cost > max_cost_spent:
+                status = 2
+                message = 'Maximum cost spent reached.'
+                break
+            a_k = options['a'] / (k + 1 + stability)**options['alpha']
+            c_k = options['c'] / (k + 1)**options['gamma']
+            delta = random_state.choice([-1.0, 1.0], size=len(x))
+            X = numpy.clip(numpy.array([x + c_k * delta, x - c_k * delta]),
+                           lower, upper)
+            if cost is None:
+                vals = black_box.evaluate_batch(X)
+            else:
+                vals = black_box.evaluate_batch_with_cost(X, cost)
+                cost_spent += 2 * cost
+            num_evaluations += 2
+            difference = vals[0] - vals[1]
+            # Divide by the displacements left after clipping
+            steps = X[0] - X[1]
+            steps[steps == 0] = numpy.inf
+            gradient = difference / steps
+            x = numpy.clip(x - a_k * gradient, lower, upper)
+
+            differences.append(abs(difference))
+            if (cost is not None and len(differences) == options['window']
+                    and cost * options['cost_growth'] <= max_cost):
+                low, high = black_box.noise_bounds(cost,
+                                                   options['confidence'])
+                # Infinite bounds give no information about the noise
+                if (numpy.isfinite(high - low)
+                        and numpy.mean(differences) < (high - low) / 2):
+                    cost *= options['cost_growth']
+                differences = []
+
+        if cost is None:
+            value = black_box.evaluate(x)
+        else:
+            # The budget left is at least the cost before its last increase
+            cost = min(cost, max_cost_spent - cost_spent)
+            value = black_box.evaluate_with_cost(x, cost)
+            cost_spent += cost
+        num_evaluations += 1
+
+        return OptimizationResult(optimal_value=value,
+                                  optimal_parameters=x,
+                                  num_evaluations=num_evaluations,
+                                  cost_spent=cost_spent,
+                                  status=status,
+                                  message=message)
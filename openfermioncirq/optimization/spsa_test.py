@@ -0,0 +1,136 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import pytest
+import scipy.special
+
+from openfermioncirq.optimization import (
+        SPSA,
+        ScipyOptimizationAlgorithm,
+        StatefulBlackBox)
+from openfermioncirq.testing import ExampleStatefulBlackBox
+
+
+class NoisyQuadraticBlackBox(StatefulBlackBox):
+    """A quadratic whose noise has variance inversely proportional to the
+    cost, like the noise of an energy estimated from measurements."""
+
+    def __init__(self, bounds=None, **kwargs):
+        self._bounds = bounds
+        self.batch_sizes = []
+        super().__init__(save_x_vals=True, **kwargs)
+
+    @property
+    def dimension(self):
+        return 6
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    def _evaluate(self, x):
+        return numpy.sum(x**2)
+
+    def _evaluate_with_cost(self, x, cost):
+        return numpy.sum(x**2) + numpy.random.randn() / numpy.sqrt(cost)
+
+    def _evaluate_batch_with_cost(self, X, cost):
+        self.batch_sizes.append(len(X))
+        return super()._evaluate_batch_with_cost(X, cost)
+
+    def noise_bounds(self, cost, confidence=None):
+        magnitude = (scipy.special.erfinv(confidence or 0.99)
+                     * numpy.sqrt(2 / cost))
+        return -magnitude, magnitude
+
+
+def test_spsa_increases_cost():
+    black_box = NoisyQuadraticBlackBox(cost_of_evaluate=1.0)
+    algorithm = SPSA(options={'maxiter': 300, 'seed': 0})
+    result = algorithm.optimize(black_box, numpy.ones(6))
+
+    # Two evaluations per iteration and one final evaluation
+    assert result.num_evaluations == 601
+    assert black_box.num_evaluations == 601
+    assert set(black_box.batch_sizes) == {2}
+    assert result.cost_spent == pytest.approx(black_box.cost_spent)
+    costs = [cost for _, cost, _ in black_box.function_values]
+    assert costs[0] == 1.0
+    assert costs[-1] > 1.0
+    assert numpy.all(numpy.diff(costs) >= 0)
+    assert numpy.sum(result.optimal_parameters**2) < 0.05
+
+
+def test_spsa_beats_cobyla_at_fixed_budget():
+    budget = 2e5
+    initial_guess = numpy.ones(6)
+    cobyla = ScipyOptimizationAlgorithm(options={'maxiter': 200},
+                                        kwargs={'method': 'COBYLA'},
+                                        uses_bounds=False)
+    for seed in range(3):
+        numpy.random.seed(seed)
+        black_box = NoisyQuadraticBlackBox(cost_of_evaluate=budget / 200)
+        cobyla_result = cobyla.optimize(black_box, initial_guess)
+        assert black_box.cost_spent <= budget
+
+        numpy.random.seed(seed)
+        black_box = NoisyQuadraticBlackBox(cost_of_evaluate=1.0)
+        algorithm = SPSA(options={'maxiter': 1000, 'max_cost_spent': budget})
+        spsa_result = algorithm.optimize(black_box, initial_guess)
+        assert spsa_result.status == 2
+        assert black_box.cost_spent <= budget
+
+        assert (numpy.sum(spsa_result.optimal_parameters**2)
+                < numpy.sum(cobyla_result.optimal_parameters**2))
+
+
+def test_spsa_max_cost():
+    black_box = NoisyQuadraticBlackBox(cost_of_evaluate=1.0)
+    algorithm = SPSA(options={'maxiter': 100, 'max_cost': 4.0, 'seed': 0})
+    _ = algorithm.optimize(black_box, numpy.ones(6))
+    assert max(cost for _, cost, _ in black_box.function_values) <= 4.0
+
+
+def test_spsa_fixed_cost_without_noise_bounds():
+    class UnboundedNoiseBlackBox(NoisyQuadraticBlackBox):
+        def noise_bounds(self, cost, confidence=None):
+            return -numpy.inf, numpy.inf
+
+    black_box = UnboundedNoiseBlackBox(cost_of_evaluate=2.0)
+    result = SPSA(options={'maxiter': 50}).optimize(black_box, numpy.ones(6))
+    assert result.cost_spent == 2.0 * 101
+    assert {cost for _, cost, _ in black_box.function_values} == {2.0}
+
+
+def test_spsa_noiseless():
+    black_box = ExampleStatefulBlackBox()
+    result = SPSA(options={'seed': 1}).optimize(black_box,
+                                                numpy.array([1.0, -1.0]))
+    assert result.status == 1
+    assert result.num_evaluations == 201
+    assert result.cost_spent == 0.0
+    assert result.optimal_value < 1e-3
+
+
+def test_spsa_respects_bounds():
+    bounds = [(0.5, 2.0)] * 6
+    black_box = NoisyQuadraticBlackBox(bounds=bounds, cost_of_evaluate=10.0)
+    result = SPSA(options={'seed': 0}).optimize(black_box, numpy.ones(6))
+    X = numpy.array([x for _, _, x in black_box.function_values])
+    assert numpy.all(X >= 0.5) and numpy.all(X <= 2.0)
+    assert numpy.all(result.optimal_parameters < 0.75)
+
+
+def test_spsa_requires_initial_guess():
+    with pytest.raises(ValueError):
+        _ = SPSA().optimize(ExampleStatefulBlackBox())
@@ -0,0 +1,555 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Columnar storage for the function values evaluated by an optimizer."""
+
+from typing import (
+        Dict, Iterable, Optional, Tuple, Union, cast, overload)
+
+import collections.abc
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+import numpy
+
+
+FunctionValue = Tuple[float, Optional[float], Optional[numpy.ndarray]]
+
+
+class FunctionValueTrace(collections.abc.Sequence):
+    """The function values evaluated during an optimization, stored as arrays.
+
+    A FunctionValueTrace behaves like the list of (value, cost, x) tuples
+    stored in `OptimizationResult.function_values`, but keeps each field in a
+    single numpy array. A trace saved to a directory with `save` can be
+    loaded with `load`, which memory-maps the arrays; the files are only
+    opened when the trace is first accessed. Slicing a trace gives another
+    trace whose arrays are views into those of the original.
+
+    Attributes:
+        values: A 1d array of the function values.
+        costs: A 1d array of the costs used for the evaluations, with NaN
+            where no cost was used.
+        x_vals: A 2d array whose rows are the evaluated points, with rows of
+            NaN where the point was not saved, or None if no points were
+            saved.
+    """
+
+    def __init__(self,
+                 values: numpy.ndarray,
+                 costs: numpy.ndarray,
+                 x_vals: Optional[numpy.ndarray]=None) -> None:
+        self._arrays = {'values': values,
+                        'costs': costs,
+                        'x_vals': x_vals}  # type: Optional[Dict]
+        self._directory = None  # type: Optional[str]
+        self._mmap_mode = None  # type: Optional[str]
+
+    @classmethod
+    def from_function_values(cls,
+                             function_values: Iterable[FunctionValue]
+                             ) -> 'FunctionValueTrace':
+        """Convert a list of (value, cost, x) tuples to a trace."""
+        function_values = list(function_values)
+        values = numpy.array([val for val, _, _ in function_values])
+        costs = numpy.array(
+                [numpy.nan if cost is None else cost
+                 for _, cost, _ in function_values],
+                dtype=float)
+        x_vals = None
+        dimensions = {len(x) for _, _, x in function_values if x is not None}
+        if dimensions:
+            x_vals = numpy.full((len(function_values), max(dimensions)),
+                                numpy.nan)
+            for i, (_, _, x) in enumerate(function_values):
+                if x is not None:
+                    x_vals[i, :len(x)] = x
+        return cls(values, costs, x_vals)
+
+    @property
+    def values(self) -> numpy.ndarray:
+        return self._get_arrays()['values']
+
+    @property
+    def costs(self) -> numpy.ndarray:
+        return self._get_arrays()['costs']
+
+    @property
+    def x_vals(self) -> Optional[numpy.ndarray]:
+        return self._get_arrays()['x_vals']
+
+    def _get_arrays(self) -> Dict:
+        if self._arrays is None:
+            self._arrays = {}
+            for name in ('values', 'costs', 'x_vals'):
+                filename = os.path.join(self._directory, name + '.npy')
+                self._arrays[name] = (
+                        numpy.load(filename, mmap_mode=self._mmap_mode)
+                        if os.path.isfile(filename) else None)
+        return self._arrays
+
+    def save(self, directory: str) -> None:
+        """Save the trace as one .npy file per field in a directory."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, array in self._get_arrays().items():
+            if array is not None:
+                numpy.save(os.path.join(directory, name + '.npy'), array)
+
+    @classmethod
+    def load(cls,
+             directory: str,
+             mmap_mode: Optional[str]='r') -> 'FunctionValueTrace':
+        """Load a trace saved with `save`.
+
+        Args:
+            directory: The directory that the trace was saved to.
+            mmap_mode: The mode used to memory-map the arrays, as accepted by
+                `numpy.load`. Set this to None to read the arrays into memory.
+        """
+        trace = cls.__new__(cls)
+        trace._arrays = None
+        trace._directory = directory
+        trace._mmap_mode = mmap_mode
+        return trace
+
+    def _function_value(self, i: int) -> FunctionValue:
+        cost = float(self.costs[i])
+        x = None
+        if self.x_vals is not None and not numpy.all(
+                numpy.isnan(self.x_vals[i])):
+            x = numpy.array(self.x_vals[i])
+        return (self.values[i].item(),
+                None if numpy.isnan(cost) else cost,
+                x)
+
+    @overload
+    def __getitem__(self, index: int) -> FunctionValue:
+        pass
+
+    @overload
+    def __getitem__(self, index: slice) -> 'FunctionValueTrace':
+        pass
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            x_vals = self.x_vals
+            return FunctionValueTrace(
+                    self.values[index],
+                    self.costs[index],
+                    None if x_vals is None else x_vals[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Trace index out of range.')
+        return self._function_value(index)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        for (val, cost, x), (other_val, other_cost, other_x) in zip(self,
+                                                                    other):
+            if val != other_val or cost != other_cost:
+                return False
+            if (x is None) != (other_x is None):
+                return False
+            if x is not None and not numpy.array_equal(x, other_x):
+                return False
+        return True
+
+    def __getstate__(self):
+        # Pickle the data itself rather than the memory-mapped files
+        return {name: None if array is None else numpy.array(array)
+                for name, array in self._get_arrays().items()}
+
+    def __setstate__(self, state):
+        self._arrays = state
+        self._directory = None
+        self._mmap_mode = None
+
+
+# The columns of a FunctionValueBuffer other than the points
+_BUFFER_COLUMNS = ('values', 'costs', 'timestamps', 'wait_times')
+_RETENTIONS = ('ring', 'downsample')
+
+
+class FunctionValueBuffer(FunctionValueTrace):
+    """A growable trace that function values are recorded into.
+
+    The function values, costs, times of evaluation, wait times and points
+    are stored in preallocated numpy arrays whose capacity doubles when they
+    are full, so that recording an evaluation doesn't create any Python
+    objects. A buffer behaves like the list of (value, cost, x) tuples that
+    it replaces, including `append`.
+
+    The number of evaluations retained can be limited with `max_length`.
+    With ring retention, only the most recent evaluations are kept. With
+    downsample retention, every evaluation whose index is a multiple of a
+    stride is kept, and the stride doubles each time the buffer is full, so
+    that the retained evaluations cover the whole history evenly. Once the
+    arrays would exceed `memory_limit` bytes, they are moved to memory-mapped
+    files in a temporary directory, which is removed when the buffer is
+    garbage collected.
+
+    The arrays returned by the properties of the trace, and slices of the
+    trace, are views that may be overwritten as more evaluations are
+    recorded. Pickling a buffer only stores the retained evaluations.
+
+    Attributes:
+        max_length: The maximum number of evaluations retained, or None.
+        retention: Either 'ring' or 'downsample'.
+        memory_limit: The number of bytes beyond which the arrays are stored
+            on disk, or None.
+        spill_directory: The directory that temporary directories for arrays
+            stored on disk are created in, or None for the default.
+    """
+
+    def __init__(self,
+                 max_length: Optional[int]=None,
+                 retention: str='ring',
+                 memory_limit: Optional[int]=None,
+                 spill_directory: Optional[str]=None,
+                 initial_capacity: int=64) -> None:
+        """
+        Args:
+            max_length: The maximum number of evaluations retained. By
+                default, all evaluations are retained.
+            retention: How evaluations are discarded once `max_length` is
+                reached: 'ring' to keep the most recent ones, or
+                'downsample' to keep evenly spaced ones.
+            memory_limit: The number of bytes beyond which the arrays are
+                stored in memory-mapped files. By default, the arrays are
+                always kept in memory.
+            spill_directory: The directory in which to create the temporary
+                directory for the memory-mapped files. By default, the
+                system's temporary directory is used.
+            initial_capacity: The number of evaluations for which space is
+                allocated initially.
+        """
+        if retention not in _RETENTIONS:
+            raise ValueError('Unknown retention {!r}; expected one of '
+                             '{}.'.format(retention, _RETENTIONS))
+        if max_length is not None and max_length < 1:
+            raise ValueError('The maximum length must be positive.')
+        self.max_length = max_length
+        self.retention = retention
+        self.memory_limit = memory_limit
+        self.spill_directory = spill_directory
+        self._directory = None
+        self._mmap_mode = None
+        self._arrays = None
+        self._init_storage(max(1, initial_capacity))
+
+    def _init_storage(self, capacity: int) -> None:
+        self._columns = {name: numpy.empty(capacity)
+                         for name in _BUFFER_COLUMNS} \
+            # type: Dict[str, numpy.ndarray]
+        self._x_vals = None  # type: Optional[numpy.ndarray]
+        self._capacity = capacity
+        # The retained evaluations are the rows start to stop
+        self._start = 0
+        self._stop = 0
+        self._num_recorded = 0
+        self._stride = 1
+        self._spill_path = None  # type: Optional[str]
+        self._spill_generation = 0
+
+    @property
+    def num_recorded(self) -> int:
+        """The number of evaluations recorded, including discarded ones."""
+        return self._num_recorded
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the arrays are stored in memory-mapped files."""
+        return self._spill_path is not None
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        """The times at which the retained evaluations were recorded."""
+        return self._columns['timestamps'][self._start:self._stop]
+
+    @property
+    def wait_times(self) -> numpy.ndarray:
+        """The times elapsed before the retained evaluations were queried.
+
+        The wait time is NaN for evaluations that weren't preceded by a
+        query.
+        """
+        return self._columns['wait_times'][self._start:self._stop]
+
+    @property
+    def evaluation_indices(self) -> numpy.ndarray:
+        """The indices among all recorded evaluations of the retained ones.
+        """
+        length = self._stop - self._start
+        if self.retention == 'downsample':
+            return numpy.arange(length) * self._stride
+        return numpy.arange(self._num_recorded - length, self._num_recorded)
+
+    def _get_arrays(self) -> Dict:
+        rows = slice(self._start, self._stop)
+        return {'values': self._columns['values'][rows],
+                'costs': self._columns['costs'][rows],
+                'x_vals': None if self._x_vals is None
+                          else self._x_vals[rows]}
+
+    def append(self,
+               function_value: FunctionValue,
+               wait_time: Optional[float]=None,
+               timestamp: Optional[float]=None) -> None:
+        """Record an evaluation.
+
+        Args:
+            function_value: The (value, cost, x) tuple of the evaluation,
+                where the cost and the point may be None.
+            wait_time: The time elapsed before the evaluation was queried.
+            timestamp: The time at which the evaluation finished. Defaults to
+                the current time.
+        """
+        val, cost, x = function_value
+        if self.max_length is None and (x is None or self._x_vals is not None):
+            # Write the row directly, which is much faster than a batch of one
+            if self._stop == self._capacity:
+                self._resize(2 * self._capacity)
+            row = self._stop
+            self._columns['values'][row] = val
+            self._columns['costs'][row] = numpy.nan if cost is None else cost
+            self._columns['timestamps'][row] = (
+                    time.time() if timestamp is None else timestamp)
+            self._columns['wait_times'][row] = (
+                    numpy.nan if wait_time is None else wait_time)
+            if self._x_vals is not None:
+                if x is None:
+                    self._x_vals[row] = numpy.nan
+                elif len(x) != self._x_vals.shape[1]:
+                    raise ValueError(
+                            'Expected points of dimension {}, got {}.'.format(
+                                self._x_vals.shape[1], len(x)))
+                else:
+                    self._x_vals[row] = x
+            self._stop += 1
+            self._num_recorded += 1
+            return
+        self.append_batch(
+                numpy.array([val]),
+                cost,
+                None if x is None else numpy.asarray(x)[numpy.newaxis],
+                None if wait_time is None else numpy.array([wait_time]),
+                timestamp)
+
+    def append_batch(self,
+                     vals: numpy.ndarray,
+                     cost: Optional[float]=None,
+                     X: Optional[numpy.ndarray]=None,
+                     wait_times: Optional[numpy.ndarray]=None,
+                     timestamp: Optional[float]=None) -> None:
+        """Record evaluations of many points with the same cost.
+
+        Args:
+            vals: A 1d array of the function values.
+            cost: The cost of each evaluation, or None.
+            X: A 2d array whose rows are the points, or None.
+            wait_times: A 1d array of the wait times, or None.
+            timestamp: The time at which the evaluations finished. Defaults
+                to the current time.
+        """
+        vals = numpy.asarray(vals, dtype=float)
+        if not len(vals):
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        if X is not None:
+            X = numpy.asarray(X, dtype=float)
+            self._reserve_x(X.shape[1])
+        if self.max_length is not None and self.retention == 'downsample':
+            for i in range(len(vals)):
+                self._append_downsampled(
+                        vals[i:i + 1],
+                        cost,
+                        None if X is None else X[i:i + 1],
+                        None if wait_times is None else wait_times[i:i + 1],
+                        timestamp)
+            return
+        self._num_recorded += len(vals)
+        if self.max_length is not None and len(vals) > self.max_length:
+            # Only the last evaluations of the batch are retained
+            keep = slice(len(vals) - self.max_length, None)
+            vals = vals[keep]
+            X = None if X is None else X[keep]
+            wait_times = None if wait_times is None else wait_times[keep]
+        self._reserve(len(vals))
+        self._write(vals, cost, X, wait_times, timestamp)
+        if self.max_length is not None:
+            self._start = max(self._start, self._stop - self.max_length)
+
+    def _append_downsampled(self, vals, cost, X, wait_times, timestamp
+                            ) -> None:
+        index = self._num_recorded
+        self._num_recorded += 1
+        if index % self._stride:
+            return
+        if self._stop - self._start >= cast(int, self.max_length):
+            # Keep every other evaluation
+            self._move(slice(self._start, self._stop, 2), 0)
+            self._stride *= 2
+            if index % self._stride:
+                return
+        self._reserve(1)
+        self._write(vals, cost, X, wait_times, timestamp)
+
+    def _write(self, vals, cost, X, wait_times, timestamp) -> None:
+        rows = slice(self._stop, self._stop + len(vals))
+        self._columns['values'][rows] = vals
+        self._columns['costs'][rows] = numpy.nan if cost is None else cost
+        self._columns['timestamps'][rows] = timestamp
+        self._columns['wait_times'][rows] = (
+                numpy.nan if wait_times is None else wait_times)
+        if self._x_vals is not None:
+            self._x_vals[rows] = numpy.nan if X is None else X
+        self._stop = rows.stop
+
+    def _move(self, rows: slice, destination: int) -> None:
+        """Move rows of the arrays to the front, starting at a row."""
+        arrays = list(self._columns.values())
+        if self._x_vals is not None:
+            arrays.append(self._x_vals)
+        length = 0
+        for array in arrays:
+            moved = array[rows].copy()
+            length = len(moved)
+            array[destination:destination + length] = moved
+        self._start = destination
+        self._stop = destination + length
+
+    def _reserve(self, num_rows: int) -> None:
+        """Make room for rows after the retained evaluations."""
+        if self._stop + num_rows <= self._capacity:
+            return
+        if self.max_length is None:
+            self._resize(max(2 * self._capacity, self._stop + num_rows))
+            return
+        if self.retention == 'downsample':
+            limit = self.max_length
+        else:
+            # Rows are shifted to the front only when the buffer is full
+            limit = 2 * self.max_length
+        if self._capacity < limit:
+            self._resize(min(limit,
+                             max(2 * self._capacity,
+                                 self._stop - self._start + num_rows)))
+        if self._stop + num_rows > self._capacity:
+            keep = min(self._stop - self._start,
+                       self.max_length - num_rows)
+            self._move(slice(self._stop - keep, self._stop), 0)
+
+    def _reserve_x(self, dimension: int) -> None:
+        if self._x_vals is None:
+            self._x_vals = self._allocate((self._capacity, dimension))
+            self._x_vals[...] = numpy.nan
+        elif self._x_vals.shape[1] != dimension:
+            raise ValueError('Expected points of dimension {}, got {}.'.format(
+                self._x_vals.shape[1], dimension))
+
+    def _resize(self, capacity: int) -> None:
+        """Move the retained evaluations to arrays of a new capacity."""
+        rows = slice(self._start, self._stop)
+        length = self._stop - self._start
+        if (self.memory_limit is not None and self._spill_path is None
+                and self._row_size() * capacity > self.memory_limit):
+            self._spill_path = tempfile.mkdtemp(
+                    prefix='function-values-', dir=self.spill_directory)
+            weakref.finalize(self, shutil.rmtree, self._spill_path, True)
+        self._spill_generation += 1
+        old_arrays = dict(self._columns)
+        if self._x_vals is not None:
+            old_arrays['x_vals'] = self._x_vals
+        for name, old in old_arrays.items():
+            new = self._allocate((capacity,) + old.shape[1:], name)
+            new[:length] = old[rows]
+            if name == 'x_vals':
+                new[length:] = numpy.nan
+                self._x_vals = new
+            else:
+                self._columns[name] = new
+        self._capacity = capacity
+        self._start = 0
+        self._stop = length
+        # Remove the files of the previous generation
+        del old_arrays, old
+        self._remove_spilled_files(self._spill_generation - 1)
+
+    def _allocate(self, shape: Tuple[int, ...], name: str='x_vals'
+                  ) -> numpy.ndarray:
+        if self._spill_path is None:
+            return numpy.empty(shape)
+        filename = os.path.join(
+                self._spill_path,
+                '{}-{}.dat'.format(name, self._spill_generation))
+        return numpy.memmap(filename, dtype=float, mode='w+', shape=shape)
+
+    def _remove_spilled_files(self, generation: int) -> None:
+        if self._spill_path is None:
+            return
+        suffix = '-{}.dat'.format(generation)
+        for filename in os.listdir(self._spill_path):
+            if filename.endswith(suffix):
+                os.remove(os.path.join(self._spill_path, filename))
+
+    def _row_size(self) -> int:
+        """The number of bytes used by each row of the arrays."""
+        width = len(_BUFFER_COLUMNS)
+        if self._x_vals is not None:
+            width += self._x_vals.shape[1]
+        return 8 * width
+
+    def __getstate__(self):
+        rows = slice(self._start, self._stop)
+        return {'max_length': self.max_length,
+                'retention': self.retention,
+                'memory_limit': self.memory_limit,
+                'spill_directory': self.spill_directory,
+                'num_recorded': self._num_recorded,
+                'stride': self._stride,
+                'columns': {name: numpy.array(array[rows])
+                            for name, array in self._columns.items()},
+                'x_vals': None if self._x_vals is None
+                          else numpy.array(self._x_vals[rows])}
+
+    def __setstate__(self, state):
+        self.max_length = state['max_length']
+        self.retention = state['retention']
+        self.memory_limit = state['memory_limit']
+        self.spill_directory = state['spill_directory']
+        self._directory = None
+        self._mmap_mode = None
+        self._arrays = None
+        length = len(state['columns']['values'])
+        # Leave room for an append, which doubles the capacity
+        self._init_storage(max(1, length))
+        for name, column in state['columns'].items():
+            self._columns[name][:length] = column
+        if state['x_vals'] is not None:
+            self._x_vals = numpy.empty(
+                    (self._capacity,) + state['x_vals'].shape[1:])
+            self._x_vals[:length] = state['x_vals']
+        self._stop = length
+        self._num_recorded = state['num_recorded']
+        self._stride = state['stride']
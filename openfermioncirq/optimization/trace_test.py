@@ -0,0 +1,171 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import pickle
+
+import numpy
+import pytest
+
+from openfermioncirq.optimization import (
+        FunctionValueBuffer, FunctionValueTrace)
+
+
+function_values = [(1.5, None, numpy.array([0.1, 0.2])),
+                   (-0.5, 2.0, numpy.array([0.3, 0.4])),
+                   (0.25, 3.0, None)]
+
+
+def test_function_value_trace_from_function_values():
+    trace = FunctionValueTrace.from_function_values(function_values)
+
+    assert len(trace) == 3
+    assert trace == function_values
+    assert trace != function_values[:2]
+    assert trace != [(1.5, None, None)] + function_values[1:]
+    numpy.testing.assert_allclose(trace.values, [1.5, -0.5, 0.25])
+    assert numpy.isnan(trace.costs[0])
+    assert trace.x_vals.shape == (3, 2)
+
+    y, z, x = trace[-2]
+    assert y == -0.5
+    assert z == 2.0
+    numpy.testing.assert_allclose(x, [0.3, 0.4])
+    assert trace[2][2] is None
+    assert trace[1:] == function_values[1:]
+    with pytest.raises(IndexError):
+        _ = trace[3]
+
+
+def test_function_value_trace_without_x_vals():
+    trace = FunctionValueTrace.from_function_values(
+            [(1.0, None, None), (2.0, None, None)])
+    assert trace.x_vals is None
+    assert trace == [(1.0, None, None), (2.0, None, None)]
+
+
+def test_function_value_trace_save_load(tmpdir):
+    directory = os.path.join(str(tmpdir), 'trace')
+    FunctionValueTrace.from_function_values(function_values).save(directory)
+
+    trace = FunctionValueTrace.load(directory)
+    assert trace._arrays is None
+    assert trace == function_values
+    assert isinstance(trace.values, numpy.memmap)
+
+    trace = FunctionValueTrace.load(directory, mmap_mode=None)
+    assert not isinstance(trace.values, numpy.memmap)
+    assert trace == function_values
+
+    unpickled = pickle.loads(pickle.dumps(FunctionValueTrace.load(directory)))
+    assert not isinstance(unpickled.values, numpy.memmap)
+    assert unpickled == function_values
+
+
+def test_function_value_buffer_append():
+    buffer = FunctionValueBuffer(initial_capacity=1)
+    for val, cost, x in function_values:
+        buffer.append((val, cost, x))
+    buffer.append_batch(numpy.array([4.0, 5.0]), 1.0,
+                        numpy.array([[0.5, 0.6], [0.7, 0.8]]),
+                        numpy.array([0.25, 0.0]), timestamp=12.0)
+
+    assert len(buffer) == buffer.num_recorded == 5
+    assert buffer == function_values + [
+            (4.0, 1.0, numpy.array([0.5, 0.6])),
+            (5.0, 1.0, numpy.array([0.7, 0.8]))]
+    assert buffer[:2] == function_values[:2]
+    numpy.testing.assert_equal(buffer.wait_times,
+                               [numpy.nan] * 3 + [0.25, 0.0])
+    numpy.testing.assert_equal(buffer.timestamps[3:], [12.0, 12.0])
+    numpy.testing.assert_equal(buffer.evaluation_indices, range(5))
+    assert not buffer.spilled
+
+    with pytest.raises(ValueError):
+        buffer.append((1.0, None, numpy.zeros(3)))
+
+    unpickled = pickle.loads(pickle.dumps(buffer))
+    assert isinstance(unpickled, FunctionValueBuffer)
+    assert unpickled == buffer
+    unpickled.append((6.0, None, None))
+    assert unpickled.num_recorded == 6
+    assert unpickled[5] == (6.0, None, None)
+
+    # An empty buffer can be recorded into after unpickling
+    unpickled = pickle.loads(pickle.dumps(FunctionValueBuffer()))
+    assert len(unpickled) == 0
+    unpickled.append((1.0, None, numpy.zeros(2)))
+    unpickled.append((2.0, 0.5, numpy.ones(2)))
+    assert unpickled.num_recorded == 2
+    numpy.testing.assert_equal(unpickled.values, [1.0, 2.0])
+    numpy.testing.assert_equal(unpickled.x_vals, [[0.0, 0.0], [1.0, 1.0]])
+
+
+def test_function_value_buffer_ring():
+    buffer = FunctionValueBuffer(max_length=4, initial_capacity=1)
+    for i in range(10):
+        buffer.append((float(i), None, numpy.array([i, -i])))
+    assert buffer.num_recorded == 10
+    numpy.testing.assert_equal(buffer.values, [6, 7, 8, 9])
+    numpy.testing.assert_equal(buffer.x_vals[:, 1], [-6, -7, -8, -9])
+    numpy.testing.assert_equal(buffer.evaluation_indices, [6, 7, 8, 9])
+
+    buffer.append_batch(numpy.arange(10.0, 13.0))
+    numpy.testing.assert_equal(buffer.values, [9, 10, 11, 12])
+    assert numpy.all(numpy.isnan(buffer.x_vals[1:]))
+    buffer.append_batch(numpy.arange(13.0, 19.0))
+    numpy.testing.assert_equal(buffer.values, [15, 16, 17, 18])
+    numpy.testing.assert_equal(buffer.evaluation_indices, [15, 16, 17, 18])
+    assert buffer._capacity == 8
+
+
+def test_function_value_buffer_downsample():
+    buffer = FunctionValueBuffer(max_length=4, retention='downsample')
+    buffer.append_batch(numpy.arange(20.0))
+    assert buffer.num_recorded == 20
+    numpy.testing.assert_equal(buffer.values, [0, 8, 16])
+    numpy.testing.assert_equal(buffer.evaluation_indices, [0, 8, 16])
+    buffer.append((20.0, None, None))
+    buffer.append((24.0, None, None))
+    numpy.testing.assert_equal(buffer.values, [0, 8, 16])
+    assert buffer.num_recorded == 22
+
+
+def test_function_value_buffer_spill(tmpdir):
+    buffer = FunctionValueBuffer(memory_limit=10000,
+                                 spill_directory=str(tmpdir),
+                                 initial_capacity=8)
+    X = numpy.random.RandomState(2317).randn(500, 3)
+    for i, x in enumerate(X):
+        buffer.append((float(i), 1.0, x))
+    assert buffer.spilled
+    assert isinstance(buffer.values, numpy.memmap)
+    numpy.testing.assert_equal(buffer.values, numpy.arange(500))
+    numpy.testing.assert_equal(buffer.x_vals, X)
+
+    # Only the files of the current arrays are kept
+    spill_path = buffer._spill_path
+    assert len(os.listdir(spill_path)) == 5
+
+    unpickled = pickle.loads(pickle.dumps(buffer))
+    assert not unpickled.spilled
+    assert unpickled == buffer
+
+    del buffer
+    assert not os.path.exists(spill_path)
+
+
+def test_function_value_buffer_invalid_arguments():
+    with pytest.raises(ValueError):
+        _ = FunctionValueBuffer(retention='random')
+    with pytest.raises(ValueError):
+        _ = FunctionValueBuffer(max_length=0)
@@ -0,0 +1,229 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""A content-addressed cache on disk for expensive preprocessing."""
+
+from typing import Any, Callable, Dict, Optional
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy
+import scipy.sparse
+
+
+# Changing the format invalidates all existing entries
+_FORMAT_VERSION = b'openfermioncirq-preprocessing-cache-1'
+_MANIFEST = 'manifest.json'
+_CSR_FIELDS = ('data', 'indices', 'indptr')
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+class PreprocessingCache:
+    """A cache of arrays and sparse matrices stored in a directory.
+
+    Each entry is a dictionary of named numpy arrays and scipy sparse
+    matrices, stored in a subdirectory whose name is the key of the entry.
+    Keys are computed with `key` by hashing the inputs of the computation,
+    so an entry is reused by any process that performs the same computation
+    with the same inputs. Entries are written to a temporary directory and
+    then renamed, so concurrent processes never see an incomplete entry.
+
+    Arrays are read with memory mapping by default, so the data is only
+    loaded from disk as it is accessed and is shared between processes
+    reading the same entry. If a maximum size is set, the least recently
+    used entries are removed after an entry is stored until the total size
+    of the entries is within the limit.
+
+    Attributes:
+        directory: The directory that the entries are stored in.
+        max_size: The maximum total size of the entries in bytes, or None
+            for no limit.
+        mmap_mode: The mode used to memory-map the arrays, as accepted by
+            `numpy.load`, or None to read the arrays into memory.
+        hits: The number of entries found in the cache.
+        misses: The number of entries not found in the cache.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_size: Optional[int]=None,
+                 mmap_mode: Optional[str]='r') -> None:
+        """
+        Args:
+            directory: The directory that the entries are stored in. It is
+                created if it doesn't exist.
+            max_size: The maximum total size of the entries in bytes. By
+                default, the size is not limited.
+            mmap_mode: The mode used to memory-map the arrays, as accepted by
+                `numpy.load`. Set this to None to read the arrays into memory.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.mmap_mode = mmap_mode
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Compute the key of an entry from the inputs of its computation.
+
+        The parts may be numpy arrays, whose data type, shape and contents
+        are hashed, sequences of parts, or other values, whose repr is
+        hashed. The first part is conventionally the name of the computation.
+        """
+        digest = hashlib.sha256(_FORMAT_VERSION)
+        for part in parts:
+            _update_digest(digest, part)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Read an entry, or return None if it isn't in the cache."""
+        path = os.path.join(self.directory, key)
+        manifest_filename = os.path.join(path, _MANIFEST)
+        try:
+            with open(manifest_filename) as f:
+                manifest = json.load(f)
+            entry = {name: self._load(path, name, info)
+                     for name, info in manifest.items()}
+            # The modification time of the manifest orders the entries for
+            # eviction
+            os.utime(manifest_filename)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """Store an entry.
+
+        If the entry is already in the cache, it is left unchanged.
+
+        Args:
+            key: The key of the entry.
+            entry: A dictionary whose keys are names containing only letters,
+                digits and underscores, and whose values are numpy arrays,
+                scalars, or scipy sparse matrices.
+        """
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        temp_path = tempfile.mkdtemp(prefix='.{}.'.format(key),
+                                     dir=self.directory)
+        try:
+            manifest = {}
+            for name, value in entry.items():
+                if not _NAME_PATTERN.match(name):
+                    raise ValueError('Invalid name for a cache array: '
+                                     '{!r}.'.format(name))
+                if scipy.sparse.issparse(value):
+                    value = scipy.sparse.csr_matrix(value)
+                    for field in _CSR_FIELDS:
+                        numpy.save(
+                            os.path.join(temp_path,
+                                         '{}.{}.npy'.format(name, field)),
+                            getattr(value, field))
+                    manifest[name] = {'type': 'csr',
+                                      'shape': list(value.shape)}
+                else:
+                    numpy.save(os.path.join(temp_path, name + '.npy'),
+                               numpy.asarray(value))
+                    manifest[name] = {'type': 'array'}
+            with open(os.path.join(temp_path, _MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Another process stored the same entry first
+                pass
+        finally:
+            # Nothing is left to remove after a successful rename
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self._evict(keep=key)
+
+    def get_or_compute(self,
+                       key: str,
+                       compute: Callable[[], Dict[str, Any]]
+                       ) -> Dict[str, Any]:
+        """Read an entry, computing and storing it if it isn't in the cache.
+        """
+        entry = self.get(key)
+        if entry is None:
+            entry = compute()
+            self.put(key, entry)
+        return entry
+
+    def size(self) -> int:
+        """The total size of the entries in bytes."""
+        return sum(size for _, _, size in self._entries())
+
+    def _load(self, path: str, name: str, info: Dict[str, Any]) -> Any:
+        if info['type'] == 'csr':
+            data, indices, indptr = (
+                    numpy.load(os.path.join(path,
+                                            '{}.{}.npy'.format(name, field)),
+                               mmap_mode=self.mmap_mode)
+                    for field in _CSR_FIELDS)
+            return scipy.sparse.csr_matrix((data, indices, indptr),
+                                           shape=tuple(info['shape']),
+                                           copy=False)
+        return numpy.load(os.path.join(path, name + '.npy'),
+                          mmap_mode=self.mmap_mode)
+
+    def _entries(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            try:
+                last_used = os.path.getmtime(os.path.join(path, _MANIFEST))
+                size = sum(os.path.getsize(os.path.join(path, filename))
+                           for filename in os.listdir(path))
+            except OSError:
+                # Temporary directories and concurrently removed entries
+                continue
+            entries.append((last_used, key, size))
+        return entries
+
+    def _evict(self, keep: str) -> None:
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries())
+        total_size = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key),
+                          ignore_errors=True)
+            total_size -= size
+
+
+def _update_digest(digest, part: Any) -> None:
+    if isinstance(part, numpy.ndarray):
+        part = numpy.ascontiguousarray(part)
+        header = 'ndarray {} {}'.format(part.dtype.str, part.shape)
+        digest.update(header.encode())
+        digest.update(part.tobytes())
+    elif isinstance(part, (list, tuple)):
+        digest.update('sequence {}'.format(len(part)).encode())
+        for item in part:
+            _update_digest(digest, item)
+    else:
+        text = repr(part)
+        digest.update('{} {}'.format(len(text), text).encode())
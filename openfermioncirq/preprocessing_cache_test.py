@@ -0,0 +1,122 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import time
+
+import numpy
+import pytest
+import scipy.sparse
+
+from openfermioncirq import PreprocessingCache
+
+
+def test_preprocessing_cache_key():
+    key = PreprocessingCache.key('name', numpy.arange(3), 1e-8, None)
+    assert key == PreprocessingCache.key('name', numpy.arange(3), 1e-8, None)
+    assert key != PreprocessingCache.key('name', numpy.arange(3.0), 1e-8,
+                                         None)
+    assert key != PreprocessingCache.key('name', numpy.arange(3), 1e-7, None)
+    assert key != PreprocessingCache.key('other', numpy.arange(3), 1e-8,
+                                         None)
+    assert (PreprocessingCache.key(numpy.zeros((2, 3)))
+            != PreprocessingCache.key(numpy.zeros((3, 2))))
+    assert (PreprocessingCache.key(('a', 'b'), 'c')
+            != PreprocessingCache.key('a', ('b', 'c')))
+
+
+def test_preprocessing_cache_put_get(tmpdir):
+    directory = os.path.join(str(tmpdir), 'cache')
+    cache = PreprocessingCache(directory)
+    assert os.path.isdir(directory)
+
+    key = cache.key('test')
+    assert cache.get(key) is None
+    assert cache.misses == 1
+
+    matrix = scipy.sparse.random(20, 20, density=0.2, format='csc',
+                                 random_state=3)
+    cache.put(key, {'array': numpy.arange(4.0),
+                    'scalar': 2.5,
+                    'matrix': matrix})
+    entry = cache.get(key)
+    assert cache.hits == 1
+    assert isinstance(entry['array'], numpy.memmap)
+    numpy.testing.assert_allclose(entry['array'], numpy.arange(4.0))
+    assert float(entry['scalar']) == 2.5
+    assert isinstance(entry['matrix'], scipy.sparse.csr_matrix)
+    numpy.testing.assert_allclose(entry['matrix'].toarray(), matrix.toarray())
+
+    # Storing an existing entry leaves it unchanged
+    cache.put(key, {'array': numpy.zeros(2)})
+    numpy.testing.assert_allclose(cache.get(key)['array'], numpy.arange(4.0))
+
+    in_memory = PreprocessingCache(directory, mmap_mode=None).get(key)
+    assert not isinstance(in_memory['array'], numpy.memmap)
+    numpy.testing.assert_allclose(in_memory['array'], numpy.arange(4.0))
+
+    # No temporary directories are left behind
+    assert os.listdir(directory) == [key]
+
+
+def test_preprocessing_cache_get_or_compute(tmpdir):
+    cache = PreprocessingCache(str(tmpdir))
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return {'value': numpy.array([1.0, 2.0])}
+
+    key = cache.key('compute')
+    numpy.testing.assert_allclose(
+            cache.get_or_compute(key, compute)['value'], [1.0, 2.0])
+    numpy.testing.assert_allclose(
+            cache.get_or_compute(key, compute)['value'], [1.0, 2.0])
+    assert len(calls) == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_preprocessing_cache_eviction(tmpdir):
+    cache = PreprocessingCache(str(tmpdir))
+    keys = [cache.key('entry', i) for i in range(3)]
+    for key in keys:
+        cache.put(key, {'array': numpy.zeros(1000)})
+    entry_size = cache.size() // 3
+
+    # Use the first entry so that the second is the least recently used
+    now = time.time()
+    for i, key in enumerate(keys):
+        os.utime(os.path.join(str(tmpdir), key, 'manifest.json'),
+                 (now - 10 + i, now - 10 + i))
+    assert cache.get(keys[0]) is not None
+
+    cache.max_size = 3 * entry_size
+    new_key = cache.key('entry', 3)
+    cache.put(new_key, {'array': numpy.zeros(1000)})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.get(new_key) is not None
+    assert cache.size() <= cache.max_size
+
+    # The newest entry is kept even if it exceeds the maximum size
+    cache.max_size = 1
+    cache.put(keys[1], {'array': numpy.zeros(1000)})
+    assert os.listdir(str(tmpdir)) == [keys[1]]
+
+
+def test_preprocessing_cache_invalid_name(tmpdir):
+    cache = PreprocessingCache(str(tmpdir))
+    with pytest.raises(ValueError):
+        cache.put(cache.key('invalid'), {'../array': numpy.zeros(1)})
+    assert os.listdir(str(tmpdir)) == []
@@ -12,7 +12,7 @@
 
 """A Trotter algorithm using the low rank decomposition strategy."""
 
-from typing import cast, Optional, Sequence, TYPE_CHECKING, Tuple
+from typing import cast, Dict, Optional, Sequence, TYPE_CHECKING, Tuple
 
 import numpy
 
@@ -24,6 +24,7 @@ from openfermioncirq import (
     rot111,
     bogoliubov_transform,
     swap_network)
+from openfermioncirq.preprocessing_cache import PreprocessingCache
 from openfermioncirq.trotter.trotter_algorithm import (
     Hamiltonian,
     TrotterStep,
@@ -66,7 +67,8 @@ class LowRankTrotterAlgorithm(TrotterAlgorithm):
     def __init__(self,
                  truncation_threshold: Optional[float]=1e-8,
                  final_rank: Optional[int]=None,
-                 spin_basis=True) -> None:
+                 spin_basis=True,
+                 cache: Optional[PreprocessingCache]=None) -> None:
         """
         Args:
             truncation_threshold: The value of x from the docstring of
@@ -75,17 +77,23 @@ class LowRankTrotterAlgorithm(TrotterAlgorithm):
                 truncate.
             spin_basis: Whether the Hamiltonian is given in the spin orbital
                 (rather than spatial orbital) basis.
+            cache: A cache on disk in which to store the low rank
+                decomposition of the Hamiltonian, so that it is reused by
+                Trotter steps and ansatzes constructed for the same
+                Hamiltonian in other processes.
         """
         self.truncation_threshold = truncation_threshold
         self.final_rank = final_rank
         self.spin_basis = spin_basis
+        self.cache = cache
 
     def asymmetric(self, hamiltonian: Hamiltonian) -> Optional[TrotterStep]:
         return AsymmetricLowRankTrotterStep(
                 hamiltonian,
                 self.truncation_threshold,
                 self.final_rank,
-                self.spin_basis)
+                self.spin_basis,
+                self.cache)
 
     def controlled_asymmetric(self, hamiltonian: Hamiltonian
                               ) -> Optional[TrotterStep]:
@@ -93,49 +101,142 @@ class LowRankTrotterAlgorithm(TrotterAlgorithm):
                 hamiltonian,
                 self.truncation_threshold,
                 self.final_rank,
-                self.spin_basis)
+                self.spin_basis,
+                self.cache)
 
 
 LOW_RANK = LowRankTrotterAlgorithm()
 
 
+def low_rank_decomposition(
+        hamiltonian: openfermion.InteractionOperator,
+        truncation_threshold: Optional[float]=1e-8,
+        final_rank: Optional[int]=None,
+        spin_basis: bool=True,
+        cache: Optional[PreprocessingCache]=None
+        ) -> Dict[str, numpy.ndarray]:
+    """Decompose a Hamiltonian for simulation with the low rank strategy.
+
+    Args:
+        hamiltonian: The Hamiltonian.
+        truncation_threshold: The truncation threshold passed to
+            `openfermion.low_rank_two_body_decomposition`.
+        final_rank: The rank at which to truncate the decomposition.
+        spin_basis: Whether the Hamiltonian is given in the spin orbital
+            (rather than spatial orbital) basis.
+        cache: A cache on disk in which to look up and store the result.
+
+    Returns:
+        A dictionary containing the arrays
+            eigenvalues: The eigenvalues of the two-body decomposition.
+            one_body_squares: The one-body operators that are squared, with
+                one for each eigenvalue.
+            one_body_correction: The one-body correction from the two-body
+                decomposition.
+            scaled_density_density_matrices: The density-density matrices
+                of the squared one-body operators, scaled by the eigenvalues.
+            basis_change_matrices: The basis change matrices that diagonalize
+                the squared one-body operators.
+            one_body_energies: The orbital energies of the corrected
+                one-body terms.
+            one_body_basis_change_matrix: The basis change matrix that
+                diagonalizes the corrected one-body terms.
+    """
+    if cache is None:
+        return _low_rank_decomposition(hamiltonian, truncation_threshold,
+                                       final_rank, spin_basis)
+    key = cache.key('low_rank_decomposition',
+                    hamiltonian.one_body_tensor,
+                    hamiltonian.two_body_tensor,
+                    truncation_threshold,
+                    final_rank,
+                    spin_basis)
+    return cache.get_or_compute(
+            key,
+            lambda: _low_rank_decomposition(hamiltonian, truncation_threshold,
+                                            final_rank, spin_basis))
+
+
+def _low_rank_decomposition(hamiltonian: openfermion.InteractionOperator,
+                            truncation_threshold: Optional[float],
+                            final_rank: Optional[int],
+                            spin_basis: bool) -> Dict[str, numpy.ndarray]:
+    n_qubits = hamiltonian.n_qubits
+
+    # Perform the low rank decomposition of two-body operator.
+    eigenvalues, one_body_squares, one_body_correction, _ = (
+        openfermion.low_rank_two_body_decomposition(
+            hamiltonian.two_body_tensor,
+            truncation_threshold=truncation_threshold,
+            final_rank=final_rank,
+            spin_basis=spin_basis))
+
+    # Get scaled density-density terms and basis transformation matrices.
+    scaled_density_density_matrices = []  # type: List[numpy.ndarray]
+    basis_change_matrices = []            # type: List[numpy.ndarray]
+    for j in range(len(eigenvalues)):
+        density_density_matrix, basis_change_matrix = (
+            openfermion.prepare_one_body_squared_evolution(
+                one_body_squares[j]))
+        scaled_density_density_matrices.append(
+                numpy.real(eigenvalues[j] * density_density_matrix))
+        basis_change_matrices.append(basis_change_matrix)
+
+    # Get transformation matrix and orbital energies for one-body terms
+    one_body_coefficients = (
+            hamiltonian.one_body_tensor + one_body_correction)
+    quad_ham = openfermion.QuadraticHamiltonian(one_body_coefficients)
+    one_body_energies, one_body_basis_change_matrix, _ = (
+            quad_ham.diagonalizing_bogoliubov_transform()
+    )
+
+    return {
+        'eigenvalues': numpy.asarray(eigenvalues),
+        'one_body_squares': numpy.asarray(one_body_squares),
+        'one_body_correction': numpy.asarray(one_body_correction),
+        'scaled_density_density_matrices': numpy.array(
+            scaled_density_density_matrices).reshape(
+                len(eigenvalues), n_qubits, n_qubits),
+        'basis_change_matrices': numpy.array(
+            basis_change_matrices).reshape(
+                len(eigenvalues), n_qubits, n_qubits),
+        'one_body_energies': numpy.asarray(one_body_energies),
+        'one_body_basis_change_matrix': numpy.asarray(
+            one_body_basis_change_matrix),
+    }
+
+
 class LowRankTrotterStep(TrotterStep):
 
     def __init__(self,
                  hamiltonian: openfermion.InteractionOperator,
                  truncation_threshold: Optional[float]=1e-8,
                  final_rank: Optional[int]=None,
-                 spin_basis=True) -> None:
+                 spin_basis=True,
+                 cache: Optional[PreprocessingCache]=None) -> None:
 
         self.truncation_threshold = truncation_threshold
         self.final_rank = final_rank
 
-        # Perform the low rank decomposition of two-body operator.
-        self.eigenvalues, self.one_body_squares, one_body_correction, _ = (
-            openfermion.low_rank_two_body_decomposition(
-                hamiltonian.two_body_tensor,
+        decomposition = low_rank_decomposition(
+                hamiltonian,
                 truncation_threshold=self.truncation_threshold,
                 final_rank=self.final_rank,
-                spin_basis=spin_basis))
+                spin_basis=spin_basis,
+                cache=cache)
+        self.eigenvalues = decomposition['eigenvalues']
+        self.one_body_squares = decomposition['one_body_squares']
 
         # Get scaled density-density terms and basis transformation matrices.
-        self.scaled_density_density_matrices = []  # type: List[numpy.ndarray]
-        self.basis_change_matrices = []            # type: List[numpy.ndarray]
-        for j in range(len(self.eigenvalues)):
-            density_density_matrix, basis_change_matrix = (
-                openfermion.prepare_one_body_squared_evolution(
-                    self.one_body_squares[j]))
-            self.scaled_density_density_matrices.append(
-                    numpy.real(self.eigenvalues[j] * density_density_matrix))
-            self.basis_change_matrices.append(basis_change_matrix)
+        self.scaled_density_density_matrices = list(
+                decomposition['scaled_density_density_matrices'])
+        self.basis_change_matrices = list(
+                decomposition['basis_change_matrices'])
 
         # Get transformation matrix and orbital energies for one-body terms
-        one_body_coefficients = (
-                hamiltonian.one_body_tensor + one_body_correction)
-        quad_ham = openfermion.QuadraticHamiltonian(one_body_coefficients)
-        self.one_body_energies, self.one_body_basis_change_matrix, _ = (
-                quad_ham.diagonalizing_bogoliubov_transform()
-        )
+        self.one_body_energies = decomposition['one_body_energies']
+        self.one_body_basis_change_matrix = (
+                decomposition['one_body_basis_change_matrix'])
 
         super().__init__(hamiltonian)
 
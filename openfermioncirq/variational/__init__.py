@@ -20,9 +20,19 @@ from openfermioncirq.variational.ansatzes import (
     SwapNetworkTrotterAnsatz,
     SwapNetworkTrotterHubbardAnsatz)
 
+from openfermioncirq.variational.cluster import (
+    ClusterExecutor,
+    run_cluster_worker)
+
+from openfermioncirq.variational.fermionic_linear_operator import (
+    FermionicLinearOperator)
+
 from openfermioncirq.variational.hamiltonian_objective import (
     HamiltonianObjective)
 
 from openfermioncirq.variational.objective import VariationalObjective
 
-from openfermioncirq.variational.study import VariationalStudy
+from openfermioncirq.variational.study import (
+    StoppingPolicy,
+    SuccessiveHalving,
+    VariationalStudy)
@@ -23,6 +23,8 @@ import cirq
 import openfermion
 
 from openfermioncirq import bogoliubov_transform, swap_network
+from openfermioncirq.preprocessing_cache import PreprocessingCache
+from openfermioncirq.trotter.algorithms.low_rank import low_rank_decomposition
 from openfermioncirq.variational.ansatz import VariationalAnsatz
 from openfermioncirq.variational.letter_with_subscripts import (
         LetterWithSubscripts)
@@ -105,7 +107,8 @@ class LowRankTrotterAnsatz(VariationalAnsatz):
                  include_all_z: bool=False,
                  adiabatic_evolution_time: Optional[float]=None,
                  spin_basis: bool=True,
-                 qubits: Optional[Sequence[cirq.Qid]]=None
+                 qubits: Optional[Sequence[cirq.Qid]]=None,
+                 cache: Optional[PreprocessingCache]=None
                  ) -> None:
         """
         Args:
@@ -131,6 +134,10 @@ class LowRankTrotterAnsatz(VariationalAnsatz):
             qubits: Qubits to be used by the ansatz circuit. If not specified,
                 then qubits will automatically be generated by the
                 `_generate_qubits` method.
+            cache: A cache on disk in which to store the low rank
+                decomposition of the Hamiltonian, so that it is reused by
+                ansatzes and Trotter steps constructed for the same
+                Hamiltonian in other processes.
         """
         self.hamiltonian = hamiltonian
         self.iterations = iterations
@@ -143,31 +150,24 @@ class LowRankTrotterAnsatz(VariationalAnsatz):
                     numpy.sum(numpy.abs(hamiltonian.two_body_tensor)))
         self.adiabatic_evolution_time = cast(float, adiabatic_evolution_time)
 
-        # Perform the low rank decomposition of two-body operator.
-        self.eigenvalues, one_body_squares, self.one_body_correction, _ = (
-            openfermion.low_rank_two_body_decomposition(
-                hamiltonian.two_body_tensor,
+        decomposition = low_rank_decomposition(
+                hamiltonian,
                 final_rank=self.final_rank,
-                spin_basis=spin_basis))
+                spin_basis=spin_basis,
+                cache=cache)
+        self.eigenvalues = decomposition['eigenvalues']
+        self.one_body_correction = decomposition['one_body_correction']
 
         # Get scaled density-density terms and basis transformation matrices.
-        self.scaled_density_density_matrices = []  # type: List[numpy.ndarray]
-        self.basis_change_matrices = []            # type: List[numpy.ndarray]
-        for j in range(len(self.eigenvalues)):
-            density_density_matrix, basis_change_matrix = (
-                openfermion.prepare_one_body_squared_evolution(
-                    one_body_squares[j]))
-            self.scaled_density_density_matrices.append(
-                    numpy.real(self.eigenvalues[j] * density_density_matrix))
-            self.basis_change_matrices.append(basis_change_matrix)
+        self.scaled_density_density_matrices = list(
+                decomposition['scaled_density_density_matrices'])
+        self.basis_change_matrices = list(
+                decomposition['basis_change_matrices'])
 
         # Get transformation matrix and orbital energies for one-body terms
-        one_body_coefficients = (
-                hamiltonian.one_body_tensor + self.one_body_correction)
-        quad_ham = openfermion.QuadraticHamiltonian(one_body_coefficients)
-        self.one_body_energies, self.one_body_basis_change_matrix, _ = (
-                quad_ham.diagonalizing_bogoliubov_transform()
-        )
+        self.one_body_energies = decomposition['one_body_energies']
+        self.one_body_basis_change_matrix = (
+                decomposition['one_body_basis_change_matrix'])
 
         super().__init__(qubits)
 
@@ -10,10 +10,13 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import numpy
 import sympy
 
 import openfermion
 
+from openfermioncirq import PreprocessingCache
+from openfermioncirq.trotter import LowRankTrotterAlgorithm
 from openfermioncirq.variational.ansatzes import LowRankTrotterAnsatz
 
 
@@ -58,3 +61,24 @@ def test_swap_network_trotter_ansatz_default_initial_params_length():
 
     ansatz = LowRankTrotterAnsatz(lih_hamiltonian)
     assert len(ansatz.default_initial_params()) == len(list(ansatz.params()))
+
+
+def test_low_rank_trotter_ansatz_cache(tmpdir):
+    cache = PreprocessingCache(str(tmpdir))
+    ansatz = LowRankTrotterAnsatz(lih_hamiltonian, final_rank=2)
+    cached_ansatz = LowRankTrotterAnsatz(lih_hamiltonian, final_rank=2,
+                                         cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cached_ansatz.circuit == ansatz.circuit
+    numpy.testing.assert_allclose(cached_ansatz.default_initial_params(),
+                                  ansatz.default_initial_params())
+
+    # The Trotter step reuses the decomposition computed for the ansatz
+    algorithm = LowRankTrotterAlgorithm(final_rank=2, cache=cache)
+    step = algorithm.asymmetric(lih_hamiltonian)
+    assert (cache.hits, cache.misses) == (1, 1)
+    numpy.testing.assert_allclose(step.one_body_energies,
+                                  ansatz.one_body_energies)
+    for cached, matrix in zip(step.basis_change_matrices,
+                              ansatz.basis_change_matrices):
+        numpy.testing.assert_allclose(cached, matrix)
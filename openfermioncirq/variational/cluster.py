@@ -0,0 +1,222 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""An executor that runs tasks on worker processes connected by sockets."""
+
+from typing import Any, Callable, List, Optional, Tuple
+
+import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+
+
+# Placed in the task queue to tell the connection threads to stop
+_SHUTDOWN = None
+
+
+class ClusterExecutor(concurrent.futures.Executor):
+    """An executor whose workers connect to it over the network.
+
+    The executor listens on a socket. Worker processes, which may run on
+    other machines, connect to it by calling `run_cluster_worker` with the
+    address and authentication key of the executor, and then perform the
+    submitted tasks one at a time until the executor is shut down. Workers
+    can join at any time, and tasks are handed to whichever worker is free.
+    The functions and arguments of the tasks are pickled, so they must be
+    importable by the workers.
+
+    If a worker is lost while it performs a task, for instance because its
+    machine went down, the task is handed to another worker, up to
+    `max_retries` times, after which its future fails with the error of the
+    lost connection. Tasks wait for a worker to be free, so a task that is
+    handed back while no other worker is connected waits for one to join.
+
+    The executor can also start a number of local worker processes itself,
+    which makes it a stand-in for a cluster on a single machine.
+
+    Example::
+        # On the machine running the study
+        executor = ClusterExecutor(address=('0.0.0.0', 6000),
+                                   authkey=b'secret')
+        study.optimize(optimization_params, repetitions=100,
+                       executor=executor)
+
+        # On each of the other machines
+        run_cluster_worker(('study-host', 6000), authkey=b'secret')
+
+    Attributes:
+        address: The address that the executor listens on.
+        authkey: The key that workers use to authenticate themselves. Since
+            workers run the tasks that they receive, only trusted workers
+            should be given the key.
+    """
+
+    def __init__(self,
+                 address: Tuple[str, int]=('localhost', 0),
+                 authkey: Optional[bytes]=None,
+                 num_local_workers: int=0,
+                 max_retries: int=2) -> None:
+        """
+        Args:
+            address: The host and port to listen on. By default, the
+                executor listens on a free port of the local host only.
+            authkey: The key that workers use to authenticate themselves.
+                By default, a random key is generated.
+            num_local_workers: The number of worker processes to start on
+                the local machine.
+            max_retries: The number of times that a task is handed to
+                another worker after the worker performing it was lost.
+        """
+        if authkey is None:
+            authkey = os.urandom(32)
+        self.authkey = authkey
+        self.max_retries = max_retries
+        self._listener = multiprocessing.connection.Listener(
+                address, authkey=authkey)
+        self.address = self._listener.address
+        self._tasks = queue.Queue()  # type: queue.Queue
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._threads = []  # type: List[threading.Thread]
+        self._accept_thread = threading.Thread(target=self._accept,
+                                               daemon=True)
+        self._accept_thread.start()
+        self._local_workers = [
+                multiprocessing.Process(target=run_cluster_worker,
+                                        args=(self.address, authkey),
+                                        daemon=True)
+                for _ in range(num_local_workers)]
+        for process in self._local_workers:
+            process.start()
+
+    def submit(self,
+               fn: Callable,
+               *args: Any,
+               **kwargs: Any) -> concurrent.futures.Future:
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit tasks after shutdown.')
+            future = concurrent.futures.Future()  # type: Any
+            self._tasks.put((future, fn, args, kwargs, self.max_retries))
+        return future
+
+    def shutdown(self, wait: bool=True) -> None:
+        """Stop the workers once the tasks already submitted are done.
+
+        Args:
+            wait: Whether to wait until the tasks are done and the local
+                workers have exited.
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            self._tasks.put(_SHUTDOWN)
+        # Wake the thread waiting for new workers so that it stops
+        try:
+            multiprocessing.connection.Client(
+                    self.address, authkey=self.authkey).close()
+        except OSError:
+            # coverage: ignore
+            pass
+        if wait:
+            self._accept_thread.join()
+            for thread in list(self._threads):
+                thread.join()
+            for process in self._local_workers:
+                process.join()
+
+    def _accept(self) -> None:
+        """Start a connection thread for each worker that connects."""
+        with self._listener:
+            while True:
+                try:
+                    connection = self._listener.accept()
+                except (OSError, EOFError,
+                        multiprocessing.AuthenticationError):
+                    # coverage: ignore
+                    if self._shutdown:
+                        return
+                    continue
+                if self._shutdown:
+                    connection.close()
+                    return
+                thread = threading.Thread(target=self._serve,
+                                          args=(connection,),
+                                          daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _serve(self, connection: multiprocessing.connection.Connection
+               ) -> None:
+        """Send tasks to a worker and collect their results."""
+        with connection:
+            while True:
+                item = self._tasks.get()
+                if item is _SHUTDOWN:
+                    # Leave the signal for the other connection threads
+                    self._tasks.put(_SHUTDOWN)
+                    try:
+                        connection.send(_SHUTDOWN)
+                    except OSError:
+                        # coverage: ignore
+                        pass
+                    return
+                future, fn, args, kwargs, retries = item
+                # A task handed back by a lost worker is already running
+                if (not future.running() and
+                        not future.set_running_or_notify_cancel()):
+                    continue
+                try:
+                    connection.send((fn, args, kwargs))
+                    succeeded, value = connection.recv()
+                except (OSError, EOFError) as error:
+                    # The worker was lost, so another worker takes the task
+                    if retries > 0:
+                        self._tasks.put((future, fn, args, kwargs,
+                                         retries - 1))
+                    else:
+                        future.set_exception(error)
+                    return
+                if succeeded:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+
+def run_cluster_worker(address: Tuple[str, int],
+                       authkey: bytes) -> None:
+    """Perform the tasks of a ClusterExecutor until it shuts down.
+
+    Args:
+        address: The address of the executor.
+        authkey: The authentication key of the executor.
+    """
+    with multiprocessing.connection.Client(address,
+                                           authkey=authkey) as connection:
+        while True:
+            try:
+                task = connection.recv()
+            except EOFError:
+                # coverage: ignore
+                return
+            if task is _SHUTDOWN:
+                return
+            fn, args, kwargs = task
+            try:
+                result = (True, fn(*args, **kwargs))
+            except Exception as error:
+                result = (False, error)
+            connection.send(result)
@@ -0,0 +1,73 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import multiprocessing
+import os
+
+import pytest
+
+from openfermioncirq import ClusterExecutor, run_cluster_worker
+
+
+def exit_once(marker: str) -> int:
+    """Kill the worker the first time, as if its machine went down."""
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return os.getpid()
+
+
+def test_cluster_executor_local_workers():
+    with ClusterExecutor(num_local_workers=2) as executor:
+        results = list(executor.map(pow, range(10), [2] * 10))
+        worker_pids = {executor.submit(os.getpid).result()
+                       for _ in range(4)}
+        with pytest.raises(ZeroDivisionError):
+            executor.submit(divmod, 1, 0).result()
+    assert results == [i**2 for i in range(10)]
+    assert os.getpid() not in worker_pids
+
+    with pytest.raises(RuntimeError):
+        _ = executor.submit(pow, 2, 2)
+    executor.shutdown()
+
+
+def test_cluster_executor_remote_worker():
+    executor = ClusterExecutor(authkey=b'test key')
+    future = executor.submit(pow, 3, 2)
+    assert not future.done()
+
+    # A worker started independently, as on another machine
+    worker = multiprocessing.Process(target=run_cluster_worker,
+                                     args=(executor.address, b'test key'))
+    worker.start()
+    assert future.result(timeout=30) == 9
+    executor.shutdown()
+    worker.join(timeout=30)
+    assert worker.exitcode == 0
+
+
+def test_cluster_executor_lost_worker(tmpdir):
+    marker = os.path.join(str(tmpdir), 'marker')
+    with ClusterExecutor(num_local_workers=2) as executor:
+        worker_pid = executor.submit(exit_once, marker).result(timeout=30)
+        assert os.path.exists(marker)
+        assert executor.submit(os.getpid).result(timeout=30) == worker_pid
+    exitcodes = sorted(process.exitcode
+                       for process in executor._local_workers)
+    assert exitcodes == [0, 1]
+
+    # Without retries, the task fails with the error of the connection
+    os.remove(marker)
+    with ClusterExecutor(num_local_workers=1, max_retries=0) as executor:
+        with pytest.raises(EOFError):
+            executor.submit(exit_once, marker).result(timeout=30)
@@ -0,0 +1,544 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""A matrix-free representation of a fermionic Hamiltonian."""
+
+from typing import (
+        Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union)
+
+import concurrent.futures
+import os
+
+import numpy
+import openfermion
+import scipy.sparse
+import scipy.sparse.linalg
+
+
+LadderOperators = Sequence[Tuple[int, int]]
+
+# The minimum number of index entries computed at once when applying the
+# operator, so that small operators are not dominated by overhead
+_MIN_CHUNK_ENTRIES = 2**16
+
+# The number of terms expanded into Pauli strings at once
+_PAULI_BLOCK_SIZE = 2**14
+
+
+class FermionicLinearOperator(scipy.sparse.linalg.LinearOperator):
+    """A fermionic operator under the Jordan-Wigner transform, matrix-free.
+
+    The operator acts on state vectors of n qubits in which qubit p holds the
+    occupation of mode p, with qubit 0 corresponding to the most significant
+    bit of the index, as in `openfermion.get_sparse_operator`.
+
+    Each product of ladder operators is compiled once into bit masks: the
+    bits that a basis state must have for the product not to annihilate it,
+    the bits that the product flips, and the bits whose parity determines the
+    sign. Applying the operator then amounts to enumerating the indices of the
+    basis states satisfying the constraints, looking up the signs in a table
+    of parities, and a vectorized gather and scatter with NumPy, for many
+    products at once. Products that don't flip any bits, such as the number
+    operators in a DiagonalCoulombHamiltonian, are summed into a single
+    diagonal which is computed once. The memory used is a constant number of
+    vectors of length 2**n, rather than the number of nonzero entries of the
+    sparse matrix, and no QubitOperator is constructed.
+    """
+
+    def __init__(self,
+                 operator: Union[openfermion.DiagonalCoulombHamiltonian,
+                                 openfermion.FermionOperator,
+                                 openfermion.InteractionOperator],
+                 n_qubits: Optional[int]=None) -> None:
+        """
+        Args:
+            operator: The operator.
+            n_qubits: The number of qubits. By default, it is determined from
+                the operator.
+        """
+        if n_qubits is None:
+            n_qubits = openfermion.count_qubits(operator)
+        if n_qubits > 62:
+            # coverage: ignore
+            raise ValueError('Too many qubits for 64-bit basis state indices.')
+        self.n_qubits = n_qubits
+        super().__init__(dtype=numpy.complex128,
+                         shape=(2**n_qubits, 2**n_qubits))
+
+        self._diagonal = numpy.zeros(2**n_qubits, dtype=numpy.complex128)
+        terms = {}  # type: Dict[Tuple[int, int, int, int], complex]
+        for ladder_operators, coefficient in _ladder_operator_terms(operator):
+            compiled = _compile_term(ladder_operators, n_qubits)
+            if compiled is None:
+                continue
+            fixed_mask, fixed_bits, flip_mask, sign_mask, sign = compiled
+            key = (fixed_mask, fixed_bits, flip_mask, sign_mask)
+            terms[key] = terms.get(key, 0) + sign * coefficient
+
+        off_diagonal_terms = {}  # type: Dict[int, List[Tuple]]
+        for (fixed_mask, fixed_bits, flip_mask, sign_mask
+                ), coefficient in terms.items():
+            if coefficient == 0:
+                continue
+            if flip_mask:
+                positions = tuple(i for i in range(n_qubits)
+                                  if fixed_mask >> i & 1)
+                off_diagonal_terms.setdefault(len(positions), []).append(
+                        (positions, fixed_bits, flip_mask, sign_mask,
+                         coefficient))
+            else:
+                indices = _constrained_indices(n_qubits, fixed_mask,
+                                               fixed_bits)
+                self._diagonal[indices] += coefficient * (
+                        1 - 2 * _parities(indices & sign_mask))
+        if not numpy.any(self._diagonal.imag):
+            self._diagonal = self._diagonal.real
+
+        # The sign of every term is looked up in a table of parities
+        self._sign_table = 1 - 2 * _parities(
+                numpy.arange(2**n_qubits, dtype=numpy.int64)).astype(
+                    numpy.int8)
+
+        # Terms with the same number of fixed bits are applied together, in
+        # chunks small enough that the indices of a chunk take O(2**n)
+        # memory. Terms that fix the same bits share the enumeration of the
+        # remaining bits.
+        self._chunks = []  # type: List[_TermChunk]
+        for num_fixed, group in sorted(off_diagonal_terms.items()):
+            group.sort(key=lambda term: term[0])
+            chunk_size = max(1, max(2**n_qubits, _MIN_CHUNK_ENTRIES)
+                             >> (n_qubits - num_fixed))
+            for start in range(0, len(group), chunk_size):
+                positions, fixed_bits, flip_masks, sign_masks, coefficients = (
+                        zip(*group[start:start + chunk_size]))
+                unique_positions, position_indices = numpy.unique(
+                        numpy.array(positions, dtype=numpy.int64).reshape(
+                            len(positions), num_fixed),
+                        axis=0, return_inverse=True)
+                self._chunks.append(_TermChunk(
+                        unique_positions,
+                        position_indices.reshape(-1),
+                        numpy.array(fixed_bits, dtype=numpy.int64),
+                        numpy.array(flip_masks, dtype=numpy.int64),
+                        numpy.array(sign_masks, dtype=numpy.int64),
+                        numpy.array(coefficients, dtype=numpy.complex128)))
+
+    def _matvec(self, vector: numpy.ndarray) -> numpy.ndarray:
+        return self._apply(numpy.asarray(vector).reshape(-1, 1)).reshape(-1)
+
+    def _matmat(self, matrix: numpy.ndarray) -> numpy.ndarray:
+        return self._apply(numpy.asarray(matrix))
+
+    def _adjoint(self) -> 'FermionicLinearOperator':
+        adjoint = FermionicLinearOperator.__new__(FermionicLinearOperator)
+        adjoint.__dict__.update(self.__dict__)
+        adjoint._diagonal = self._diagonal.conj()
+        # The adjoint of a term maps the flipped states back with the
+        # conjugate coefficient. The flipped bits are all fixed and the sign
+        # mask excludes them, so the sign is unchanged.
+        adjoint._chunks = [
+                chunk._replace(fixed_bits=chunk.fixed_bits ^ chunk.flip_masks,
+                               coefficients=chunk.coefficients.conj())
+                for chunk in self._chunks]
+        return adjoint
+
+    def _apply(self, vectors: numpy.ndarray) -> numpy.ndarray:
+        dimension = 2**self.n_qubits
+        result = (self._diagonal[:, numpy.newaxis] * vectors).astype(
+                numpy.complex128)
+        for chunk in self._chunks:
+            indices, targets, weights = self._chunk_entries(chunk)
+            # Different terms may map to the same basis state, so the
+            # contributions are summed with bincount
+            for column in range(vectors.shape[1]):
+                contributions = weights * vectors[indices, column]
+                result[:, column] += numpy.bincount(
+                        targets, contributions.real, minlength=dimension)
+                result[:, column] += 1j * numpy.bincount(
+                        targets, contributions.imag, minlength=dimension)
+        return result
+
+    def sparse_matrix(self,
+                      max_workers: Optional[int]=None
+                      ) -> scipy.sparse.csr_matrix:
+        """The operator as a sparse matrix.
+
+        This gives the same matrix as `openfermion.get_sparse_operator`, but
+        the entries are computed directly from the compiled terms rather
+        than from the Jordan-Wigner transformed QubitOperator. Blocks of
+        terms are converted to sparse matrices in parallel threads and then
+        summed.
+
+        Args:
+            max_workers: The maximum number of threads to use. By default,
+                the number of CPUs is used.
+        """
+        matrix = scipy.sparse.diags(self._diagonal.astype(numpy.complex128),
+                                    format='csr')
+        if not self._chunks:
+            return matrix
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        num_blocks = min(max_workers, len(self._chunks))
+        blocks = [self._chunks[i::num_blocks] for i in range(num_blocks)]
+        with concurrent.futures.ThreadPoolExecutor(num_blocks) as executor:
+            for block_matrix in executor.map(self._block_matrix, blocks):
+                matrix = matrix + block_matrix
+        return matrix
+
+    def restricted_sparse_matrix(self,
+                                 basis_indices: numpy.ndarray
+                                 ) -> scipy.sparse.csr_matrix:
+        """The operator restricted to a subset of the basis states.
+
+        The entries of the restricted matrix are computed from the compiled
+        terms, term chunk by term chunk, and only the entries whose row and
+        column both lie in the subset are kept, so that the matrix of the
+        full operator is never formed. For a subset of fixed particle
+        number, the memory used is that of the restricted matrix and a
+        constant number of vectors of length 2**n.
+
+        Args:
+            basis_indices: The indices of the basis states in increasing
+                order. The i-th row and column of the restricted matrix
+                correspond to the basis state whose index is the i-th entry.
+        """
+        basis_indices = numpy.asarray(basis_indices, dtype=numpy.int64)
+        size = len(basis_indices)
+        # The position of each basis state in the subset, or -1
+        positions = numpy.full(2**self.n_qubits, -1, dtype=numpy.int64)
+        positions[basis_indices] = numpy.arange(size)
+
+        rows, columns, data = [], [], []
+        for chunk in self._chunks:
+            indices, targets, weights = self._chunk_entries(chunk)
+            indices = positions[indices]
+            targets = positions[targets]
+            inside = (indices >= 0) & (targets >= 0)
+            rows.append(targets[inside])
+            columns.append(indices[inside])
+            data.append(weights[inside])
+        matrix = scipy.sparse.diags(
+                self._diagonal[basis_indices].astype(numpy.complex128),
+                format='csr')
+        if rows:
+            # Duplicate entries are summed by the conversion to CSR
+            matrix = matrix + scipy.sparse.coo_matrix(
+                    (numpy.concatenate(data),
+                     (numpy.concatenate(rows), numpy.concatenate(columns))),
+                    shape=(size, size)).tocsr()
+        return matrix
+
+    def _block_matrix(self,
+                      chunks: Sequence['_TermChunk']
+                      ) -> scipy.sparse.csr_matrix:
+        rows, columns, data = [], [], []
+        for chunk in chunks:
+            indices, targets, weights = self._chunk_entries(chunk)
+            rows.append(targets)
+            columns.append(indices)
+            data.append(weights)
+        # Duplicate entries are summed by the conversion to CSR
+        return scipy.sparse.coo_matrix(
+                (numpy.concatenate(data),
+                 (numpy.concatenate(rows), numpy.concatenate(columns))),
+                shape=self.shape).tocsr()
+
+    def _chunk_entries(self, chunk: '_TermChunk'
+                       ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """The nonzero entries of the terms in a chunk.
+
+        Returns arrays of the column indices, the row indices and the values
+        of the entries. An index may appear more than once.
+        """
+        num_free = self.n_qubits - chunk.positions.shape[1]
+        indices = numpy.broadcast_to(
+                numpy.arange(2**num_free, dtype=numpy.int64),
+                (len(chunk.positions), 2**num_free))
+        # Insert zeros at the fixed positions, from the least significant
+        for positions in chunk.positions.T:
+            positions = positions[:, numpy.newaxis]
+            low = indices & ((1 << positions) - 1)
+            indices = ((indices >> positions) << (positions + 1)) | low
+        indices = (indices[chunk.position_indices]
+                   | chunk.fixed_bits[:, numpy.newaxis])
+        weights = chunk.coefficients[:, numpy.newaxis] * self._sign_table[
+                indices & chunk.sign_masks[:, numpy.newaxis]]
+        targets = indices ^ chunk.flip_masks[:, numpy.newaxis]
+        return indices.ravel(), targets.ravel(), weights.ravel()
+
+
+def jordan_wigner_one_norm(
+        operator: Union[openfermion.DiagonalCoulombHamiltonian,
+                        openfermion.FermionOperator,
+                        openfermion.InteractionOperator],
+        n_qubits: Optional[int]=None,
+        max_workers: Optional[int]=None) -> float:
+    """The one-norm of the Jordan-Wigner transform, omitting the constant.
+
+    This is the sum of the absolute values of the coefficients of the
+    non-identity Pauli terms of `openfermion.jordan_wigner(operator)`,
+    computed without constructing the QubitOperator. Each ladder operator
+    is a sum of two Pauli strings, which are represented by bit masks of the
+    qubits acted on by X and by Z, so that products of ladder operators are
+    expanded for many terms at once with NumPy. Blocks of terms are expanded
+    in parallel threads.
+
+    Args:
+        operator: The operator.
+        n_qubits: The number of qubits. By default, it is determined from
+            the operator.
+        max_workers: The maximum number of threads to use. By default, the
+            number of CPUs is used.
+    """
+    if n_qubits is None:
+        n_qubits = openfermion.count_qubits(operator)
+    if 2 * n_qubits > 63:
+        # coverage: ignore
+        raise ValueError('Too many qubits for 64-bit Pauli string keys.')
+
+    blocks = []
+    for modes, actions, coefficients in _ladder_operator_arrays(operator):
+        for start in range(0, len(coefficients), _PAULI_BLOCK_SIZE):
+            end = start + _PAULI_BLOCK_SIZE
+            blocks.append((modes[start:end], actions[start:end],
+                           coefficients[start:end]))
+    if not blocks:
+        return 0.0
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        expanded = list(executor.map(
+                lambda block: _pauli_coefficients(n_qubits, *block), blocks))
+    keys, coefficients = _sum_duplicates(
+            numpy.concatenate([keys for keys, _ in expanded]),
+            numpy.concatenate([coefficients for _, coefficients in expanded]))
+    return float(numpy.sum(numpy.abs(coefficients[keys != 0])))
+
+
+_TermChunk = NamedTuple('_TermChunk', [
+    ('positions', numpy.ndarray),
+    ('position_indices', numpy.ndarray),
+    ('fixed_bits', numpy.ndarray),
+    ('flip_masks', numpy.ndarray),
+    ('sign_masks', numpy.ndarray),
+    ('coefficients', numpy.ndarray)])
+
+
+def _ladder_operator_terms(
+        operator: Union[openfermion.DiagonalCoulombHamiltonian,
+                        openfermion.FermionOperator,
+                        openfermion.InteractionOperator]
+        ) -> Iterable[Tuple[LadderOperators, complex]]:
+    """Iterate over the terms of an operator as products of ladder operators.
+
+    The tensors of an InteractionOperator or DiagonalCoulombHamiltonian are
+    read directly, without constructing a FermionOperator.
+    """
+    if isinstance(operator, openfermion.FermionOperator):
+        yield from operator.terms.items()
+    elif isinstance(operator, openfermion.DiagonalCoulombHamiltonian):
+        yield (), operator.constant
+        for p, q in zip(*numpy.nonzero(operator.one_body)):
+            yield ((p, 1), (q, 0)), operator.one_body[p, q]
+        for p, q in zip(*numpy.nonzero(operator.two_body)):
+            yield ((p, 1), (p, 0), (q, 1), (q, 0)), operator.two_body[p, q]
+    elif isinstance(operator, openfermion.InteractionOperator):
+        yield (), operator.constant
+        for p, q in zip(*numpy.nonzero(operator.one_body_tensor)):
+            yield ((p, 1), (q, 0)), operator.one_body_tensor[p, q]
+        for p, q, r, s in zip(*numpy.nonzero(operator.two_body_tensor)):
+            yield (((p, 1), (q, 1), (r, 0), (s, 0)),
+                   operator.two_body_tensor[p, q, r, s])
+    else:
+        raise TypeError('Unsupported operator type: {}.'.format(
+            type(operator).__name__))
+
+
+def _ladder_operator_arrays(
+        operator: Union[openfermion.DiagonalCoulombHamiltonian,
+                        openfermion.FermionOperator,
+                        openfermion.InteractionOperator]
+        ) -> List[Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+    """The terms of an operator as arrays, grouped by number of operators.
+
+    Returns a list of tuples (modes, actions, coefficients), where modes and
+    actions are 2d arrays whose rows give the ladder operators of a term.
+    The tensors of an InteractionOperator or DiagonalCoulombHamiltonian are
+    converted without iterating over their entries in Python.
+    """
+    if isinstance(operator, openfermion.FermionOperator):
+        groups = {}  # type: Dict[int, Tuple[List, List]]
+        for ladder_operators, coefficient in operator.terms.items():
+            terms, coefficients = groups.setdefault(len(ladder_operators),
+                                                    ([], []))
+            terms.append(ladder_operators)
+            coefficients.append(coefficient)
+        arrays = []
+        for length, (terms, coefficients) in sorted(groups.items()):
+            terms_array = numpy.array(terms, dtype=numpy.int64).reshape(
+                    len(terms), length, 2)
+            arrays.append((terms_array[:, :, 0], terms_array[:, :, 1],
+                           numpy.array(coefficients, dtype=numpy.complex128)))
+        return arrays
+
+    if isinstance(operator, openfermion.DiagonalCoulombHamiltonian):
+        one_body, two_body = operator.one_body, operator.two_body
+        p, q = numpy.nonzero(two_body)
+        two_body_modes = numpy.stack([p, p, q, q], axis=1)
+        two_body_actions = numpy.tile([1, 0, 1, 0], (len(p), 1))
+        two_body_coefficients = two_body[p, q]
+    elif isinstance(operator, openfermion.InteractionOperator):
+        one_body = operator.one_body_tensor
+        two_body = operator.two_body_tensor
+        indices = numpy.nonzero(two_body)
+        two_body_modes = numpy.stack(indices, axis=1)
+        two_body_actions = numpy.tile([1, 1, 0, 0], (len(indices[0]), 1))
+        two_body_coefficients = two_body[indices]
+    else:
+        raise TypeError('Unsupported operator type: {}.'.format(
+            type(operator).__name__))
+    p, q = numpy.nonzero(one_body)
+    return [
+        (numpy.zeros((1, 0), dtype=numpy.int64),
+         numpy.zeros((1, 0), dtype=numpy.int64),
+         numpy.array([operator.constant], dtype=numpy.complex128)),
+        (numpy.stack([p, q], axis=1),
+         numpy.tile([1, 0], (len(p), 1)),
+         one_body[p, q].astype(numpy.complex128)),
+        (two_body_modes,
+         two_body_actions,
+         two_body_coefficients.astype(numpy.complex128))]
+
+
+def _pauli_coefficients(n_qubits: int,
+                        modes: numpy.ndarray,
+                        actions: numpy.ndarray,
+                        coefficients: numpy.ndarray
+                        ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Expand products of ladder operators into Pauli strings.
+
+    A Pauli string is represented by the key (x << n_qubits) | z, where x
+    and z are the bit masks of the qubits acted on by X and Z, and stands for
+    the product of the X operators followed by the Z operators. This differs
+    from the Hermitian Pauli string by a phase, which doesn't affect the
+    magnitudes of the coefficients. Under the Jordan-Wigner transform,
+    a_p = (X_p - X_p Z_p) Z_{<p} / 2 and a^_p = (X_p + X_p Z_p) Z_{<p} / 2.
+
+    Returns the keys of the Pauli strings and their coefficients, with
+    duplicates summed.
+    """
+    num_terms, length = modes.shape
+    bits = numpy.left_shift(1, n_qubits - 1 - modes).astype(numpy.int64)
+    # Z acts on the modes before each mode, which are the higher bits
+    lower_z = ((1 << n_qubits) - 1) & ~((bits << 1) - 1)
+    signs = 2 * actions - 1
+    keys = []
+    values = []
+    for branches in range(2**length):
+        x = numpy.zeros(num_terms, dtype=numpy.int64)
+        z = numpy.zeros(num_terms, dtype=numpy.int64)
+        value = coefficients / 2**length
+        for i in range(length):
+            operator_x = bits[:, i]
+            operator_z = lower_z[:, i]
+            if branches >> i & 1:
+                operator_z = operator_z | operator_x
+                value = value * signs[:, i]
+            # Moving Z past X gives a sign
+            value = value * (1 - 2 * _parities(z & operator_x))
+            x ^= operator_x
+            z ^= operator_z
+        keys.append((x << n_qubits) | z)
+        values.append(value)
+    return _sum_duplicates(numpy.concatenate(keys), numpy.concatenate(values))
+
+
+def _sum_duplicates(keys: numpy.ndarray,
+                    values: numpy.ndarray
+                    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sums = (numpy.bincount(inverse, values.real, minlength=len(unique_keys))
+            + 1j * numpy.bincount(inverse, values.imag,
+                                  minlength=len(unique_keys)))
+    return unique_keys, sums
+
+
+def _compile_term(ladder_operators: LadderOperators,
+                  n_qubits: int) -> Optional[Tuple[int, int, int, int, int]]:
+    """Compile a product of ladder operators into bit masks.
+
+    The ladder operators are applied from right to left. The result is a
+    tuple (fixed_mask, fixed_bits, flip_mask, sign_mask, sign) such that the
+    product maps a basis state x with x & fixed_mask == fixed_bits to
+    sign * (-1)**parity(x & sign_mask) times the basis state x ^ flip_mask,
+    and annihilates all other basis states. Returns None if the product is
+    zero.
+    """
+    all_bits = (1 << n_qubits) - 1
+    values = {}  # type: Dict[int, int]
+    initial_values = {}  # type: Dict[int, int]
+    touched_mask = 0
+    sign_mask = 0
+    sign_parity = 0
+    for mode, action in reversed(ladder_operators):
+        mode = int(mode)
+        bit = 1 << (n_qubits - 1 - mode)
+        # A creation operator needs an empty mode and vice versa
+        required = 1 - action
+        if mode not in values:
+            initial_values[mode] = required
+        elif values[mode] != required:
+            return None
+        # The sign counts the occupied modes before this one
+        before = all_bits & ~((bit << 1) - 1)
+        sign_mask ^= before & ~touched_mask
+        sign_parity ^= sum(value for other, value in values.items()
+                           if other < mode) & 1
+        values[mode] = action
+        touched_mask |= bit
+
+    fixed_mask = 0
+    fixed_bits = 0
+    flip_mask = 0
+    for mode, value in initial_values.items():
+        bit = 1 << (n_qubits - 1 - mode)
+        fixed_mask |= bit
+        if value:
+            fixed_bits |= bit
+        if values[mode] != value:
+            flip_mask |= bit
+    # Bits with fixed values contribute a constant to the sign
+    sign_parity ^= bin(sign_mask & fixed_bits).count('1') & 1
+    sign_mask &= ~fixed_mask
+    return fixed_mask, fixed_bits, flip_mask, sign_mask, 1 - 2 * sign_parity
+
+
+def _constrained_indices(n_qubits: int,
+                         fixed_mask: int,
+                         fixed_bits: int) -> numpy.ndarray:
+    """The indices x of basis states with x & fixed_mask == fixed_bits."""
+    positions = [i for i in range(n_qubits) if fixed_mask >> i & 1]
+    indices = numpy.arange(1 << (n_qubits - len(positions)),
+                           dtype=numpy.int64)
+    # Insert zeros at the fixed positions, from the least significant
+    for position in positions:
+        low = indices & ((1 << position) - 1)
+        indices = ((indices >> position) << (position + 1)) | low
+    return indices | fixed_bits
+
+
+def _parities(indices: numpy.ndarray) -> numpy.ndarray:
+    """The parity of the number of bits set in each index."""
+    bits = indices.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        bits ^= bits >> shift
+    return bits & 1
@@ -0,0 +1,107 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import openfermion
+import pytest
+import scipy.sparse
+
+from openfermioncirq import FermionicLinearOperator
+from openfermioncirq.variational.fermionic_linear_operator import (
+        jordan_wigner_one_norm)
+
+
+test_operators = [
+    openfermion.random_interaction_operator(5, real=True, seed=8023),
+    openfermion.random_interaction_operator(4, real=False, seed=3381),
+    openfermion.random_diagonal_coulomb_hamiltonian(5, real=True, seed=2213),
+    openfermion.random_diagonal_coulomb_hamiltonian(4, real=False, seed=657),
+    openfermion.FermionOperator('3^ 0 1^ 2', 0.5 - 0.25j)
+    + openfermion.FermionOperator('1^ 1 1 1^', -1.5)
+    + openfermion.FermionOperator('2 2^ 0^ 3', 2.0)
+    + openfermion.FermionOperator('0^ 0^ 1', 3.0)
+    + openfermion.FermionOperator((), 0.75),
+]
+
+
+@pytest.mark.parametrize('operator', test_operators)
+def test_fermionic_linear_operator_matches_sparse_operator(operator):
+    n_qubits = openfermion.count_qubits(operator)
+    matrix = openfermion.get_sparse_operator(operator, n_qubits).toarray()
+    linear_op = FermionicLinearOperator(operator)
+    assert linear_op.shape == matrix.shape
+
+    numpy.random.seed(4470)
+    vector = (numpy.random.randn(2**n_qubits)
+              + 1j * numpy.random.randn(2**n_qubits))
+    vectors = numpy.random.randn(2**n_qubits, 3)
+
+    numpy.testing.assert_allclose(linear_op @ vector, matrix @ vector,
+                                  atol=1e-12)
+    numpy.testing.assert_allclose(linear_op @ vectors, matrix @ vectors,
+                                  atol=1e-12)
+    numpy.testing.assert_allclose(linear_op.H @ vector,
+                                  matrix.conj().T @ vector,
+                                  atol=1e-12)
+
+
+@pytest.mark.parametrize('operator', test_operators)
+def test_fermionic_linear_operator_sparse_matrix(operator):
+    matrix = openfermion.get_sparse_operator(
+            operator, openfermion.count_qubits(operator))
+    sparse_matrix = FermionicLinearOperator(operator).sparse_matrix(
+            max_workers=2)
+    assert isinstance(sparse_matrix, scipy.sparse.csr_matrix)
+    numpy.testing.assert_allclose(sparse_matrix.toarray(), matrix.toarray(),
+                                  atol=1e-12)
+
+
+@pytest.mark.parametrize('operator', test_operators)
+def test_fermionic_linear_operator_restricted_sparse_matrix(operator):
+    n_qubits = openfermion.count_qubits(operator)
+    matrix = openfermion.get_sparse_operator(operator, n_qubits).toarray()
+    indices = numpy.array([0, 3, 5, 6, 9, 12, 2**n_qubits - 1])
+    restricted_matrix = FermionicLinearOperator(
+            operator).restricted_sparse_matrix(indices)
+    assert isinstance(restricted_matrix, scipy.sparse.csr_matrix)
+    numpy.testing.assert_allclose(restricted_matrix.toarray(),
+                                  matrix[numpy.ix_(indices, indices)],
+                                  atol=1e-12)
+
+
+@pytest.mark.parametrize('operator', test_operators)
+def test_jordan_wigner_one_norm(operator):
+    qubit_op = openfermion.jordan_wigner(operator)
+    numpy.testing.assert_allclose(
+            jordan_wigner_one_norm(operator, max_workers=2),
+            qubit_op.induced_norm(order=1) - abs(qubit_op.constant))
+
+
+def test_jordan_wigner_one_norm_zero():
+    assert jordan_wigner_one_norm(openfermion.FermionOperator(), 2) == 0
+    assert jordan_wigner_one_norm(openfermion.FermionOperator((), 1.5)) == 0
+
+
+def test_fermionic_linear_operator_n_qubits():
+    operator = openfermion.FermionOperator('0^ 1', 1.0)
+    linear_op = FermionicLinearOperator(operator, n_qubits=3)
+    matrix = openfermion.get_sparse_operator(operator, 3)
+    vector = numpy.arange(8.0)
+    assert linear_op.shape == (8, 8)
+    numpy.testing.assert_allclose(linear_op @ vector, matrix @ vector)
+
+
+def test_fermionic_linear_operator_bad_type():
+    with pytest.raises(TypeError):
+        _ = FermionicLinearOperator(openfermion.QubitOperator('X0'))
+    with pytest.raises(TypeError):
+        _ = jordan_wigner_one_norm(openfermion.QubitOperator('X0'))
@@ -12,15 +12,47 @@
 
 """A class for studying variational ansatzes with an associated Hamiltonian."""
 
-from typing import Optional, Tuple, Union
+from typing import (
+        Dict, List, NamedTuple, Optional, Sequence, Tuple, Union)
 
 import numpy
+import scipy.sparse
+import scipy.sparse.linalg
 import scipy.special
+import sympy
 
 import cirq
 import openfermion
 
+from openfermioncirq.optimization import profiling
+from openfermioncirq.preprocessing_cache import PreprocessingCache
+from openfermioncirq.variational.fermionic_linear_operator import (
+        FermionicLinearOperator, jordan_wigner_one_norm)
 from openfermioncirq.variational.objective import VariationalObjective
+from openfermioncirq.variational.shared_memory import SharedCSRMatrix
+from openfermioncirq.variational.simulation import number_sector_indices
+
+
+PauliMeasurementGroup = NamedTuple('PauliMeasurementGroup', [
+    ('bases', Tuple[str, ...]),
+    ('masks', numpy.ndarray),
+    ('coefficients', numpy.ndarray)])
+PauliMeasurementGroup.__doc__ = """Pauli terms that are measured together.
+
+Attributes:
+    bases: The basis, 'X', 'Y' or 'Z', in which each qubit is measured.
+    masks: A 2d boolean array whose rows indicate the qubits that each term
+        acts on.
+    coefficients: The real coefficients of the terms.
+"""
+
+# The number of entries of the blocks of basis states that a linear operator
+# is applied to when it is restricted to a particle number
+_RESTRICTION_BLOCK_ENTRIES = 2**22
+
+# The rotations that map the eigenbases of X, Y and Z onto the computational
+# basis, given as the phase exponent and exponent of a PhasedXPowGate
+_BASIS_ROTATIONS = {'X': (0.5, -0.5), 'Y': (0.0, 0.5), 'Z': (0.0, 0.0)}
 
 
 class HamiltonianObjective(VariationalObjective):
@@ -34,6 +66,12 @@ class HamiltonianObjective(VariationalObjective):
     variance is inversely proportional to the number of measurements taken.
     The cost corresponds to the number of measurements performed.
 
+    The expectation value can also be estimated from measurements. The Pauli
+    terms of the Jordan-Wigner transformed Hamiltonian are partitioned into
+    groups of terms that commute qubit-wise, so that all of the terms of a
+    group are estimated from the same measurements in a product basis (see
+    `measurement_groups`, `measurement_circuit` and `value_from_samples`).
+
     Attributes:
         hamiltonian: The Hamiltonian of interest, represented
             as a FermionOperator, QubitOperator, InteractionOperator, or
@@ -52,35 +90,91 @@ class HamiltonianObjective(VariationalObjective):
                      openfermion.FermionOperator,
                      openfermion.InteractionOperator,
                      openfermion.QubitOperator],
-                 use_linear_op: bool=False) -> None:
+                 use_linear_op: bool=False,
+                 use_shared_memory: bool=False,
+                 cache: Optional[PreprocessingCache]=None) -> None:
         """
         Args:
             hamiltonian: The Hamiltonian.
             use_linear_op: Whether to use a LinearOperator instead of a sparse
                 matrix to compute expectation values. Using a LinearOperator
-                is more memory-efficient but results in much slower expectation
-                value computation.
+                is more memory-efficient. Fermionic Hamiltonians use a
+                FermionicLinearOperator, which is built directly from the
+                fermionic terms and is close to the sparse matrix in speed;
+                a QubitOperator uses a LinearQubitOperator, which results in
+                much slower expectation value computation.
+            use_shared_memory: Whether to store the sparse matrix of the
+                Hamiltonian in shared memory. Worker processes that receive
+                the objective through multiprocessing then attach to the
+                matrix instead of each holding a copy of it. Ignored if
+                `use_linear_op` is True.
+            cache: A cache on disk in which to store the sparse matrix of the
+                Hamiltonian and the variance bound, keyed by the terms of the
+                Hamiltonian. Objectives constructed for the same Hamiltonian
+                in other processes then read the matrix from the cache,
+                memory-mapped, instead of recomputing it.
         """
         self.hamiltonian = hamiltonian
+        self._shared_matrix = None  # type: Optional[SharedCSRMatrix]
+        self._number_sector_matrices = {} \
+            # type: Dict[int, scipy.sparse.csr_matrix]
+        self._measurement_groups = None \
+            # type: Optional[List[PauliMeasurementGroup]]
+        self._measurement_constant = 0.0
 
-        if isinstance(hamiltonian, openfermion.QubitOperator):
-            hamiltonian_qubit_op = hamiltonian
-        else:
-            hamiltonian_qubit_op = openfermion.jordan_wigner(hamiltonian)
+        n_qubits = openfermion.count_qubits(hamiltonian)
 
         if use_linear_op:
-            self._hamiltonian_linear_op = openfermion.LinearQubitOperator(
-                    hamiltonian_qubit_op)
+            if isinstance(hamiltonian, openfermion.QubitOperator):
+                self._hamiltonian_linear_op = openfermion.LinearQubitOperator(
+                        hamiltonian)
+            else:
+                self._hamiltonian_linear_op = FermionicLinearOperator(
+                        hamiltonian, n_qubits)
+        elif cache is None:
+            self._hamiltonian_linear_op = _sparse_operator(hamiltonian,
+                                                           n_qubits)
         else:
-            self._hamiltonian_linear_op = openfermion.get_sparse_operator(
-                    hamiltonian_qubit_op)
+            self._hamiltonian_linear_op = cache.get_or_compute(
+                    cache.key('HamiltonianObjective.sparse_operator',
+                              _hamiltonian_key_parts(hamiltonian)),
+                    lambda: {'matrix': _sparse_operator(hamiltonian,
+                                                        n_qubits)}
+                    )['matrix']
 
         # The variance bound is the squared one-norm of the coefficients,
         # omitting the constant term
-        one_norm_minus_constant = (
-                hamiltonian_qubit_op.induced_norm(order=1)
-                - abs(hamiltonian_qubit_op.constant))
-        self.variance_bound = one_norm_minus_constant**2
+        if cache is None:
+            self.variance_bound = _variance_bound(hamiltonian, n_qubits)
+        else:
+            self.variance_bound = float(cache.get_or_compute(
+                    cache.key('HamiltonianObjective.variance_bound',
+                              _hamiltonian_key_parts(hamiltonian)),
+                    lambda: {'variance_bound': _variance_bound(hamiltonian,
+                                                               n_qubits)}
+                    )['variance_bound'])
+
+        if use_shared_memory and not use_linear_op:
+            self._shared_matrix = SharedCSRMatrix(self._hamiltonian_linear_op)
+            self._hamiltonian_linear_op = self._shared_matrix.matrix
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The restricted matrices are recomputed on demand
+        state['_number_sector_matrices'] = {}
+        if self._shared_matrix is not None:
+            # The matrix is reconstructed from the shared memory segments
+            del state['_hamiltonian_linear_op']
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_number_sector_matrices', {})
+        state.setdefault('_measurement_groups', None)
+        state.setdefault('_measurement_constant', 0.0)
+        self.__dict__.update(state)
+        self._shared_matrix = state.get('_shared_matrix')
+        if self._shared_matrix is not None:
+            self._hamiltonian_linear_op = self._shared_matrix.matrix
 
     def value(self,
               circuit_output: Union[cirq.TrialResult,
@@ -89,19 +183,221 @@ class HamiltonianObjective(VariationalObjective):
               ) -> float:
         """The evaluation function for a circuit output."""
         if isinstance(circuit_output, numpy.ndarray):
-            return openfermion.expectation(
-                    self._hamiltonian_linear_op,
-                    circuit_output).real
+            with profiling.span('expectation_value'):
+                return openfermion.expectation(
+                        self._hamiltonian_linear_op,
+                        circuit_output).real
         elif isinstance(circuit_output, cirq.WaveFunctionTrialResult):
-            return openfermion.expectation(
-                    self._hamiltonian_linear_op,
-                    circuit_output.final_state).real
+            with profiling.span('expectation_value'):
+                return openfermion.expectation(
+                        self._hamiltonian_linear_op,
+                        circuit_output.final_state).real
         else:
             # TODO implement this
             raise NotImplementedError(
                     "Don't know how to compute the value of a TrialResult that "
                     "is not an SimulationTrialResult.")
 
+    def number_sector_matrix(self,
+                             particle_number: int) -> scipy.sparse.csr_matrix:
+        """The Hamiltonian restricted to a fixed particle number.
+
+        The rows and columns of the matrix correspond to the computational
+        basis states with `particle_number` qubits set to 1, in increasing
+        order of their indices (see `number_sector_indices`). The matrix is
+        computed once for each particle number.
+
+        If the Hamiltonian is held as a sparse matrix, the restricted matrix
+        is sliced from it. Otherwise the full matrix is never formed: a
+        FermionicLinearOperator computes the entries of the sector directly,
+        and any other linear operator is applied to blocks of the sector's
+        basis states.
+        """
+        if particle_number not in self._number_sector_matrices:
+            operator = self._hamiltonian_linear_op
+            indices = number_sector_indices(self.n_qubits, particle_number)
+            if scipy.sparse.issparse(operator):
+                matrix = scipy.sparse.csr_matrix(operator)[indices][:, indices]
+            elif isinstance(operator, FermionicLinearOperator):
+                matrix = operator.restricted_sparse_matrix(indices)
+            else:
+                matrix = _restricted_matrix(operator, indices)
+            self._number_sector_matrices[particle_number] = matrix
+        return self._number_sector_matrices[particle_number]
+
+    @property
+    def n_qubits(self) -> int:
+        """The number of qubits that the Hamiltonian acts on."""
+        return int(numpy.log2(self._hamiltonian_linear_op.shape[0]))
+
+    def measurement_groups(self) -> List[PauliMeasurementGroup]:
+        """Partition the Pauli terms into qubit-wise commuting groups.
+
+        The non-identity terms of the Jordan-Wigner transformed Hamiltonian
+        are assigned greedily, in order of decreasing magnitude of their
+        coefficients, to the first group in which they commute qubit-wise
+        with all other terms. The groups are computed once.
+        """
+        if self._measurement_groups is None:
+            qubit_operator = self._qubit_operator()
+            self._measurement_constant = qubit_operator.constant.real
+            self._measurement_groups = _qubit_wise_commuting_groups(
+                    qubit_operator, self.n_qubits)
+        return self._measurement_groups
+
+    def measurement_circuit(self,
+                            qubits: Sequence[cirq.Qid],
+                            key: str='hamiltonian') -> cirq.Circuit:
+        """A circuit that measures the qubits in a parameterized basis.
+
+        Each qubit is rotated by a PhasedXPowGate with symbolic parameters,
+        and then all of the qubits are measured. The parameter values that
+        select the bases of each measurement group are given by
+        `measurement_resolvers`, so that one circuit serves all groups.
+
+        Args:
+            qubits: The qubits, where qubit p corresponds to qubit p of the
+                Hamiltonian.
+            key: The measurement key.
+        """
+        return cirq.Circuit(
+                [cirq.PhasedXPowGate(
+                    phase_exponent=sympy.Symbol(
+                        'measurement_phase_{}'.format(p)),
+                    exponent=sympy.Symbol(
+                        'measurement_exponent_{}'.format(p))).on(qubit)
+                 for p, qubit in enumerate(qubits)],
+                cirq.measure(*qubits, key=key))
+
+    def measurement_resolvers(self) -> List[Dict[str, float]]:
+        """The parameter values of the measurement circuit for each group."""
+        resolvers = []
+        for group in self.measurement_groups():
+            resolver = {}
+            for p, basis in enumerate(group.bases):
+                phase_exponent, exponent = _BASIS_ROTATIONS[basis]
+                resolver['measurement_phase_{}'.format(p)] = phase_exponent
+                resolver['measurement_exponent_{}'.format(p)] = exponent
+            resolvers.append(resolver)
+        return resolvers
+
+    def shots_per_group(self,
+                        cost: float,
+                        standard_deviations: Optional[numpy.ndarray]=None
+                        ) -> numpy.ndarray:
+        """The number of measurements of each group for a given cost.
+
+        The cost, rounded to an integer, is the total number of
+        measurements, with at least one measurement per group; a cost below
+        the number of groups measures each group once. If the standard
+        deviations of the per-shot values of the groups (see
+        `group_sample_values`) are given, the cost is distributed in
+        proportion to them, which minimizes the variance of the estimate.
+        Otherwise, and for groups whose standard deviation is NaN, the sum of
+        the magnitudes of the coefficients of the group, which bounds its
+        standard deviation, is used instead. With the latter allocation, the
+        variance of the estimate is at most `variance_bound / cost`.
+
+        Groups whose share would be less than one measurement are measured
+        once and the rest of the cost is shared among the other groups. The
+        shares are rounded down and the measurements left over go to the
+        groups with the largest remainders, so that the numbers of
+        measurements add up to the total exactly.
+        """
+        weights = numpy.array([numpy.sum(numpy.abs(group.coefficients))
+                               for group in self.measurement_groups()])
+        if standard_deviations is not None:
+            weights = numpy.where(numpy.isnan(standard_deviations),
+                                  weights, standard_deviations)
+        if not numpy.sum(weights):
+            weights = numpy.ones(len(weights))
+        total = max(int(round(cost)), len(weights))
+
+        shots = numpy.ones(len(weights), dtype=int)
+        free = numpy.ones(len(weights), dtype=bool)
+        shares = numpy.zeros(len(weights))
+        while numpy.any(free):
+            shares[free] = ((total - numpy.sum(~free)) * weights[free]
+                            / numpy.sum(weights[free]))
+            below_one = free & (shares < 1)
+            if not numpy.any(below_one):
+                break
+            free &= ~below_one
+        shots[free] = numpy.floor(shares[free])
+        remainders = numpy.where(free, shares - shots, -1.0)
+        left_over = total - numpy.sum(shots)
+        shots[numpy.argsort(-remainders, kind='stable')[:left_over]] += 1
+        return shots
+
+    def group_sample_values(self,
+                            samples: Sequence[numpy.ndarray]
+                            ) -> List[numpy.ndarray]:
+        """The value of each measured bitstring for each group.
+
+        The value of a bitstring is the sum of the coefficients of the terms
+        of the group, each multiplied by the parity of the bits that the term
+        acts on, as +1 or -1. The mean value of a group's bitstrings
+        estimates the expectation value of the group's terms.
+
+        Args:
+            samples: For each measurement group, a 2d array whose rows are
+                the measured bitstrings, as obtained by running the
+                measurement circuit with the group's parameter values.
+        """
+        values = []
+        with profiling.span('estimate'):
+            for group, bits in zip(self.measurement_groups(), samples):
+                # The parity of the measured bits that each term acts on
+                parities = (numpy.asarray(bits, dtype=numpy.int64)
+                            @ group.masks.T.astype(numpy.int64)) & 1
+                values.append((1 - 2 * parities) @ group.coefficients)
+        return values
+
+    def value_from_samples(self, samples: Sequence[numpy.ndarray]) -> float:
+        """Estimate the expectation value from measurement results.
+
+        Args:
+            samples: For each measurement group, a 2d array whose rows are
+                the measured bitstrings, as obtained by running the
+                measurement circuit with the group's parameter values.
+        """
+        return self.value_from_group_values(self.group_sample_values(samples))
+
+    def value_from_group_values(self,
+                                group_values: Sequence[numpy.ndarray]
+                                ) -> float:
+        """Estimate the expectation value from the values of each group.
+
+        Args:
+            group_values: For each measurement group, the values of the
+                measured bitstrings, as returned by `group_sample_values`.
+        """
+        self.measurement_groups()
+        return float(self._measurement_constant + sum(
+                numpy.mean(values) for values in group_values))
+
+    def _qubit_operator(self) -> openfermion.QubitOperator:
+        if isinstance(self.hamiltonian, openfermion.QubitOperator):
+            return self.hamiltonian
+        return openfermion.jordan_wigner(self.hamiltonian)
+
+    def apply_hamiltonian(self, state: numpy.ndarray) -> numpy.ndarray:
+        """Apply the Hamiltonian to a state vector."""
+        with profiling.span('apply_hamiltonian'):
+            return self._hamiltonian_linear_op @ state
+
+    def value_batch(self, circuit_outputs: numpy.ndarray) -> numpy.ndarray:
+        """The expectation values of many state vectors.
+
+        The Hamiltonian is applied to all of the states with a single
+        matrix-matrix product.
+        """
+        states = numpy.asarray(circuit_outputs).T
+        with profiling.span('expectation_value'):
+            return numpy.real(numpy.sum(
+                    states.conj() * (self._hamiltonian_linear_op @ states),
+                    axis=0))
+
     def noise(self, cost: Optional[float]=None) -> float:
         """A sample from a normal distribution with mean 0.
 
@@ -140,3 +436,106 @@ class HamiltonianObjective(VariationalObjective):
         sigmas = scipy.special.erfinv(confidence) * numpy.sqrt(2)
         magnitude_bound = sigmas * numpy.sqrt(self.variance_bound / cost)
         return -magnitude_bound, magnitude_bound
+
+
+def _sparse_operator(hamiltonian: Union[
+                         openfermion.DiagonalCoulombHamiltonian,
+                         openfermion.FermionOperator,
+                         openfermion.InteractionOperator,
+                         openfermion.QubitOperator],
+                     n_qubits: int) -> scipy.sparse.spmatrix:
+    if isinstance(hamiltonian, openfermion.QubitOperator):
+        return openfermion.get_sparse_operator(hamiltonian, n_qubits)
+    # The matrix is computed directly from the fermionic terms, without
+    # constructing the Jordan-Wigner transformed QubitOperator
+    return FermionicLinearOperator(hamiltonian, n_qubits).sparse_matrix()
+
+
+def _restricted_matrix(operator: scipy.sparse.linalg.LinearOperator,
+                       basis_indices: numpy.ndarray
+                       ) -> scipy.sparse.csr_matrix:
+    """A linear operator restricted to a subset of the basis states.
+
+    The operator is applied to blocks of the basis states of the subset, so
+    that only a few vectors of the full dimension are held at once.
+    """
+    dimension = operator.shape[0]
+    size = len(basis_indices)
+    block_size = max(1, _RESTRICTION_BLOCK_ENTRIES // dimension)
+    blocks = []
+    for start in range(0, size, block_size):
+        columns = basis_indices[start:start + block_size]
+        basis_states = numpy.zeros((dimension, len(columns)),
+                                   dtype=numpy.complex128)
+        basis_states[columns, numpy.arange(len(columns))] = 1
+        blocks.append(scipy.sparse.csc_matrix(
+                numpy.asarray(operator @ basis_states)[basis_indices]))
+    return scipy.sparse.hstack(blocks, format='csr')
+
+
+def _variance_bound(hamiltonian: Union[
+                        openfermion.DiagonalCoulombHamiltonian,
+                        openfermion.FermionOperator,
+                        openfermion.InteractionOperator,
+                        openfermion.QubitOperator],
+                    n_qubits: int) -> float:
+    if isinstance(hamiltonian, openfermion.QubitOperator):
+        one_norm_minus_constant = (hamiltonian.induced_norm(order=1)
+                                   - abs(hamiltonian.constant))
+    else:
+        one_norm_minus_constant = jordan_wigner_one_norm(hamiltonian,
+                                                         n_qubits)
+    return one_norm_minus_constant**2
+
+
+def _qubit_wise_commuting_groups(qubit_operator: openfermion.QubitOperator,
+                                 n_qubits: int
+                                 ) -> List[PauliMeasurementGroup]:
+    terms = sorted(((term, coefficient)
+                    for term, coefficient in qubit_operator.terms.items()
+                    if term),
+                   key=lambda item: -abs(item[1]))
+    group_bases = []  # type: List[Dict[int, str]]
+    group_terms = []  # type: List[List[Tuple]]
+    for term, coefficient in terms:
+        for bases, members in zip(group_bases, group_terms):
+            if all(bases.get(qubit, action) == action
+                   for qubit, action in term):
+                break
+        else:
+            bases = {}
+            members = []
+            group_bases.append(bases)
+            group_terms.append(members)
+        bases.update(term)
+        members.append((term, coefficient))
+
+    groups = []
+    for bases, members in zip(group_bases, group_terms):
+        masks = numpy.zeros((len(members), n_qubits), dtype=bool)
+        for i, (term, _) in enumerate(members):
+            masks[i, [qubit for qubit, _ in term]] = True
+        groups.append(PauliMeasurementGroup(
+            tuple(bases.get(qubit, 'Z') for qubit in range(n_qubits)),
+            masks,
+            numpy.array([numpy.real(coefficient)
+                         for _, coefficient in members])))
+    return groups
+
+
+def _hamiltonian_key_parts(hamiltonian: Union[
+                               openfermion.DiagonalCoulombHamiltonian,
+                               openfermion.FermionOperator,
+                               openfermion.InteractionOperator,
+                               openfermion.QubitOperator]) -> Tuple:
+    """The parts of a preprocessing cache key identifying a Hamiltonian."""
+    if isinstance(hamiltonian, openfermion.SymbolicOperator):
+        return (type(hamiltonian).__name__,
+                sorted((term, complex(coefficient))
+                       for term, coefficient in hamiltonian.terms.items()))
+    if isinstance(hamiltonian, openfermion.DiagonalCoulombHamiltonian):
+        tensors = (hamiltonian.one_body, hamiltonian.two_body)
+    else:
+        tensors = (hamiltonian.one_body_tensor, hamiltonian.two_body_tensor)
+    return (type(hamiltonian).__name__, complex(hamiltonian.constant),
+            tensors)
@@ -10,13 +10,17 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import multiprocessing.reduction
+import pickle
+
 import numpy
 import cirq
 import openfermion
 from openfermion import random_diagonal_coulomb_hamiltonian
 import pytest
 
-from openfermioncirq import HamiltonianObjective
+from openfermioncirq import (
+        FermionicLinearOperator, HamiltonianObjective, PreprocessingCache)
 
 
 # Construct a Hamiltonian for testing
@@ -49,6 +53,201 @@ def test_hamiltonian_objective_value():
             obj_linear_op.value(result.final_state), correct_val, 1e-5)
 
 
+def test_hamiltonian_objective_linear_op_type():
+    obj = HamiltonianObjective(test_hamiltonian, use_linear_op=True)
+    assert isinstance(obj._hamiltonian_linear_op, FermionicLinearOperator)
+
+    obj = HamiltonianObjective(openfermion.jordan_wigner(test_fermion_op),
+                               use_linear_op=True)
+    assert isinstance(obj._hamiltonian_linear_op,
+                      openfermion.LinearQubitOperator)
+
+
+def test_hamiltonian_objective_value_batch():
+    obj = HamiltonianObjective(test_hamiltonian)
+    obj_linear_op = HamiltonianObjective(test_hamiltonian, use_linear_op=True)
+    states = numpy.array([openfermion.haar_random_vector(16, seed=seed)
+                          for seed in range(3)])
+    correct_vals = [obj.value(state) for state in states]
+
+    numpy.testing.assert_allclose(obj.value_batch(states), correct_vals)
+    numpy.testing.assert_allclose(
+            obj_linear_op.value_batch(states), correct_vals)
+
+
+def test_hamiltonian_objective_number_sector_matrix():
+    hamiltonian_sparse = openfermion.get_sparse_operator(test_hamiltonian)
+    indices = [3, 5, 6, 9, 10, 12]
+    expected = hamiltonian_sparse.toarray()[numpy.ix_(indices, indices)]
+
+    for obj in (HamiltonianObjective(test_hamiltonian),
+                HamiltonianObjective(test_hamiltonian, use_linear_op=True),
+                HamiltonianObjective(openfermion.jordan_wigner(
+                    test_hamiltonian), use_linear_op=True)):
+        matrix = obj.number_sector_matrix(2)
+        numpy.testing.assert_allclose(matrix.toarray(), expected)
+        assert obj.number_sector_matrix(2) is matrix
+
+    unpickled = pickle.loads(pickle.dumps(obj))
+    assert not unpickled._number_sector_matrices
+
+
+def test_hamiltonian_objective_number_sector_matrix_without_full_matrix(
+        monkeypatch):
+    obj = HamiltonianObjective(test_hamiltonian, use_linear_op=True)
+    hamiltonian_sparse = openfermion.get_sparse_operator(test_hamiltonian)
+    indices = [3, 5, 6, 9, 10, 12]
+
+    def sparse_matrix(*args, **kwargs):
+        raise AssertionError('The full matrix was built.')
+    monkeypatch.setattr(FermionicLinearOperator, 'sparse_matrix',
+                        sparse_matrix)
+
+    numpy.testing.assert_allclose(
+            obj.number_sector_matrix(2).toarray(),
+            hamiltonian_sparse.toarray()[numpy.ix_(indices, indices)])
+
+
+def test_hamiltonian_objective_shared_memory():
+    obj = HamiltonianObjective(test_hamiltonian)
+    obj_shared = HamiltonianObjective(test_hamiltonian,
+                                      use_shared_memory=True)
+    state = openfermion.haar_random_vector(16, seed=6131)
+    numpy.testing.assert_allclose(obj_shared.value(state), obj.value(state))
+
+    attached = pickle.loads(
+            multiprocessing.reduction.ForkingPickler.dumps(obj_shared))
+    shared_data = attached._shared_matrix._arrays[0]
+    assert shared_data.name == obj_shared._shared_matrix._arrays[0].name
+    assert numpy.shares_memory(attached._hamiltonian_linear_op.data,
+                               shared_data.array)
+    numpy.testing.assert_allclose(attached.value(state), obj.value(state))
+
+    copied = pickle.loads(pickle.dumps(obj_shared))
+    assert not numpy.shares_memory(copied._hamiltonian_linear_op.data,
+                                   obj_shared._hamiltonian_linear_op.data)
+    numpy.testing.assert_allclose(copied.value(state), obj.value(state))
+
+
+@pytest.mark.parametrize('hamiltonian', [
+    test_hamiltonian,
+    test_fermion_op,
+    openfermion.random_interaction_operator(4, real=False, seed=5210),
+])
+def test_hamiltonian_objective_variance_bound(hamiltonian):
+    qubit_op = openfermion.jordan_wigner(hamiltonian)
+    one_norm = qubit_op.induced_norm(order=1) - abs(qubit_op.constant)
+    obj = HamiltonianObjective(hamiltonian)
+    numpy.testing.assert_allclose(obj.variance_bound, one_norm**2)
+    numpy.testing.assert_allclose(
+            HamiltonianObjective(qubit_op).variance_bound, one_norm**2)
+
+    matrix = openfermion.get_sparse_operator(qubit_op)
+    numpy.testing.assert_allclose(obj._hamiltonian_linear_op.toarray(),
+                                  matrix.toarray(), atol=1e-12)
+
+
+@pytest.mark.parametrize('hamiltonian', [
+    test_hamiltonian,
+    test_fermion_op,
+    openfermion.jordan_wigner(test_fermion_op),
+])
+def test_hamiltonian_objective_cache(hamiltonian, tmpdir):
+    cache = PreprocessingCache(str(tmpdir))
+    obj = HamiltonianObjective(hamiltonian)
+    first = HamiltonianObjective(hamiltonian, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    second = HamiltonianObjective(hamiltonian, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    state = openfermion.haar_random_vector(16, seed=2241)
+    for cached in (first, second):
+        numpy.testing.assert_allclose(cached.variance_bound,
+                                      obj.variance_bound)
+        numpy.testing.assert_allclose(cached.value(state), obj.value(state))
+
+    # A different Hamiltonian doesn't use the same entries
+    _ = HamiltonianObjective(2 * hamiltonian, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_hamiltonian_objective_measurement_groups():
+    hamiltonian = openfermion.random_interaction_operator(4, real=False,
+                                                          seed=7315)
+    obj = HamiltonianObjective(hamiltonian)
+    groups = obj.measurement_groups()
+    assert obj.measurement_groups() is groups
+    assert obj.n_qubits == 4
+
+    # The groups contain every non-identity term once
+    qubit_op = openfermion.jordan_wigner(hamiltonian)
+    assert sum(len(group.coefficients) for group in groups) == len(
+            qubit_op.terms) - 1
+    for group in groups:
+        assert len(group.bases) == 4
+        assert set(group.bases) <= {'X', 'Y', 'Z'}
+        assert group.masks.shape == (len(group.coefficients), 4)
+
+    weights = [numpy.sum(numpy.abs(group.coefficients)) for group in groups]
+    shots = obj.shots_per_group(1e4)
+    assert numpy.sum(shots) == 1e4
+    assert shots[numpy.argmax(weights)] == numpy.max(shots)
+    assert numpy.all(obj.shots_per_group(1) >= 1)
+
+    standard_deviations = numpy.full(len(groups), numpy.nan)
+    standard_deviations[0] = 0.0
+    standard_deviations[1] = 2 * weights[1]
+    shots = obj.shots_per_group(1e4, standard_deviations)
+    assert shots[0] == 1
+    assert abs(shots[1] / shots[2] - 2 * weights[1] / weights[2]) < 0.1
+
+
+def test_hamiltonian_objective_shots_per_group_total():
+    # One large term and many small terms that fall into separate groups
+    hamiltonian = openfermion.QubitOperator('Z0 Z1 Z2 Z3', 100.0)
+    for p in range(4):
+        for pauli in 'XY':
+            hamiltonian += openfermion.QubitOperator(
+                    '{}{}'.format(pauli, p), 0.01 * (p + 1))
+    obj = HamiltonianObjective(hamiltonian)
+    num_groups = len(obj.measurement_groups())
+    assert num_groups > 2
+
+    for cost in [num_groups, 10, 11, 37, 100, 1000.4, 1e4]:
+        shots = obj.shots_per_group(cost)
+        assert numpy.sum(shots) == max(round(cost), num_groups)
+        assert numpy.all(shots >= 1)
+    standard_deviations = numpy.full(num_groups, 0.001)
+    standard_deviations[0] = numpy.nan
+    assert numpy.sum(obj.shots_per_group(53, standard_deviations)) == 53
+
+    # Costs below the number of groups measure each group once
+    numpy.testing.assert_equal(obj.shots_per_group(1),
+                               numpy.ones(num_groups))
+
+
+def test_hamiltonian_objective_value_from_samples():
+    hamiltonian = openfermion.random_interaction_operator(3, real=False,
+                                                          seed=1204)
+    obj = HamiltonianObjective(hamiltonian)
+    qubits = cirq.LineQubit.range(3)
+    circuit = cirq.testing.random_circuit(qubits, 5, 0.9, random_state=3306)
+    state = circuit.final_wavefunction(qubit_order=qubits)
+
+    results = cirq.Simulator(seed=5302).run_sweep(
+            circuit + obj.measurement_circuit(qubits, key='m'),
+            obj.measurement_resolvers(),
+            repetitions=20000)
+    samples = [result.measurements['m'] for result in results]
+    estimate = obj.value_from_samples(samples)
+    group_values = obj.group_sample_values(samples)
+    assert [len(values) for values in group_values] == [20000] * len(samples)
+    assert obj.value_from_group_values(group_values) == estimate
+    numpy.testing.assert_allclose(
+            estimate, obj.value(state),
+            atol=5 * numpy.sqrt(obj.variance_bound / 20000))
+
+
 def test_hamiltonian_objective_noise():
 
     obj = HamiltonianObjective(test_hamiltonian)
@@ -0,0 +1,105 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""An append-only log for persisting results incrementally."""
+
+from typing import Any, IO, List, Optional
+
+import os
+import pickle
+import struct
+import zlib
+
+
+# Each record is framed by its length and CRC32 checksum
+_HEADER = struct.Struct('<II')
+
+
+class Journal:
+    """An append-only, crash-safe log of picklable records.
+
+    Each record is written to the end of the file and flushed to disk before
+    `append` returns. If the process is interrupted while writing a record,
+    the incomplete record is detected by its length and checksum and is
+    discarded when the journal is read.
+
+    Attributes:
+        filename: The name of the journal file.
+    """
+
+    def __init__(self, filename: str) -> None:
+        """
+        Args:
+            filename: The name of the journal file.
+        """
+        self.filename = filename
+        self._file = None  # type: Optional[IO[bytes]]
+
+    def create(self, first_record: Any) -> None:
+        """Start a new journal containing a single record.
+
+        An existing journal with the same filename is atomically replaced.
+        """
+        self.close()
+        temp_filename = '{}.tmp'.format(self.filename)
+        with open(temp_filename, 'wb') as f:
+            f.write(_frame(first_record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+
+    def append(self, record: Any) -> None:
+        """Append a record to the journal and flush it to disk."""
+        if self._file is None:
+            # Discard an incomplete record left by an interrupted process
+            _, valid_length = self._read()
+            self._file = open(self.filename, 'r+b')
+            self._file.truncate(valid_length)
+            self._file.seek(valid_length)
+        self._file.write(_frame(record))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def read(self) -> List[Any]:
+        """Read all complete records in the journal."""
+        records, _ = self._read()
+        return records
+
+    def exists(self) -> bool:
+        """Whether the journal file exists."""
+        return os.path.isfile(self.filename)
+
+    def close(self) -> None:
+        """Close the journal file if it is open for appending."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read(self):
+        records = []  # type: List[Any]
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + _HEADER.size <= len(data):
+            length, checksum = _HEADER.unpack_from(data, position)
+            start = position + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append(pickle.loads(payload))
+            position = start + length
+        return records, position
+
+
+def _frame(record: Any) -> bytes:
+    payload = pickle.dumps(record)
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
@@ -0,0 +1,49 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+
+from openfermioncirq.variational.journal import Journal
+
+
+def test_journal_append_and_read(tmpdir):
+    journal = Journal(os.path.join(str(tmpdir), 'test.journal'))
+    assert not journal.exists()
+
+    journal.create('header')
+    journal.append(('a', 1))
+    journal.append(('b', [2, 3]))
+    assert journal.exists()
+    assert journal.read() == ['header', ('a', 1), ('b', [2, 3])]
+
+    journal.create('new header')
+    assert journal.read() == ['new header']
+    journal.close()
+
+
+def test_journal_discards_incomplete_record(tmpdir):
+    filename = os.path.join(str(tmpdir), 'test.journal')
+    journal = Journal(filename)
+    journal.create('header')
+    journal.append('complete')
+    journal.append('incomplete')
+    journal.close()
+
+    # Simulate a crash in the middle of writing the last record
+    with open(filename, 'r+b') as f:
+        f.truncate(os.path.getsize(filename) - 3)
+
+    journal = Journal(filename)
+    assert journal.read() == ['header', 'complete']
+    journal.append('next')
+    assert journal.read() == ['header', 'complete', 'next']
+    journal.close()
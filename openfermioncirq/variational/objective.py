@@ -46,6 +46,18 @@ class VariationalObjective(metaclass=abc.ABCMeta):
         possible settings of the parameters.
         """
 
+    def value_batch(self, circuit_outputs: numpy.ndarray) -> numpy.ndarray:
+        """The evaluation function for many final state vectors.
+
+        Args:
+            circuit_outputs: A 2d array whose rows are state vectors.
+
+        Returns:
+            A 1d array containing the value of each state vector.
+        """
+        # Default: defer to `value`
+        return numpy.array([self.value(state) for state in circuit_outputs])
+
     def noise(self, cost: Optional[float]=None) -> float:
         """Artificial noise that may be added to the true objective value.
 
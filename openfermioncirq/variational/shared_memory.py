@@ -0,0 +1,176 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Numpy arrays stored in shared memory segments."""
+
+from typing import Tuple
+
+import multiprocessing.reduction
+import weakref
+
+import numpy
+import scipy.sparse
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # coverage: ignore
+    # Python < 3.8
+    shared_memory = None
+
+
+class SharedArray:
+    """A numpy array stored in a shared memory segment.
+
+    When a SharedArray is sent to another process through multiprocessing
+    (for instance as an argument to a task of a process pool), only the name
+    of its shared memory segment is transmitted. The receiving process
+    attaches to the segment and sees the same data without copying it.
+    When a SharedArray is pickled in any other way, such as when saving it to
+    disk, its data is pickled and unpickling it creates a new segment.
+
+    The process that creates a SharedArray owns the segment and unlinks it
+    when the SharedArray is garbage collected or `unlink` is called. Processes
+    that attached to the segment can keep using it until they release it.
+
+    Attributes:
+        array: A numpy array whose data lives in the shared memory segment.
+            It should be treated as read-only.
+    """
+
+    def __init__(self, array: numpy.ndarray) -> None:
+        """
+        Args:
+            array: The array whose data to copy into a new shared memory
+                segment.
+        """
+        if shared_memory is None:
+            # coverage: ignore
+            raise RuntimeError('Shared memory requires Python 3.8 or later.')
+        array = numpy.ascontiguousarray(array)
+        # Shared memory segments can't be empty
+        segment = shared_memory.SharedMemory(create=True,
+                                             size=max(array.nbytes, 1))
+        self._init(segment, array.shape, array.dtype, owner=True)
+        self.array[...] = array
+
+    def _init(self,
+              segment: 'shared_memory.SharedMemory',
+              shape: Tuple[int, ...],
+              dtype: numpy.dtype,
+              owner: bool) -> None:
+        self._segment = segment
+        self.array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        self._finalizer = weakref.finalize(
+                self, _release_segment, segment, owner)
+
+    @classmethod
+    def _attach(cls,
+                name: str,
+                shape: Tuple[int, ...],
+                dtype: numpy.dtype) -> 'SharedArray':
+        shared_array = cls.__new__(cls)
+        shared_array._init(shared_memory.SharedMemory(name=name),
+                           shape, dtype, owner=False)
+        return shared_array
+
+    @property
+    def name(self) -> str:
+        """The name of the shared memory segment."""
+        return self._segment.name
+
+    def unlink(self) -> None:
+        """Release the array and, if this process owns it, the segment."""
+        self._finalizer()
+
+    def __array__(self, dtype=None) -> numpy.ndarray:
+        return numpy.asarray(self.array, dtype=dtype)
+
+    def __reduce__(self):
+        return SharedArray, (numpy.array(self.array),)
+
+
+def _release_segment(segment: 'shared_memory.SharedMemory',
+                     owner: bool) -> None:
+    try:
+        segment.close()
+    except BufferError:  # coverage: ignore
+        # An array that views the segment is still alive. The mapping is
+        # released when the process exits.
+        pass
+    if owner:
+        segment.unlink()
+
+
+def _reduce_shared_array(shared_array: SharedArray):
+    return SharedArray._attach, (shared_array.name,
+                                 shared_array.array.shape,
+                                 shared_array.array.dtype)
+
+
+multiprocessing.reduction.ForkingPickler.register(SharedArray,
+                                                  _reduce_shared_array)
+
+
+class SharedCSRMatrix:
+    """A scipy CSR matrix whose arrays are stored in shared memory.
+
+    Like SharedArray, a SharedCSRMatrix sent to another process through
+    multiprocessing transmits only the names of its shared memory segments,
+    and the receiving process reconstructs the matrix around them without
+    copying.
+
+    Attributes:
+        matrix: A scipy.sparse.csr_matrix whose data, indices and indptr
+            arrays live in shared memory. It should be treated as read-only.
+    """
+
+    def __init__(self, matrix: scipy.sparse.spmatrix) -> None:
+        """
+        Args:
+            matrix: The sparse matrix whose data to copy into shared memory.
+        """
+        matrix = scipy.sparse.csr_matrix(matrix)
+        self._init(SharedArray(matrix.data),
+                   SharedArray(matrix.indices),
+                   SharedArray(matrix.indptr),
+                   matrix.shape)
+
+    def _init(self,
+              data: SharedArray,
+              indices: SharedArray,
+              indptr: SharedArray,
+              shape: Tuple[int, int]) -> None:
+        self._arrays = (data, indices, indptr)
+        self.matrix = scipy.sparse.csr_matrix(
+                (data.array, indices.array, indptr.array),
+                shape=shape,
+                copy=False)
+
+    @classmethod
+    def _from_shared_arrays(cls,
+                            data: SharedArray,
+                            indices: SharedArray,
+                            indptr: SharedArray,
+                            shape: Tuple[int, int]) -> 'SharedCSRMatrix':
+        shared_matrix = cls.__new__(cls)
+        shared_matrix._init(data, indices, indptr, shape)
+        return shared_matrix
+
+    def unlink(self) -> None:
+        """Release the shared memory segments of the matrix."""
+        self.matrix = None
+        for shared_array in self._arrays:
+            shared_array.unlink()
+
+    def __reduce__(self):
+        return SharedCSRMatrix._from_shared_arrays, (
+                *self._arrays, self.matrix.shape)
@@ -0,0 +1,82 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import multiprocessing
+import multiprocessing.reduction
+import pickle
+
+import numpy
+import scipy.sparse
+
+from openfermioncirq.variational.shared_memory import (
+        SharedArray,
+        SharedCSRMatrix)
+
+
+def _sum_of_shared_array(shared_array):
+    return float(numpy.sum(shared_array.array))
+
+
+def test_shared_array_forking_pickle_attaches():
+    array = numpy.arange(1000, dtype=numpy.float64)
+    shared_array = SharedArray(array)
+    numpy.testing.assert_allclose(numpy.asarray(shared_array), array)
+
+    dumped = multiprocessing.reduction.ForkingPickler.dumps(shared_array)
+    assert len(dumped) < array.nbytes
+    attached = pickle.loads(dumped)
+    assert attached.name == shared_array.name
+
+    shared_array.array[0] = 17.0
+    assert attached.array[0] == 17.0
+    attached.unlink()
+    shared_array.unlink()
+
+
+def test_shared_array_pickle_copies():
+    shared_array = SharedArray(numpy.arange(5))
+    loaded = pickle.loads(pickle.dumps(shared_array))
+    assert loaded.name != shared_array.name
+    numpy.testing.assert_allclose(loaded.array, shared_array.array)
+
+
+def test_shared_array_in_pool():
+    shared_array = SharedArray(numpy.ones(100))
+    pool = multiprocessing.Pool(2)
+    try:
+        sums = pool.map(_sum_of_shared_array, [shared_array] * 3)
+    finally:
+        pool.terminate()
+    assert sums == [100.0] * 3
+
+
+def test_shared_csr_matrix():
+    matrix = scipy.sparse.random(32, 32, density=0.2, format='csr',
+                                 random_state=2961)
+    shared_matrix = SharedCSRMatrix(matrix)
+    assert abs(shared_matrix.matrix - matrix).max() == 0.0
+
+    attached = pickle.loads(
+            multiprocessing.reduction.ForkingPickler.dumps(shared_matrix))
+    assert abs(attached.matrix - matrix).max() == 0.0
+    for shared_array, array in zip(
+            attached._arrays,
+            (attached.matrix.data,
+             attached.matrix.indices,
+             attached.matrix.indptr)):
+        assert numpy.shares_memory(shared_array.array, array)
+
+    copied = pickle.loads(pickle.dumps(shared_matrix))
+    assert abs(copied.matrix - matrix).max() == 0.0
+
+    attached.unlink()
+    assert attached.matrix is None
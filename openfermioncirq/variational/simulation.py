@@ -0,0 +1,733 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Fast simulation of parameterized circuits."""
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import functools
+import itertools
+
+import numpy
+import sympy
+
+import cirq
+
+
+def apply_matrix(states: numpy.ndarray,
+                 matrix: numpy.ndarray,
+                 axes: Sequence[int]) -> numpy.ndarray:
+    """Apply a matrix to some qubits of a stack of state vectors.
+
+    Args:
+        states: An array of shape (B, 2, 2, ..., 2) holding B state vectors
+            of n qubits each, with one axis per qubit.
+        matrix: The matrix to apply, acting on the qubits in the order given
+            by `axes`. Either a 2d array applied to every state, or a 3d array
+            of shape (B, 2**k, 2**k) holding one matrix per state.
+        axes: The k qubit axes that the matrix acts on, numbered from 0 to
+            n - 1 (not counting the leading axis of `states`).
+
+    Returns:
+        A new array with the same shape as `states`.
+    """
+    n = states.ndim - 1
+    k = len(axes)
+    targets = [axis + 1 for axis in axes]
+    ends = list(range(n + 1 - k, n + 1))
+    moved = numpy.moveaxis(states, targets, ends)
+    shape = moved.shape
+    flat = moved.reshape(shape[0], -1, 2**k)
+    if matrix.ndim == 2:
+        result = flat @ matrix.T
+    else:
+        result = flat @ numpy.transpose(matrix, (0, 2, 1))
+    return numpy.moveaxis(result.reshape(shape), ends, targets)
+
+
+def apply_diagonal(states: numpy.ndarray,
+                   diagonal: numpy.ndarray,
+                   axes: Sequence[int]) -> numpy.ndarray:
+    """Apply a diagonal matrix to some qubits of a stack of state vectors.
+
+    Args:
+        states: An array of shape (B, 2, 2, ..., 2) holding B state vectors.
+        diagonal: The diagonal of the matrix to apply. Either a 1d array
+            applied to every state, or a 2d array of shape (B, 2**k) holding
+            one diagonal per state.
+        axes: The k qubit axes that the matrix acts on.
+
+    Returns:
+        A new array with the same shape as `states`.
+    """
+    n = states.ndim - 1
+    k = len(axes)
+    targets = [axis + 1 for axis in axes]
+    ends = list(range(n + 1 - k, n + 1))
+    moved = numpy.moveaxis(states, targets, ends)
+    shape = moved.shape
+    flat = moved.reshape(shape[0], -1, 2**k)
+    if diagonal.ndim == 1:
+        result = flat * diagonal
+    else:
+        result = flat * diagonal[:, numpy.newaxis, :]
+    return numpy.moveaxis(result.reshape(shape), ends, targets)
+
+
+class CompiledCircuit:
+    """A parameterized circuit compiled into a fixed list of gate kernels.
+
+    Compiling a circuit does all of the work that does not depend on the
+    values of its parameters once. Operations without parameters become
+    fixed matrices. Operations with EigenGates whose exponent is an affine
+    function of the parameters store their eigendecomposition together with
+    the coefficients of that function, so that their matrices are computed
+    directly from the parameter array. Any other parameterized operation is
+    resolved with sympy when it is applied. Terminal measurements are
+    ignored.
+
+    If a particle number is given, the circuit is simulated in the subspace
+    of computational basis states with that many qubits set to 1, which has
+    dimension n choose N rather than 2**n. This requires every gate of the
+    circuit to conserve the number of qubits set to 1, as the gates of
+    number-conserving fermionic ansatzes do. State vectors are then given in
+    the basis of `basis_indices`.
+
+    Attributes:
+        params: The Symbols that parameterize the circuit.
+        qubit_order: The order of the qubits in the state vectors.
+        particle_number: The particle number of the subspace that the
+            circuit is simulated in, or None if the full space is used.
+    """
+
+    def __init__(self,
+                 circuit: cirq.Circuit,
+                 params: Sequence[sympy.Symbol],
+                 qubit_order: Sequence[cirq.Qid],
+                 param_scale_factors: Optional[Sequence[float]]=None,
+                 particle_number: Optional[int]=None
+                 ) -> None:
+        """
+        Args:
+            circuit: The circuit to compile.
+            params: The Symbols that parameterize the circuit. The i-th entry
+                of a parameter array gives the value of the i-th Symbol.
+            qubit_order: The order of the qubits in the state vectors.
+            param_scale_factors: Optional factors that the entries of a
+                parameter array are multiplied by to obtain the values of the
+                Symbols, as in `VariationalAnsatz.param_scale_factors`.
+            particle_number: The particle number of the subspace to simulate
+                the circuit in. By default, the full space is used.
+        """
+        if not circuit.are_all_measurements_terminal():
+            raise ValueError('Circuit contains measurements that are not '
+                             'terminal.')
+        self.params = list(params)
+        self.qubit_order = list(qubit_order)
+        self.particle_number = particle_number
+        if particle_number is None:
+            self._space = _FullSpace(len(self.qubit_order))  # type: _Space
+        else:
+            self._space = _NumberSector(len(self.qubit_order), particle_number)
+        if param_scale_factors is None:
+            param_scale_factors = [1.0] * len(self.params)
+        self._scale_factors = numpy.array(param_scale_factors, dtype=float)
+
+        axis = {qubit: i for i, qubit in enumerate(self.qubit_order)}
+        index = {param: i for i, param in enumerate(self.params)}
+        self._kernels = [
+                _compile_operation(self._space,
+                                   op,
+                                   [axis[q] for q in op.qubits],
+                                   self.params,
+                                   index,
+                                   self._scale_factors)
+                for op in circuit.all_operations()
+                if not cirq.is_measurement(op)]  # type: List[_Kernel]
+
+        self._num_prefix_kernels = 0
+        for kernel in self._kernels:
+            if not isinstance(kernel, _FixedKernel):
+                break
+            self._num_prefix_kernels += 1
+
+    @property
+    def num_qubits(self) -> int:
+        return len(self.qubit_order)
+
+    @property
+    def dimension(self) -> int:
+        """The length of the state vectors."""
+        return self._space.dimension
+
+    @property
+    def basis_indices(self) -> numpy.ndarray:
+        """The computational basis states that state vectors are given in.
+
+        The i-th entry of a state vector is the amplitude of the computational
+        basis state whose index is the i-th entry of this array.
+        """
+        return self._space.basis_indices
+
+    def prepare(self,
+                initial_state: Union[int, numpy.ndarray]) -> numpy.ndarray:
+        """Apply the leading gates of the circuit that have no parameters.
+
+        The result can be passed to `final_state` or `final_states` with
+        `prepared` set to True, so that these gates are simulated only once
+        for many parameter settings.
+
+        Args:
+            initial_state: The initial state, given either as the index of a
+                computational basis state or as a state vector.
+
+        Returns:
+            The state vector after the leading gates without parameters.
+        """
+        states = self._initial_states(initial_state, 1)
+        for kernel in self._kernels[:self._num_prefix_kernels]:
+            states = kernel.apply(states, None)
+        return states.reshape(self.dimension)
+
+    def final_state(self,
+                    initial_state: Union[int, numpy.ndarray],
+                    param_values: numpy.ndarray,
+                    prepared: bool=False) -> numpy.ndarray:
+        """Simulate the circuit at one parameter setting.
+
+        Args:
+            initial_state: The initial state, given either as the index of a
+                computational basis state or as a state vector.
+            param_values: A 1d array of parameter values.
+            prepared: Whether `initial_state` was returned by `prepare`.
+
+        Returns:
+            The final state vector.
+        """
+        return self.final_states(initial_state,
+                                 numpy.asarray(param_values)[numpy.newaxis],
+                                 prepared)[0]
+
+    def final_states(self,
+                     initial_state: Union[int, numpy.ndarray],
+                     param_values: numpy.ndarray,
+                     prepared: bool=False) -> numpy.ndarray:
+        """Simulate the circuit at many parameter settings at once.
+
+        The initial state is not modified.
+
+        Args:
+            initial_state: The initial state, given either as the index of a
+                computational basis state or as a state vector. When
+                simulating in a subspace of fixed particle number, a state
+                vector may be given either in the full space or in the
+                subspace.
+            param_values: A 2d array whose rows are parameter settings.
+            prepared: Whether `initial_state` was returned by `prepare`, in
+                which case the leading gates without parameters are skipped.
+
+        Returns:
+            A 2d array whose rows are the final state vectors.
+        """
+        param_values = numpy.asarray(param_values, dtype=float)
+        batch_size = len(param_values)
+        states = self._initial_states(initial_state, batch_size)
+        kernels = self._kernels
+        if prepared:
+            kernels = kernels[self._num_prefix_kernels:]
+        for kernel in kernels:
+            states = kernel.apply(states, param_values)
+        return states.reshape((batch_size, self.dimension))
+
+    def value_and_gradient(self,
+                           initial_state: Union[int, numpy.ndarray],
+                           param_values: numpy.ndarray,
+                           operator: Callable[[numpy.ndarray], numpy.ndarray],
+                           prepared: bool=False
+                           ) -> Tuple[float, numpy.ndarray]:
+        """The expectation value of an operator and its gradient.
+
+        The gradient is computed by reverse-mode (adjoint) differentiation:
+        after simulating the circuit forwards, the final state and the
+        operator applied to it are evolved backwards through the circuit
+        together, and the contribution of each gate is read off along the
+        way. This takes about three passes through the circuit and a
+        constant number of state vectors, independent of the number of
+        parameters.
+
+        Args:
+            initial_state: The initial state, given either as the index of a
+                computational basis state or as a state vector.
+            param_values: A 1d array of parameter values.
+            operator: A function that applies a Hermitian operator to a state
+                vector.
+            prepared: Whether `initial_state` was returned by `prepare`.
+
+        Returns:
+            A tuple (value, gradient) containing the expectation value of the
+            operator in the final state and its gradient with respect to the
+            parameter values.
+        """
+        param_values = numpy.asarray(param_values, dtype=float)[numpy.newaxis]
+        states = self._initial_states(initial_state, 1)
+        kernels = self._kernels
+        if prepared:
+            kernels = kernels[self._num_prefix_kernels:]
+        for kernel in kernels:
+            states = kernel.apply(states, param_values)
+
+        final_state = states.reshape(-1)
+        bra = numpy.asarray(operator(final_state)).reshape(states.shape)
+        value = numpy.vdot(final_state, bra).real
+
+        # The leading gates without parameters don't contribute
+        gradient = numpy.zeros(len(self.params))
+        ket = states
+        for kernel in reversed(self._kernels[self._num_prefix_kernels:]):
+            ket = kernel.apply_inverse(ket, param_values)
+            kernel.add_gradient(gradient, bra, ket, param_values)
+            bra = kernel.apply_inverse(bra, param_values)
+        return value, gradient
+
+    def _initial_states(self,
+                        initial_state: Union[int, numpy.ndarray],
+                        batch_size: int) -> numpy.ndarray:
+        if not isinstance(initial_state, (int, numpy.integer)):
+            initial_state = numpy.asarray(initial_state,
+                                          dtype=numpy.complex128)
+        return self._space.initial_states(initial_state, batch_size)
+
+
+class _Space:
+    """The vector space that a compiled circuit is simulated in."""
+
+    def __init__(self, num_qubits: int) -> None:
+        self.num_qubits = num_qubits
+
+    @property
+    def dimension(self) -> int:
+        return len(self.basis_indices)
+
+    @property
+    def basis_indices(self) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def initial_states(self,
+                       initial_state: Union[int, numpy.ndarray],
+                       batch_size: int) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def apply_matrix(self,
+                     states: numpy.ndarray,
+                     matrix: numpy.ndarray,
+                     axes: Sequence[int]) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def apply_diagonal(self,
+                       states: numpy.ndarray,
+                       diagonal: numpy.ndarray,
+                       axes: Sequence[int]) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def check_matrix(self, matrix: numpy.ndarray) -> None:
+        """Raise an error if the space can't hold the results of a matrix.
+
+        This is called once for the matrices of each gate when the circuit
+        is compiled, rather than every time a gate is applied.
+        """
+        # Default: every matrix can be applied
+
+
+class _FullSpace(_Space):
+    """The full space of n qubits.
+
+    States are stored in arrays of shape (B, 2, 2, ..., 2).
+    """
+
+    @property
+    def dimension(self) -> int:
+        return 2**self.num_qubits
+
+    @property
+    def basis_indices(self) -> numpy.ndarray:
+        return numpy.arange(2**self.num_qubits)
+
+    def initial_states(self, initial_state, batch_size):
+        initial_state = cirq.to_valid_state_vector(
+                initial_state, self.num_qubits, dtype=numpy.complex128)
+        return numpy.tile(initial_state, (batch_size, 1)).reshape(
+                (batch_size,) + (2,) * self.num_qubits)
+
+    def apply_matrix(self, states, matrix, axes):
+        return apply_matrix(states, matrix, axes)
+
+    def apply_diagonal(self, states, diagonal, axes):
+        return apply_diagonal(states, diagonal, axes)
+
+
+class _NumberSector(_Space):
+    """The computational basis states with a fixed number of ones.
+
+    States are stored in arrays of shape (B, n choose N). To apply a matrix
+    to k qubits, the amplitudes are gathered into groups of 2**k that share
+    the values of the other qubits, with zeros for the basis states that lie
+    outside of the sector. The matrix is applied to each group and the
+    results are scattered back. The tables used to gather and scatter are
+    computed once for each tuple of qubits.
+    """
+
+    def __init__(self, num_qubits: int, particle_number: int) -> None:
+        super().__init__(num_qubits)
+        self.particle_number = particle_number
+        self._basis_indices = number_sector_indices(num_qubits,
+                                                    particle_number)
+        self._tables = {} \
+            # type: Dict[Tuple[int, ...], Tuple[numpy.ndarray, ...]]
+
+    @property
+    def basis_indices(self) -> numpy.ndarray:
+        return self._basis_indices
+
+    def initial_states(self, initial_state, batch_size):
+        if isinstance(initial_state, (int, numpy.integer)):
+            position = numpy.searchsorted(self._basis_indices, initial_state)
+            if (position == self.dimension or
+                    self._basis_indices[position] != initial_state):
+                raise ValueError(
+                        'The initial state does not have particle number '
+                        '{}.'.format(self.particle_number))
+            state = numpy.zeros(self.dimension, dtype=numpy.complex128)
+            state[position] = 1
+        else:
+            state = initial_state.reshape(-1)
+            if len(state) != self.dimension:
+                full_state = cirq.to_valid_state_vector(
+                        state, self.num_qubits, dtype=numpy.complex128)
+                state = full_state[self._basis_indices]
+                if not numpy.isclose(numpy.linalg.norm(state), 1):
+                    raise ValueError(
+                            'The initial state does not have particle number '
+                            '{}.'.format(self.particle_number))
+        return numpy.tile(state, (batch_size, 1))
+
+    def check_matrix(self, matrix):
+        num_qubits = int(numpy.log2(matrix.shape[-1]))
+        if numpy.any(numpy.abs(matrix[..., _number_changing_mask(num_qubits)])
+                     > 1e-8):
+            raise ValueError('Gate does not conserve particle number.')
+
+    def apply_matrix(self, states, matrix, axes):
+        local_indices, groups, gather = self._table(axes)
+        padded = numpy.concatenate(
+                [states, numpy.zeros((len(states), 1), dtype=states.dtype)],
+                axis=1)
+        gathered = padded[:, gather]
+        if matrix.ndim == 2:
+            result = gathered @ matrix.T
+        else:
+            result = gathered @ numpy.transpose(matrix, (0, 2, 1))
+        return result[:, groups, local_indices]
+
+    def apply_diagonal(self, states, diagonal, axes):
+        local_indices, _, _ = self._table(axes)
+        return states * diagonal[..., local_indices]
+
+    def _table(self, axes: Sequence[int]) -> Tuple[numpy.ndarray, ...]:
+        key = tuple(axes)
+        if key not in self._tables:
+            k = len(axes)
+            local_indices = numpy.zeros(self.dimension, dtype=numpy.int64)
+            rest = self._basis_indices.copy()
+            for j, axis in enumerate(axes):
+                position = self.num_qubits - 1 - axis
+                bits = (self._basis_indices >> position) & 1
+                local_indices |= bits << (k - 1 - j)
+                rest &= ~(1 << position)
+            _, groups = numpy.unique(rest, return_inverse=True)
+            # Entries outside of the sector point to a padding zero
+            gather = numpy.full((groups.max() + 1, 2**k), self.dimension)
+            gather[groups, local_indices] = numpy.arange(self.dimension)
+            self._tables[key] = (local_indices, groups, gather)
+        return self._tables[key]
+
+
+@functools.lru_cache(maxsize=None)
+def _number_changing_mask(num_qubits: int) -> numpy.ndarray:
+    """Which entries of a matrix on some qubits change the number of ones."""
+    ones = numpy.array([bin(i).count('1') for i in range(2**num_qubits)])
+    return ones[:, numpy.newaxis] != ones[numpy.newaxis, :]
+
+
+def number_sector_indices(num_qubits: int,
+                          particle_number: int) -> numpy.ndarray:
+    """The indices of the basis states with a fixed number of ones.
+
+    Args:
+        num_qubits: The number of qubits.
+        particle_number: The number of qubits set to 1.
+
+    Returns:
+        The indices, in increasing order, of the computational basis states
+        of `num_qubits` qubits in which `particle_number` qubits are set to 1.
+        The first qubit corresponds to the most significant bit.
+    """
+    return numpy.array(sorted(
+            sum(1 << (num_qubits - 1 - i) for i in occupied)
+            for occupied in itertools.combinations(range(num_qubits),
+                                                   particle_number)),
+            dtype=numpy.int64)
+
+
+def particle_number(state: Union[int, numpy.ndarray],
+                    atol: float=1e-8) -> int:
+    """The number of qubits set to 1 in a state of definite particle number.
+
+    Args:
+        state: The state, given either as the index of a computational basis
+            state or as a state vector.
+        atol: The tolerance below which amplitudes are considered zero.
+
+    Raises:
+        ValueError: The state is a superposition of different particle
+            numbers.
+    """
+    if isinstance(state, (int, numpy.integer)):
+        return bin(state).count('1')
+    nonzero = numpy.flatnonzero(numpy.abs(numpy.asarray(state)) > atol)
+    numbers = {bin(index).count('1') for index in nonzero}
+    if len(numbers) != 1:
+        raise ValueError('The state does not have a definite particle number.')
+    return numbers.pop()
+
+
+class _Kernel:
+    """An operation compiled for application to a stack of states."""
+
+    def __init__(self, space: '_Space', axes: Sequence[int]) -> None:
+        self.space = space
+        self.axes = axes
+
+    def apply(self,
+              states: numpy.ndarray,
+              param_values: numpy.ndarray) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def apply_inverse(self,
+                      states: numpy.ndarray,
+                      param_values: numpy.ndarray) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def add_gradient(self,
+                     gradient: numpy.ndarray,
+                     bra: numpy.ndarray,
+                     ket: numpy.ndarray,
+                     param_values: numpy.ndarray) -> None:
+        """Add 2 Re <bra| dU/dx |ket> to the gradient, for a single state."""
+        # Default: the matrix does not depend on the parameters
+
+
+class _FixedKernel(_Kernel):
+    """An operation whose matrix does not depend on the parameters."""
+
+    def __init__(self,
+                 space: '_Space',
+                 axes: Sequence[int],
+                 matrix: numpy.ndarray) -> None:
+        super().__init__(space, axes)
+        self.diagonal = None  # type: Optional[numpy.ndarray]
+        self.matrix = None  # type: Optional[numpy.ndarray]
+        if numpy.count_nonzero(matrix - numpy.diag(numpy.diag(matrix))):
+            space.check_matrix(matrix)
+            self.matrix = matrix
+        else:
+            self.diagonal = numpy.diag(matrix)
+
+    def apply(self, states, param_values):
+        if self.diagonal is not None:
+            return self.space.apply_diagonal(states, self.diagonal,
+                                             self.axes)
+        return self.space.apply_matrix(states, self.matrix, self.axes)
+
+    def apply_inverse(self, states, param_values):
+        if self.diagonal is not None:
+            return self.space.apply_diagonal(states, self.diagonal.conj(),
+                                             self.axes)
+        return self.space.apply_matrix(states, self.matrix.conj().T,
+                                       self.axes)
+
+
+class _EigenKernel(_Kernel):
+    """An EigenGate whose exponent is an affine function of the parameters.
+
+    The matrix of the gate with exponent t is the sum over its eigenspaces of
+    exp(i pi t shift) times the projector onto the eigenspace.
+    """
+
+    def __init__(self,
+                 space: '_Space',
+                 axes: Sequence[int],
+                 shifts: numpy.ndarray,
+                 projectors: numpy.ndarray,
+                 coefficients: numpy.ndarray,
+                 offset: float) -> None:
+        super().__init__(space, axes)
+        self.shifts = shifts
+        self.coefficients = coefficients
+        self.offset = offset
+        self.diagonals = None  # type: Optional[numpy.ndarray]
+        self.projectors = None  # type: Optional[numpy.ndarray]
+        diagonals = numpy.array([numpy.diag(p) for p in projectors])
+        if numpy.allclose(projectors, [numpy.diag(d) for d in diagonals]):
+            self.diagonals = diagonals
+        else:
+            # The matrices are combinations of the projectors
+            space.check_matrix(projectors)
+            self.projectors = projectors
+
+    def apply(self, states, param_values):
+        return self._apply_phases(states, self._phases(param_values))
+
+    def apply_inverse(self, states, param_values):
+        return self._apply_phases(states, self._phases(param_values).conj())
+
+    def add_gradient(self, gradient, bra, ket, param_values):
+        # The derivative of the matrix with respect to the exponent
+        derivative_phases = (1j * numpy.pi * self.shifts *
+                             self._phases(param_values))
+        overlap = numpy.vdot(bra, self._apply_phases(ket, derivative_phases))
+        gradient += 2 * overlap.real * self.coefficients
+
+    def _phases(self, param_values: numpy.ndarray) -> numpy.ndarray:
+        exponents = param_values @ self.coefficients + self.offset
+        return numpy.exp(1j * numpy.pi * numpy.outer(exponents, self.shifts))
+
+    def _apply_phases(self,
+                      states: numpy.ndarray,
+                      phases: numpy.ndarray) -> numpy.ndarray:
+        if self.diagonals is not None:
+            return self.space.apply_diagonal(states,
+                                             phases @ self.diagonals,
+                                             self.axes)
+        matrices = numpy.einsum('bk,kij->bij', phases, self.projectors)
+        return self.space.apply_matrix(states, matrices, self.axes)
+
+
+class _ResolvedKernel(_Kernel):
+    """A parameterized operation resolved with sympy at every application.
+
+    Its gradient is computed from central finite differences of its matrix.
+    """
+
+    def __init__(self,
+                 space: '_Space',
+                 axes: Sequence[int],
+                 operation: cirq.Operation,
+                 params: Sequence[sympy.Symbol],
+                 scale_factors: numpy.ndarray) -> None:
+        super().__init__(space, axes)
+        self.operation = operation
+        self.params = params
+        self.scale_factors = scale_factors
+        # The parameters that the operation depends on
+        self.param_indices = [
+                i for i in range(len(params))
+                if cirq.is_parameterized(cirq.resolve_parameters(
+                    operation,
+                    cirq.ParamResolver({param.name: 0.0
+                                        for j, param in enumerate(params)
+                                        if j != i})))]
+        # The matrices are checked at a generic parameter setting, since
+        # special values such as 0 can hide the structure of the gate
+        space.check_matrix(self._matrices(
+                numpy.random.RandomState(0).uniform(
+                    size=(1, len(params)))))
+
+    def apply(self, states, param_values):
+        return self.space.apply_matrix(states, self._matrices(param_values),
+                                       self.axes)
+
+    def apply_inverse(self, states, param_values):
+        matrices = numpy.transpose(self._matrices(param_values),
+                                   (0, 2, 1)).conj()
+        return self.space.apply_matrix(states, matrices, self.axes)
+
+    def add_gradient(self, gradient, bra, ket, param_values, step=1e-6):
+        for i in self.param_indices:
+            shift = numpy.zeros(param_values.shape[1])
+            shift[i] = step
+            derivatives = (self._matrices(param_values + shift) -
+                           self._matrices(param_values - shift)) / (2 * step)
+            overlap = numpy.vdot(
+                    bra, self.space.apply_matrix(ket, derivatives, self.axes))
+            gradient[i] += 2 * overlap.real
+
+    def _matrices(self, param_values: numpy.ndarray) -> numpy.ndarray:
+        return numpy.array([
+                cirq.unitary(cirq.resolve_parameters(
+                    self.operation,
+                    cirq.ParamResolver({
+                        param.name: value
+                        for param, value in zip(self.params,
+                                                self.scale_factors * row)})))
+                for row in param_values])
+
+
+def _compile_operation(space: '_Space',
+                       operation: cirq.Operation,
+                       axes: Sequence[int],
+                       params: Sequence[sympy.Symbol],
+                       index: Dict[sympy.Symbol, int],
+                       scale_factors: numpy.ndarray) -> _Kernel:
+    if not cirq.is_parameterized(operation):
+        return _FixedKernel(space, axes, cirq.unitary(operation))
+
+    gate = getattr(operation, 'gate', None)
+    if isinstance(gate, cirq.EigenGate):
+        affine = _affine_coefficients(gate.exponent, index)
+        unit_gate = gate._with_exponent(1.0)
+        if affine is not None and not cirq.is_parameterized(unit_gate):
+            coefficients, offset = affine
+            components = unit_gate._eigen_components()
+            return _EigenKernel(
+                    space,
+                    axes,
+                    numpy.array([half_turns + unit_gate._global_shift
+                                 for half_turns, _ in components]),
+                    numpy.array([component for _, component in components]),
+                    coefficients * scale_factors,
+                    offset)
+
+    return _ResolvedKernel(space, axes, operation, params, scale_factors)
+
+
+def _affine_coefficients(expression: sympy.Basic,
+                         index: Dict[sympy.Symbol, int]):
+    """Write an expression as c . params + b if possible.
+
+    Args:
+        expression: The expression.
+        index: A dictionary mapping each parameter to its position.
+
+    Returns:
+        The pair (c, b), or None if the expression is not an affine function
+        of the parameters.
+    """
+    if not all(symbol in index for symbol in expression.free_symbols):
+        return None
+    coefficients = numpy.zeros(len(index))
+    for symbol in expression.free_symbols:
+        derivative = sympy.diff(expression, symbol)
+        if derivative.free_symbols:
+            return None
+        coefficients[index[symbol]] = float(derivative)
+    offset = expression.subs({symbol: 0 for symbol in expression.free_symbols})
+    return coefficients, float(offset)
@@ -0,0 +1,248 @@
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import pytest
+import sympy
+
+import cirq
+
+import openfermioncirq as ofc
+from openfermioncirq.testing import ExampleAnsatz
+from openfermioncirq.variational.simulation import (
+        CompiledCircuit,
+        number_sector_indices,
+        particle_number,
+        _EigenKernel,
+        _FixedKernel,
+        _ResolvedKernel)
+
+
+def test_compiled_circuit():
+    a, b, c = qubits = cirq.LineQubit.range(3)
+    t, u = sympy.Symbol('t'), sympy.Symbol('u')
+    circuit = cirq.Circuit(
+            cirq.H(a),
+            cirq.XPowGate(exponent=t).on(c),
+            cirq.CNOT(a, b),
+            cirq.ISwapPowGate(exponent=-2 * u + 0.1).on(c, a),
+            cirq.ZPowGate(exponent=t + 0.5, global_shift=-0.5).on(b),
+            cirq.CZPowGate(exponent=u).on(a, c),
+            cirq.XPowGate(exponent=t * u).on(b),
+            cirq.PhasedXPowGate(phase_exponent=t).on(a),
+            cirq.measure(a, b, c))
+    compiled = CompiledCircuit(circuit, [t, u], qubits,
+                               param_scale_factors=[1.0, 0.5])
+
+    kernel_types = [type(kernel) for kernel in compiled._kernels]
+    assert kernel_types == [_FixedKernel, _EigenKernel, _FixedKernel,
+                            _EigenKernel, _EigenKernel, _EigenKernel,
+                            _ResolvedKernel, _ResolvedKernel]
+    assert compiled._kernels[4].diagonals is not None
+    assert compiled._kernels[3].diagonals is None
+
+    param_values = numpy.array([[0.3, -0.7], [1.1, 0.2], [0.0, 0.0]])
+    initial_state = numpy.zeros(8, dtype=numpy.complex64)
+    initial_state[1] = 1
+    final_states = compiled.final_states(initial_state, param_values)
+
+    assert final_states.shape == (3, 8)
+    for x, final_state in zip(param_values, final_states):
+        resolver = cirq.ParamResolver({'t': x[0], 'u': 0.5 * x[1]})
+        expected = cirq.resolve_parameters(circuit, resolver
+                ).final_wavefunction(1, qubit_order=qubits)
+        numpy.testing.assert_allclose(final_state, expected, atol=1e-7)
+        numpy.testing.assert_allclose(
+                compiled.final_state(1, x), expected, atol=1e-7)
+
+
+def test_compiled_circuit_ansatz():
+    ansatz = ExampleAnsatz()
+    qubit_order = ansatz.qubit_permutation(ansatz.qubits)
+    compiled = CompiledCircuit(ansatz.circuit,
+                               list(ansatz.params()),
+                               qubit_order)
+    x = numpy.array([0.25, -0.6])
+    expected = cirq.resolve_parameters(
+            ansatz.circuit, ansatz.param_resolver(x)).final_wavefunction(
+                    qubit_order=qubit_order)
+    numpy.testing.assert_allclose(compiled.final_state(0, x), expected,
+                                  atol=1e-7)
+
+
+def test_compiled_circuit_prepare():
+    a, b = qubits = cirq.LineQubit.range(2)
+    t = sympy.Symbol('t')
+    circuit = cirq.Circuit(
+            cirq.H(a),
+            cirq.CNOT(a, b),
+            cirq.YPowGate(exponent=t).on(b),
+            cirq.H(b))
+    compiled = CompiledCircuit(circuit, [t], qubits)
+    assert compiled._num_prefix_kernels == 2
+
+    prepared_state = compiled.prepare(0)
+    numpy.testing.assert_allclose(
+            prepared_state, numpy.array([1, 0, 0, 1]) / numpy.sqrt(2),
+            atol=1e-7)
+
+    param_values = numpy.array([[0.3], [-1.2]])
+    numpy.testing.assert_allclose(
+            compiled.final_states(prepared_state, param_values,
+                                  prepared=True),
+            compiled.final_states(0, param_values),
+            atol=1e-7)
+    numpy.testing.assert_allclose(
+            compiled.final_state(prepared_state, param_values[0],
+                                 prepared=True),
+            compiled.final_state(0, param_values[0]),
+            atol=1e-7)
+
+
+def test_compiled_circuit_value_and_gradient():
+    a, b, c = qubits = cirq.LineQubit.range(3)
+    t, u, v = params = sympy.symbols('t u v')
+    circuit = cirq.Circuit(
+            cirq.H(a),
+            cirq.CNOT(a, b),
+            cirq.XPowGate(exponent=t).on(c),
+            cirq.ISwapPowGate(exponent=-2 * u + 0.1).on(c, a),
+            cirq.H(b),
+            cirq.ZPowGate(exponent=t + 0.5, global_shift=-0.5).on(b),
+            cirq.CZPowGate(exponent=u - v).on(a, c),
+            cirq.PhasedXPowGate(phase_exponent=t, exponent=v).on(b))
+    compiled = CompiledCircuit(circuit, params, qubits,
+                               param_scale_factors=[1.0, 0.5, 2.0])
+    random_state = numpy.random.RandomState(5172)
+    operator = random_state.randn(8, 8) + 1j * random_state.randn(8, 8)
+    operator += operator.conj().T
+
+    def energy(x):
+        final_state = compiled.final_state(0, x)
+        return numpy.vdot(final_state, operator @ final_state).real
+
+    x = numpy.array([0.3, -0.7, 0.4])
+    value, gradient = compiled.value_and_gradient(
+            0, x, lambda state: operator @ state)
+    assert value == pytest.approx(energy(x))
+
+    step = 1e-5
+    numerical_gradient = [
+            (energy(x + step * e) - energy(x - step * e)) / (2 * step)
+            for e in numpy.eye(3)]
+    numpy.testing.assert_allclose(gradient, numerical_gradient, atol=1e-5)
+
+    prepared_state = compiled.prepare(0)
+    prepared_value, prepared_gradient = compiled.value_and_gradient(
+            prepared_state, x, lambda state: operator @ state,
+            prepared=True)
+    assert prepared_value == pytest.approx(value)
+    numpy.testing.assert_allclose(prepared_gradient, gradient, atol=1e-8)
+
+
+def test_compiled_circuit_number_sector():
+    qubits = cirq.LineQubit.range(5)
+    a, b, c, d, e = qubits
+    t, u = params = sympy.symbols('t u')
+    circuit = cirq.Circuit(
+            ofc.XXYYPowGate(exponent=t).on(a, b),
+            ofc.YXXYPowGate(exponent=0.3).on(b, c),
+            ofc.FSWAP(c, d),
+            ofc.rot11(0.4).on(d, e),
+            cirq.CZPowGate(exponent=u).on(a, e),
+            ofc.QuarticFermionicSimulationGate((0.2, -0.3, 0.5),
+                                               exponent=0.7).on(a, b, c, d),
+            ofc.CubicFermionicSimulationGate((0.1, 0.4, -0.2),
+                                             exponent=u).on(c, d, e),
+            cirq.ZPowGate(exponent=t - u).on(c),
+            ofc.XXYYPowGate(exponent=u * t).on(e, a))
+    compiled = CompiledCircuit(circuit, params, qubits)
+    compiled_sector = CompiledCircuit(circuit, params, qubits,
+                                      particle_number=2)
+    assert compiled_sector.particle_number == 2
+    assert compiled_sector.dimension == 10
+    basis_indices = compiled_sector.basis_indices
+    numpy.testing.assert_array_equal(basis_indices,
+                                     number_sector_indices(5, 2))
+
+    initial_state = numpy.zeros(32, dtype=numpy.complex128)
+    initial_state[[0b10100, 0b00011]] = numpy.sqrt(0.5)
+    param_values = numpy.array([[0.3, -0.7], [1.1, 0.2]])
+    final_states = compiled.final_states(initial_state, param_values)
+    numpy.testing.assert_allclose(
+            compiled_sector.final_states(initial_state, param_values),
+            final_states[:, basis_indices],
+            atol=1e-7)
+    numpy.testing.assert_allclose(
+            compiled_sector.final_state(0b00110, param_values[0]),
+            compiled.final_state(0b00110, param_values[0])[basis_indices],
+            atol=1e-7)
+
+    random_state = numpy.random.RandomState(2741)
+    operator = random_state.randn(32, 32) + 1j * random_state.randn(32, 32)
+    operator += operator.conj().T
+    sector_operator = operator[numpy.ix_(basis_indices, basis_indices)]
+    # The full operator changes particle number; restrict it
+    operator[:, numpy.setdiff1d(numpy.arange(32), basis_indices)] = 0
+    operator[numpy.setdiff1d(numpy.arange(32), basis_indices), :] = 0
+    value, gradient = compiled.value_and_gradient(
+            initial_state, param_values[0], lambda state: operator @ state)
+    sector_value, sector_gradient = compiled_sector.value_and_gradient(
+            initial_state, param_values[0],
+            lambda state: sector_operator @ state)
+    assert sector_value == pytest.approx(value)
+    numpy.testing.assert_allclose(sector_gradient, gradient, atol=1e-6)
+
+
+def test_compiled_circuit_number_sector_errors():
+    a, b = qubits = cirq.LineQubit.range(2)
+    # Gates that don't conserve particle number are rejected when compiled
+    with pytest.raises(ValueError):
+        _ = CompiledCircuit(cirq.Circuit(cirq.X(a)), [], qubits,
+                            particle_number=1)
+    with pytest.raises(ValueError):
+        _ = CompiledCircuit(cirq.Circuit(cirq.X(a)**sympy.Symbol('t')),
+                            [sympy.Symbol('t')], qubits, particle_number=1)
+    with pytest.raises(ValueError):
+        _ = CompiledCircuit(
+                cirq.Circuit(cirq.rx(sympy.Symbol('t')**2).on(a)),
+                [sympy.Symbol('t')], qubits, particle_number=1)
+
+    compiled = CompiledCircuit(cirq.Circuit(cirq.ISWAP(a, b)), [], qubits,
+                               particle_number=1)
+    with pytest.raises(ValueError):
+        _ = compiled.final_state(0, [])
+    with pytest.raises(ValueError):
+        _ = compiled.final_state(numpy.array([0, 0, 0, 1]), [])
+
+
+def test_number_sector_indices():
+    numpy.testing.assert_array_equal(number_sector_indices(4, 2),
+                                     [3, 5, 6, 9, 10, 12])
+    numpy.testing.assert_array_equal(number_sector_indices(3, 0), [0])
+
+
+def test_particle_number():
+    assert particle_number(0b1011) == 3
+    state = numpy.zeros(8)
+    state[[3, 5]] = numpy.sqrt(0.5)
+    assert particle_number(state) == 2
+    state[0] = 1e-3
+    with pytest.raises(ValueError):
+        _ = particle_number(state)
+
+
+def test_compiled_circuit_nonterminal_measurement():
+    a = cirq.LineQubit(0)
+    circuit = cirq.Circuit(cirq.measure(a), cirq.X(a))
+    with pytest.raises(ValueError):
+        _ = CompiledCircuit(circuit, [], [a])
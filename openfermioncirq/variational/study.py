@@ -13,14 +13,19 @@
 """The variational study class."""
 
 from typing import (
-        Any, Dict, Hashable, Iterable, List, Optional, Sequence, Type, Union,
-        cast)
+        Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional,
+        Sequence, Tuple, Type, Union, cast)
 
 import collections
+import concurrent.futures
+import copy
 import itertools
 import multiprocessing
+import multiprocessing.pool
 import os
 import pickle
+import queue
+import shutil
 import time
 
 import numpy
@@ -29,12 +34,18 @@ import cirq
 
 from openfermioncirq.variational import variational_black_box
 from openfermioncirq.variational.ansatz import VariationalAnsatz
+from openfermioncirq.variational.journal import Journal
 from openfermioncirq.variational.objective import VariationalObjective
+from openfermioncirq.variational.shared_memory import SharedArray
 from openfermioncirq.optimization import (
+        EvaluationBudgetExhausted,
+        FunctionValueTrace,
         OptimizationParams,
         OptimizationResult,
         OptimizationTrialResult,
-        StatefulBlackBox)
+        Profiler,
+        StatefulBlackBox,
+        profiling)
 
 
 class VariationalStudy:
@@ -68,6 +79,12 @@ class VariationalStudy:
             optimization runs of the study. Key is the identifier used to
             label the run.
         num_params: The number of parameters in the circuit.
+        profile: Whether optimization runs are profiled. The time spent in
+            each phase of the evaluations is then stored as histograms in
+            the `profile` attribute of each OptimizationResult.
+        trace_dir: A directory in which each process that performs
+            optimization runs writes a timeline of the phases of its
+            evaluations, or None to not write timelines.
     """
 
     def __init__(self,
@@ -75,12 +92,15 @@ class VariationalStudy:
                  ansatz: VariationalAnsatz,
                  objective: VariationalObjective,
                  preparation_circuit: Optional[cirq.Circuit]=None,
-                 initial_state: Union[int, numpy.ndarray]=0,
+                 initial_state: Union[int, numpy.ndarray, SharedArray]=0,
                  target: Optional[float]=None,
                  black_box_type: Type[
                      variational_black_box.VariationalBlackBox]=
                      variational_black_box.UNITARY_SIMULATE,
-                 datadir: Optional[str]=None) -> None:
+                 datadir: Optional[str]=None,
+                 journal: bool=False,
+                 profile: bool=False,
+                 trace_dir: Optional[str]=None) -> None:
         """
         Args:
             name: The name of the study.
@@ -89,12 +109,30 @@ class VariationalStudy:
             preparation_circuit: A circuit to apply prior to the ansatz circuit.
                 It should use the qubits belonging to the ansatz.
             initial_state: An initial state to use if the study circuit is
-                run on a simulator.
+                run on a simulator. A state vector can be given as a
+                SharedArray so that worker processes attach to it instead of
+                receiving a copy.
             target: The target value one wants to achieve during optimization.
             black_box_type: The type of VariationalBlackBox to use for
                 optimization.
             datadir: The directory to use when saving the study. The default
                 behavior is to use the current working directory.
+            journal: Whether to append each optimization result to a journal
+                file in `datadir` as soon as it is obtained. Results in the
+                journal survive an interrupted optimization and are recovered
+                by `load`. Calling `save` writes all results to the study file
+                and empties the journal.
+            profile: Whether to profile optimization runs. The time spent
+                in each phase of the evaluations, such as simulating the
+                circuit or computing the expectation value, is stored as
+                histograms in the `profile` attribute of each
+                OptimizationResult. Profiling adds a few microseconds to
+                each evaluation.
+            trace_dir: A directory in which to write a timeline of the
+                phases of the evaluations, in the trace format of Chrome's
+                trace viewer. Each process writes its own file, named after
+                the study and the process ID. Setting this also enables
+                profiling.
         """
         # TODO store results as a pandas DataFrame?
         self.name = name
@@ -108,6 +146,17 @@ class VariationalStudy:
         self._circuit = self._preparation_circuit + self._ansatz.circuit
         self._black_box_type = black_box_type
         self.datadir = datadir
+        self.journal = journal
+        self.profile = profile or trace_dir is not None
+        self.trace_dir = trace_dir
+        self._worker_pool = None  # type: Optional[multiprocessing.pool.Pool]
+        # The number of processes of the worker pool
+        self._num_workers = 0
+        self._journal = Journal(self._filename('journal'))
+        # Whether the journal file belongs to the current generation
+        self._journal_started = False
+        # Incremented each time the study is saved
+        self._generation = 0
 
     def optimize(self,
                  optimization_params: OptimizationParams,
@@ -117,7 +166,12 @@ class VariationalStudy:
                  repetitions: int=1,
                  seeds: Optional[Sequence[int]]=None,
                  use_multiprocessing: bool=False,
-                 num_processes: Optional[int]=None
+                 num_processes: Optional[int]=None,
+                 resume: bool=False,
+                 stopping_policy: Optional['StoppingPolicy']=None,
+                 progress_callback: Optional[Callable[
+                     [Hashable, OptimizationTrialResult], None]]=None,
+                 executor: Optional[concurrent.futures.Executor]=None
                  ) -> OptimizationTrialResult:
         """Perform an optimization run and save the results.
 
@@ -154,10 +208,32 @@ class VariationalStudy:
                 The default behavior is to randomly generate an independent seed
                 for each repetition.
             use_multiprocessing: Whether to use multiprocessing to run
-                repetitions in different processes.
+                repetitions in different processes. If workers have been
+                started with `start_workers`, they are used; otherwise a
+                temporary pool of processes is created. Results are saved in
+                the order in which the repetitions complete.
             num_processes: The number of processes to use for multiprocessing.
                 The default behavior is to use the output of
-                `multiprocessing.cpu_count()`.
+                `multiprocessing.cpu_count()`. Ignored if workers have been
+                started with `start_workers`.
+            resume: Whether to resume a run that was previously started
+                with the same identifier, for instance before being
+                interrupted. If True and a result with the identifier
+                already exists, only the repetitions that it is missing are
+                performed and appended to it.
+            stopping_policy: A StoppingPolicy deciding when the remaining
+                repetitions of a run are cancelled. By default, all
+                repetitions are performed.
+            progress_callback: A function called with the identifier of a
+                run and its OptimizationTrialResult each time a repetition
+                of the run completes.
+            executor: A concurrent.futures.Executor to run repetitions in,
+                such as a ThreadPoolExecutor, a ProcessPoolExecutor or a
+                ClusterExecutor. If given, `use_multiprocessing` and
+                `num_processes` are ignored. The ansatz, objective and
+                other data of the study are sent with each repetition.
+                Threads share the random state of numpy, so seeds don't make
+                repetitions run in threads reproducible.
 
         Side effects:
             Saves the returned OptimizationTrialResult into the `trial_results`
@@ -170,7 +246,11 @@ class VariationalStudy:
                                    repetitions,
                                    seeds,
                                    use_multiprocessing,
-                                   num_processes)[0]
+                                   num_processes,
+                                   resume,
+                                   stopping_policy,
+                                   progress_callback,
+                                   executor)[0]
 
     def optimize_sweep(self,
                        param_sweep: Iterable[OptimizationParams],
@@ -180,7 +260,13 @@ class VariationalStudy:
                        repetitions: int=1,
                        seeds: Optional[Sequence[int]]=None,
                        use_multiprocessing: bool=False,
-                       num_processes: Optional[int]=None
+                       num_processes: Optional[int]=None,
+                       resume: bool=False,
+                       stopping_policy: Optional['StoppingPolicy']=None,
+                       progress_callback: Optional[Callable[
+                           [Hashable, OptimizationTrialResult], None]]=None,
+                       executor: Optional[concurrent.futures.Executor]=None,
+                       successive_halving: Optional['SuccessiveHalving']=None
                        ) -> List[OptimizationTrialResult]:
         """Perform multiple optimization runs and save the results.
 
@@ -210,10 +296,41 @@ class VariationalStudy:
                 The default behavior is to randomly generate an independent seed
                 for each repetition.
             use_multiprocessing: Whether to use multiprocessing to run
-                repetitions in different processes.
+                repetitions in different processes. If workers have been
+                started with `start_workers`, they are used; otherwise a
+                temporary pool of processes is created. Results are saved in
+                the order in which the repetitions complete.
             num_processes: The number of processes to use for multiprocessing.
                 The default behavior is to use the output of
-                `multiprocessing.cpu_count()`.
+                `multiprocessing.cpu_count()`. Ignored if workers have been
+                started with `start_workers`.
+            resume: Whether to resume runs that were previously started
+                with the same identifiers, for instance by a sweep that was
+                interrupted. If True, runs whose identifiers already have
+                results only perform the repetitions that they are missing,
+                which are appended to the existing results. Identifiers
+                should be given explicitly when resuming.
+            stopping_policy: A StoppingPolicy deciding when the remaining
+                repetitions of a run are cancelled. By default, all
+                repetitions are performed.
+            progress_callback: A function called with the identifier of a
+                run and its OptimizationTrialResult each time a repetition
+                of the run completes.
+            executor: A concurrent.futures.Executor to run repetitions in,
+                such as a ThreadPoolExecutor, a ProcessPoolExecutor or a
+                ClusterExecutor. If given, `use_multiprocessing` and
+                `num_processes` are ignored. The ansatz, objective and
+                other data of the study are sent with each repetition.
+                Threads share the random state of numpy, so seeds don't make
+                repetitions run in threads reproducible.
+            successive_halving: A SuccessiveHalving schedule. If given, the
+                runs are performed in rounds with a growing budget of
+                evaluations, and only the best runs of each round take part
+                in the next one. The result of each round replaces the
+                previous result of the run in `trial_results`, so the runs
+                that were eliminated keep the result of their last round.
+                This requires a stateful black box type and can't be
+                combined with `resume`.
 
         Side effects:
             Saves the returned OptimizationTrialResult into the results
@@ -234,39 +351,104 @@ class VariationalStudy:
             identifiers = itertools.count(cast(int, start))  # type: ignore
 
 
-        if use_multiprocessing and repetitions == 1:
-            trial_results = self._get_trial_result_list(
-                    param_sweep,
-                    identifiers,
+        runs = list(zip(identifiers, param_sweep))
+
+        if successive_halving is not None:
+            if resume:
+                raise ValueError('Runs scheduled by successive halving '
+                                 'cannot be resumed.')
+            if not issubclass(self._black_box_type, StatefulBlackBox):
+                raise ValueError('Successive halving requires a stateful '
+                                 'black box type to limit the number of '
+                                 'evaluations.')
+            if seeds is None:
+                # Every round repeats the runs with the same seeds
+                seeds = numpy.random.randint(4294967296, size=repetitions)
+            self._successive_halving(runs,
+                                     successive_halving,
+                                     reevaluate_final_params,
+                                     save_x_vals,
+                                     repetitions,
+                                     seeds,
+                                     use_multiprocessing,
+                                     num_processes,
+                                     stopping_policy,
+                                     progress_callback,
+                                     executor)
+            return [self.trial_results[identifier] for identifier, _ in runs]
+
+        # The number of repetitions already completed for each run
+        completed = {
+                identifier: self.trial_results[identifier].repetitions
+                if resume and identifier in self.trial_results else 0
+                for identifier, _ in runs}
+
+        tasks = []  # type: List[Tuple[Hashable, Tuple]]
+        for identifier, optimization_params in runs:
+            num_completed = completed[identifier]
+            if num_completed >= repetitions:
+                continue
+            if not num_completed:
+                self._append_to_journal(
+                        ('start', identifier, optimization_params))
+            tasks.extend(self._tasks(
+                    identifier,
+                    optimization_params,
                     reevaluate_final_params,
                     save_x_vals,
-                    seeds,
-                    num_processes)
-            for identifier, trial_result in zip(identifiers, trial_results):
-                self.trial_results[identifier] = trial_result
-        else:
-            trial_results = []
-            for identifier, optimization_params in zip(
-                    identifiers, param_sweep):
-
-                result_list = self._get_result_list(
-                        optimization_params,
-                        reevaluate_final_params,
-                        save_x_vals,
-                        repetitions,
-                        seeds,
-                        use_multiprocessing,
-                        num_processes)
-
-                trial_result = OptimizationTrialResult(result_list,
-                                                       optimization_params)
-                trial_results.append(trial_result)
-
-                # Save the result into the trial_results dictionary
-                self.trial_results[identifier] = trial_result
-
-        return trial_results
+                    repetitions - num_completed,
+                    seeds[num_completed:] if seeds is not None else None))
 
+        self._run_tasks(tasks,
+                        dict(runs),
+                        {identifier for identifier, _ in runs
+                         if completed[identifier]},
+                        use_multiprocessing,
+                        num_processes,
+                        stopping_policy,
+                        progress_callback,
+                        executor)
+
+        return [self.trial_results[identifier] for identifier, _ in runs]
+
+    def _successive_halving(self,
+                            runs: List[Tuple[Hashable, OptimizationParams]],
+                            schedule: 'SuccessiveHalving',
+                            reevaluate_final_params: bool,
+                            save_x_vals: bool,
+                            repetitions: int,
+                            seeds: Sequence[int],
+                            use_multiprocessing: bool,
+                            num_processes: Optional[int],
+                            stopping_policy: Optional['StoppingPolicy'],
+                            progress_callback: Optional[Callable[
+                                [Hashable, OptimizationTrialResult], None]],
+                            executor: Optional[concurrent.futures.Executor]
+                            ) -> None:
+        """Perform runs in rounds, keeping the best runs of each round."""
+        for budget, survivors in schedule.rounds(len(runs)):
+            runs = runs[:survivors]
+            tasks = []  # type: List[Tuple[Hashable, Tuple]]
+            for identifier, optimization_params in runs:
+                self._append_to_journal(
+                        ('start', identifier, optimization_params))
+                tasks.extend(self._tasks(identifier,
+                                         optimization_params,
+                                         reevaluate_final_params,
+                                         save_x_vals,
+                                         repetitions,
+                                         seeds,
+                                         budget))
+            self._run_tasks(tasks,
+                            dict(runs),
+                            (),
+                            use_multiprocessing,
+                            num_processes,
+                            stopping_policy,
+                            progress_callback,
+                            executor)
+            # Python's sort is stable, so ties keep the order of the sweep
+            runs.sort(key=lambda run: self.trial_results[run[0]].optimal_value)
 
     def extend_result(self,
                       identifier: Hashable,
@@ -275,7 +457,11 @@ class VariationalStudy:
                       repetitions: int=1,
                       seeds: Optional[Sequence[int]]=None,
                       use_multiprocessing: bool=False,
-                      num_processes: Optional[int]=None
+                      num_processes: Optional[int]=None,
+                      stopping_policy: Optional['StoppingPolicy']=None,
+                      progress_callback: Optional[Callable[
+                          [Hashable, OptimizationTrialResult], None]]=None,
+                      executor: Optional[concurrent.futures.Executor]=None
                       ) -> None:
         """Extend a result by repeating the run with the same parameters.
 
@@ -305,10 +491,27 @@ class VariationalStudy:
                 The default behavior is to randomly generate an independent seed
                 for each repetition.
             use_multiprocessing: Whether to use multiprocessing to run
-                repetitions in different processes.
+                repetitions in different processes. If workers have been
+                started with `start_workers`, they are used; otherwise a
+                temporary pool of processes is created. Results are saved in
+                the order in which the repetitions complete.
             num_processes: The number of processes to use for multiprocessing.
                 The default behavior is to use the output of
-                `multiprocessing.cpu_count()`.
+                `multiprocessing.cpu_count()`. Ignored if workers have been
+                started with `start_workers`.
+            stopping_policy: A StoppingPolicy deciding when the remaining
+                repetitions of a run are cancelled. By default, all
+                repetitions are performed.
+            progress_callback: A function called with the identifier of a
+                run and its OptimizationTrialResult each time a repetition
+                of the run completes.
+            executor: A concurrent.futures.Executor to run repetitions in,
+                such as a ThreadPoolExecutor, a ProcessPoolExecutor or a
+                ClusterExecutor. If given, `use_multiprocessing` and
+                `num_processes` are ignored. The ansatz, objective and
+                other data of the study are sent with each repetition.
+                Threads share the random state of numpy, so seeds don't make
+                repetitions run in threads reproducible.
 
         Raises:
             KeyError: There was no existing result with the given identifier.
@@ -319,115 +522,240 @@ class VariationalStudy:
 
         optimization_params = self.trial_results[identifier].params
 
-        result_list = self._get_result_list(
-                optimization_params,
-                reevaluate_final_params,
-                save_x_vals,
-                repetitions,
-                seeds,
-                use_multiprocessing,
-                num_processes)
-
-        self.trial_results[identifier].extend(result_list)
-
-    def _get_trial_result_list(
-            self,
-            param_sweep: Iterable[OptimizationParams],
-            identifiers: Optional[Iterable[Hashable]],
-            reevaluate_final_params: bool,
-            save_x_vals: bool,
-            seeds: Optional[Sequence[int]],
-            num_processes: Optional[int]
-            ) -> List[OptimizationTrialResult]:
-
-        if num_processes is None:
-            # coverage: ignore
-            num_processes = multiprocessing.cpu_count()
-        pool = multiprocessing.Pool(num_processes)
-        try:
-            arg_tuples = (
+        tasks = self._tasks(identifier,
+                            optimization_params,
+                            reevaluate_final_params,
+                            save_x_vals,
+                            repetitions,
+                            seeds)
+        self._run_tasks(tasks,
+                        {identifier: optimization_params},
+                        {identifier},
+                        use_multiprocessing,
+                        num_processes,
+                        stopping_policy,
+                        progress_callback,
+                        executor)
+
+    def _tasks(self,
+               identifier: Hashable,
+               optimization_params: OptimizationParams,
+               reevaluate_final_params: bool,
+               save_x_vals: bool,
+               repetitions: int,
+               seeds: Optional[Sequence[int]],
+               max_evaluations: Optional[int]=None
+               ) -> List[Tuple[Hashable, Tuple]]:
+        """The optimization tasks for the repetitions of a run."""
+        return [
+            (
+                identifier,
                 (
-                    self.ansatz,
-                    self.objective,
-                    self._preparation_circuit,
-                    self.initial_state,
                     optimization_params,
                     reevaluate_final_params,
                     save_x_vals,
-                    seeds[0] if seeds is not None
+                    seeds[i] if seeds is not None
                     else numpy.random.randint(4294967296),
-                    self.ansatz.default_initial_params(),
-                    self._black_box_type
+                    max_evaluations
                 )
-                for optimization_params in param_sweep
             )
-            result_list = pool.map(_run_optimization, arg_tuples)
-            trial_results = [
-                    OptimizationTrialResult([result], optimization_params)
-                    for optimization_params, result in
-                    zip(param_sweep, result_list)
-            ]
-        finally:
-            pool.terminate()
+            for i in range(repetitions)
+        ]
+
+    def _run_tasks(self,
+                   tasks: List[Tuple[Hashable, Tuple]],
+                   params: Dict[Hashable, OptimizationParams],
+                   existing: Iterable[Hashable],
+                   use_multiprocessing: bool,
+                   num_processes: Optional[int],
+                   stopping_policy: Optional['StoppingPolicy'],
+                   progress_callback: Optional[Callable[
+                       [Hashable, OptimizationTrialResult], None]],
+                   executor: Optional[concurrent.futures.Executor]
+                   ) -> None:
+        """Perform optimization tasks and save the results as they arrive.
+
+        Each result is journaled and saved into the `trial_results`
+        dictionary as soon as it is obtained. Results of runs that are not in
+        `existing` replace any previous result with the same identifier,
+        while the results of the other runs are appended to the existing
+        results. Once the stopping policy is satisfied for a run, its
+        remaining tasks are cancelled.
+        """
+        existing = set(existing)
 
-        return trial_results
+        def should_stop(identifier: Hashable) -> bool:
+            if stopping_policy is None or identifier not in existing:
+                return False
+            return stopping_policy.should_stop(
+                    self.trial_results[identifier], self.target)
 
-    def _get_result_list(
-            self,
-            optimization_params,
-            reevaluate_final_params: bool,
-            save_x_vals: bool,
-            repetitions: int=1,
-            seeds: Optional[Sequence[int]]=None,
-            use_multiprocessing: bool=False,
-            num_processes: Optional[int]=None
-            ) -> List[OptimizationResult]:
-
-        if use_multiprocessing:
+        if executor is not None or use_multiprocessing:
+            results = self._imap_tasks(
+                    tasks, num_processes, executor, should_stop)
+        else:
+            context = self._worker_context()
+            results = ((identifier, _run_optimization(context, *task))
+                       for identifier, task in tasks
+                       if not should_stop(identifier))
+
+        for identifier, result in results:
+            self._append_to_journal(('result', identifier, result))
+            if identifier in existing:
+                self.trial_results[identifier].extend([result])
+            else:
+                self.trial_results[identifier] = OptimizationTrialResult(
+                        [result], params[identifier])
+                existing.add(identifier)
+            if progress_callback is not None:
+                progress_callback(identifier, self.trial_results[identifier])
+
+    def _imap_tasks(self,
+                    tasks: List[Tuple[Hashable, Tuple]],
+                    num_processes: Optional[int],
+                    executor: Optional[concurrent.futures.Executor],
+                    should_stop: Callable[[Hashable], bool]
+                    ) -> Iterator[Tuple[Hashable, OptimizationResult]]:
+        """Run optimization tasks concurrently.
+
+        Uses the given executor if there is one. Otherwise, uses the
+        persistent worker pool if one has been started with `start_workers`,
+        and otherwise a temporary pool that is terminated once the tasks are
+        done. Results are yielded in the order in which they complete,
+        together with the identifier of their run.
+
+        Tasks of a run for which `should_stop` returns True are cancelled
+        before they start. All tasks are submitted to an executor at once and
+        the futures of the cancelled tasks are cancelled, while tasks are
+        submitted to a worker pool only as workers become available. Results
+        of tasks of a stopped run that were already in progress are
+        discarded, and a temporary pool is terminated as soon as no other
+        tasks remain.
+        """
+        pool = None  # type: Optional[multiprocessing.pool.Pool]
+        if executor is not None:
+            context = self._worker_context()
+            num_workers = len(tasks)
+        elif self._worker_pool is not None:
+            pool = self._worker_pool
+            num_workers = self._num_workers
+        else:
             if num_processes is None:
+                # coverage: ignore
                 num_processes = multiprocessing.cpu_count()
-            pool = multiprocessing.Pool(num_processes)
-            try:
-                arg_tuples = (
-                    (
-                        self.ansatz,
-                        self.objective,
-                        self._preparation_circuit,
-                        self.initial_state,
-                        optimization_params,
-                        reevaluate_final_params,
-                        save_x_vals,
-                        seeds[i] if seeds is not None
-                        else numpy.random.randint(4294967296),
-                        self.ansatz.default_initial_params(),
-                        self._black_box_type
-                    )
-                    for i in range(repetitions)
-                )
-                result_list = pool.map(_run_optimization, arg_tuples)
-            finally:
+            pool = self._create_worker_pool(num_processes)
+            num_workers = num_processes
+
+        pending = collections.deque(tasks)
+        futures = collections.defaultdict(list) \
+            # type: Dict[Hashable, List[concurrent.futures.Future]]
+        in_progress = collections.Counter() \
+            # type: Dict[Hashable, int]
+        completed = queue.Queue()  # type: queue.Queue
+
+        def submit(identifier: Hashable, task: Tuple) -> None:
+            if pool is None:
+                future = cast(concurrent.futures.Executor, executor).submit(
+                        _run_optimization, context, *task)
+            else:
+                future = concurrent.futures.Future()
+                future.set_running_or_notify_cancel()
+                pool.apply_async(_run_optimization_task,
+                                 (task,),
+                                 callback=future.set_result,
+                                 error_callback=future.set_exception)
+            futures[identifier].append(future)
+            in_progress[identifier] += 1
+            future.add_done_callback(
+                    lambda future: completed.put((identifier, future)))
+
+        try:
+            while True:
+                while pending and sum(in_progress.values()) < num_workers:
+                    identifier, task = pending.popleft()
+                    if not should_stop(identifier):
+                        submit(identifier, task)
+                # Wait only for tasks of runs that haven't stopped
+                waiting = {identifier for identifier, _ in pending}
+                waiting.update(identifier for identifier, count
+                               in in_progress.items() if count)
+                if all(should_stop(identifier) for identifier in waiting):
+                    break
+                identifier, future = completed.get()
+                in_progress[identifier] -= 1
+                if future.cancelled() or should_stop(identifier):
+                    continue
+                result = future.result()
+                yield identifier, result
+                if should_stop(identifier):
+                    for future in futures[identifier]:
+                        future.cancel()
+        finally:
+            for identifier_futures in futures.values():
+                for future in identifier_futures:
+                    future.cancel()
+            if pool is not None and pool is not self._worker_pool:
                 pool.terminate()
-        else:
-            result_list = []
-            for i in range(repetitions):
-                result = _run_optimization(
-                    (
-                        self.ansatz,
-                        self.objective,
-                        self._preparation_circuit,
-                        self.initial_state,
-                        optimization_params,
-                        reevaluate_final_params,
-                        save_x_vals,
-                        seeds[i] if seeds is not None
-                        else numpy.random.randint(4294967296),
-                        self.ansatz.default_initial_params(),
-                        self._black_box_type
-                    )
-                )
-                result_list.append(result)
 
-        return result_list
+    def _worker_context(self) -> Tuple:
+        """The data shared by all optimization runs of the study."""
+        trace_prefix = None
+        if self.trace_dir is not None:
+            # The process that writes the file appends its process ID
+            trace_prefix = os.path.join(os.path.abspath(self.trace_dir),
+                                        self.name)
+        return (self.ansatz,
+                self.objective,
+                self._preparation_circuit,
+                self.initial_state,
+                self.ansatz.default_initial_params(),
+                self._black_box_type,
+                self.profile,
+                trace_prefix)
+
+    def _create_worker_pool(self, num_processes: int
+                            ) -> multiprocessing.pool.Pool:
+        return multiprocessing.Pool(num_processes,
+                                    initializer=_initialize_worker,
+                                    initargs=(self._worker_context(),))
+
+    def start_workers(self, num_processes: Optional[int]=None) -> None:
+        """Start a persistent pool of worker processes.
+
+        The workers receive the ansatz, objective, preparation circuit,
+        initial state and black box type of the study once, when they are
+        started. Subsequent calls to `optimize`, `optimize_sweep` and
+        `extend_result` with `use_multiprocessing` set to True reuse the
+        workers and only send them the optimization parameters and seeds of
+        each run. Changes made to the study after the workers have been
+        started are not seen by them.
+
+        The workers are shut down with `stop_workers`, or when the study is
+        used as a context manager and the with block is exited.
+
+        Args:
+            num_processes: The number of worker processes. The default
+                behavior is to use the output of `multiprocessing.cpu_count()`.
+        """
+        self.stop_workers()
+        if num_processes is None:
+            # coverage: ignore
+            num_processes = multiprocessing.cpu_count()
+        self._worker_pool = self._create_worker_pool(num_processes)
+        self._num_workers = num_processes
+
+    def stop_workers(self) -> None:
+        """Shut down the worker pool started with `start_workers`, if any."""
+        if self._worker_pool is not None:
+            self._worker_pool.terminate()
+            self._worker_pool.join()
+            self._worker_pool = None
+
+    def __enter__(self) -> 'VariationalStudy':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop_workers()
 
     def __str__(self) -> str:
         header = []   # type: List[str]
@@ -539,55 +867,358 @@ class VariationalStudy:
                 'preparation_circuit': self._preparation_circuit,
                 'initial_state': self.initial_state,
                 'target': self.target,
-                'black_box_type': self._black_box_type}
+                'black_box_type': self._black_box_type,
+                'journal': self.journal,
+                'profile': self.profile,
+                'trace_dir': self.trace_dir}
+
+    def _filename(self, extension: str) -> str:
+        return self._filename_in_datadir(
+                '{}.{}'.format(self.name, extension))
+
+    def _append_to_journal(self, record: Tuple) -> None:
+        """Append a record to the journal if journaling is enabled."""
+        if not self.journal:
+            return
+        if not self._journal_started:
+            self._start_journal()
+        self._journal.append(record)
+
+    def _start_journal(self) -> None:
+        """Replace the journal with an empty one for the current generation."""
+        if self.datadir is not None and not os.path.isdir(self.datadir):
+            os.mkdir(self.datadir)
+        self._journal.create(('study',
+                              self._generation,
+                              type(self),
+                              self._init_kwargs()))
+        self._journal_started = True
+
+    def _replay_journal(self, records: List[Tuple]) -> None:
+        """Add the results recorded in a journal to the study."""
+        started = {}  # type: Dict[Hashable, OptimizationParams]
+        new_results = collections.OrderedDict() \
+                # type: Dict[Hashable, List[OptimizationResult]]
+        for kind, identifier, value in records:
+            if kind == 'start':
+                started[identifier] = value
+                new_results[identifier] = []
+            else:
+                new_results.setdefault(identifier, []).append(value)
+        for identifier, results in new_results.items():
+            if identifier in started:
+                self.trial_results[identifier] = OptimizationTrialResult(
+                        results, started[identifier])
+            else:
+                self.trial_results[identifier].extend(results)
+
+    def save(self, columnar_traces: bool=False) -> None:
+        """Save the study to disk.
+
+        The study file is replaced atomically, so an interruption while saving
+        leaves the previously saved study intact. If journaling is enabled,
+        the journal is emptied once the study file has been written.
+
+        Args:
+            columnar_traces: Whether to save the function values and wait
+                times of each result as numpy arrays in a separate directory
+                instead of pickling them into the study file. The arrays are
+                memory-mapped when the study is loaded, so loading a study
+                with large traces is fast and summary data such as the data
+                frames of the trial results can be used without reading them.
+        """
+        filename = self._filename('study')
+        if self.datadir is not None and not os.path.isdir(self.datadir):
+            os.mkdir(self.datadir)
+        self._generation += 1
+        trial_results = self.trial_results
+        if columnar_traces:
+            trial_results = self._save_traces(
+                    '{}.traces.{}'.format(self.name, self._generation))
+        temp_filename = '{}.tmp'.format(filename)
+        with open(temp_filename, 'wb') as f:
+            pickle.dump(
+                    (type(self),
+                     self._init_kwargs(),
+                     trial_results,
+                     self._generation),
+                    f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+        self._remove_old_traces()
+        if self.journal:
+            self._start_journal()
+
+    def _save_traces(self, traces_dirname: str
+                     ) -> Dict[Any, OptimizationTrialResult]:
+        """Save the traces of all results in a directory.
+
+        Returns a copy of the trial results in which the traces are replaced
+        by references to the saved arrays.
+        """
+        trial_results = collections.OrderedDict() \
+                # type: Dict[Any, OptimizationTrialResult]
+        for i, (identifier, trial_result) in enumerate(
+                self.trial_results.items()):
+            trial_result = copy.copy(trial_result)
+            trial_result.results = [copy.copy(result)
+                                    for result in trial_result.results]
+            for j, result in enumerate(trial_result.results):
+                dirname = os.path.join(traces_dirname, str(i), str(j))
+                path = self._filename_in_datadir(dirname)
+                if result.function_values is not None:
+                    trace = result.function_values
+                    if not isinstance(trace, FunctionValueTrace):
+                        trace = FunctionValueTrace.from_function_values(
+                                trace)
+                    trace.save(path)
+                    result.function_values = _TraceReference(dirname)
+                if result.wait_times is not None:
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                    numpy.save(os.path.join(path, 'wait_times.npy'),
+                               numpy.asarray(result.wait_times, dtype=float))
+                    result.wait_times = _TraceReference(
+                            os.path.join(dirname, 'wait_times.npy'))
+            trial_results[identifier] = trial_result
+        return trial_results
+
+    def _remove_old_traces(self) -> None:
+        """Remove trace directories left by previous saves."""
+        current = '{}.traces.{}'.format(self.name, self._generation)
+        prefix = '{}.traces.'.format(self.name)
+        for dirname in os.listdir(self.datadir or os.curdir):
+            if dirname.startswith(prefix) and dirname != current:
+                shutil.rmtree(self._filename_in_datadir(dirname))
 
-    def save(self) -> None:
-        """Save the study to disk."""
-        filename = '{}.study'.format(self.name)
+    def _filename_in_datadir(self, filename: str) -> str:
         if self.datadir is not None:
             filename = os.path.join(self.datadir, filename)
-            if not os.path.isdir(self.datadir):
-                os.mkdir(self.datadir)
-        with open(filename, 'wb') as f:
-            pickle.dump(
-                    (type(self), self._init_kwargs(), self.trial_results), f)
+        return filename
 
     @staticmethod
-    def load(name: str, datadir: Optional[str]=None) -> 'VariationalStudy':
+    def load(name: str,
+             datadir: Optional[str]=None,
+             mmap_mode: Optional[str]='r') -> 'VariationalStudy':
         """Load a study from disk.
 
+        Results that were recorded in the journal of the study after it was
+        last saved are recovered as well. A study that was never saved can be
+        loaded from its journal alone.
+
         Args:
             name: The name of the study.
             datadir: The directory where the study file is saved.
+            mmap_mode: For studies saved with `columnar_traces` set to True,
+                the mode used to memory-map the traces, as accepted by
+                `numpy.load`. Set this to None to read the traces into
+                memory. Traces are only read when they are first accessed.
         """
         if name.endswith('.study'):
-            filename = name
-        else:
-            filename = '{}.study'.format(name)
+            name = name[:-len('.study')]
+        filename = '{}.study'.format(name)
         if datadir is not None:
             filename = os.path.join(datadir, filename)
-        with open(filename, 'rb') as f:
-            cls, kwargs, trial_results = pickle.load(f)
+        journal = Journal('{}.journal'.format(filename[:-len('.study')]))
+        records = journal.read() if journal.exists() else []
+
+        if os.path.isfile(filename) or not records:
+            with open(filename, 'rb') as f:
+                cls, kwargs, trial_results, *rest = pickle.load(f)
+            generation = rest[0] if rest else 0
+        else:
+            _, generation, cls, kwargs = records[0]
+            trial_results = {}
+
         study = cls(datadir=datadir, **kwargs)
+        study._generation = generation
         for key, val in trial_results.items():
+            for result in val.results:
+                if isinstance(result.function_values, _TraceReference):
+                    result.function_values = FunctionValueTrace.load(
+                            study._filename_in_datadir(
+                                result.function_values.path),
+                            mmap_mode=mmap_mode)
+                if isinstance(result.wait_times, _TraceReference):
+                    result.wait_times = numpy.load(
+                            study._filename_in_datadir(result.wait_times.path),
+                            mmap_mode=mmap_mode)
             study.trial_results[key] = val
+
+        # Journals older than the study file only contain saved results
+        if records and records[0][1] >= generation:
+            study._replay_journal(records[1:])
+            study._journal_started = True
         return study
 
 
-def _run_optimization(args) -> OptimizationResult:
-    """Perform an optimization run and return the result."""
+class _TraceReference:
+    """Stands in for a trace saved in a file, relative to the data directory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+
+class StoppingPolicy:
+    """A rule for cancelling the remaining repetitions of an optimization run.
+
+    Repeating an optimization run from different random seeds guards against
+    poor local optima, but once a repetition has reached the target value of
+    the study, or several repetitions have converged to the same optimal
+    value, further repetitions are unlikely to improve the result.
+
+    Attributes:
+        stop_at_target: Whether to stop once the optimal value of a
+            repetition is at most the target value of the study, if the study
+            has a target.
+        num_agreeing: The number of repetitions whose optimal values must be
+            within `tolerance` of the best optimal value of the run for the
+            run to stop, or None to not stop on agreement.
+        tolerance: The tolerance within which optimal values agree.
+    """
+
+    def __init__(self,
+                 stop_at_target: bool=True,
+                 num_agreeing: Optional[int]=None,
+                 tolerance: float=1e-6) -> None:
+        """
+        Args:
+            stop_at_target: Whether to stop once the optimal value of a
+                repetition is at most the target value of the study.
+            num_agreeing: The number of repetitions whose optimal values must
+                be within `tolerance` of the best optimal value of the run.
+                The default behavior is to not stop on agreement.
+            tolerance: The tolerance within which optimal values agree.
+        """
+        if num_agreeing is not None and num_agreeing < 1:
+            raise ValueError('The number of agreeing repetitions must be '
+                             'positive.')
+        self.stop_at_target = stop_at_target
+        self.num_agreeing = num_agreeing
+        self.tolerance = tolerance
+
+    def should_stop(self,
+                    trial_result: OptimizationTrialResult,
+                    target: Optional[float]=None) -> bool:
+        """Whether the remaining repetitions of a run should be cancelled.
+
+        Args:
+            trial_result: The results of the repetitions of the run that have
+                completed.
+            target: The target value of the study.
+        """
+        if not trial_result.repetitions:
+            return False
+        optimal_values = trial_result.optimal_values
+        best_value = trial_result.optimal_value
+        if (self.stop_at_target and target is not None
+                and best_value <= target):
+            return True
+        if self.num_agreeing is not None:
+            num_agreeing = numpy.sum(
+                    optimal_values <= best_value + self.tolerance)
+            return bool(num_agreeing >= self.num_agreeing)
+        return False
+
+
+class SuccessiveHalving:
+    """A schedule for a sweep of runs with a growing budget of evaluations.
+
+    Most runs of a large sweep can be told apart from the best ones after a
+    small fraction of their evaluations. Successive halving first performs
+    every run with a budget of `min_evaluations` evaluations per repetition.
+    Only the best 1 / `reduction_factor` of the runs, ranked by their optimal
+    values, are then performed again with a budget that is
+    `reduction_factor` times larger, and so on. Once a single run is left
+    or the budget reaches `max_evaluations`, the remaining runs are
+    performed with a budget of `max_evaluations` evaluations. Runs are
+    restarted in each round rather than continued, since optimization
+    algorithms can't generally be resumed.
+
+    Attributes:
+        min_evaluations: The budget of evaluations of the first round.
+        reduction_factor: The factor by which the number of runs is divided
+            and the budget is multiplied after each round.
+        max_evaluations: The budget of evaluations of the last round, or
+            None for an unlimited budget.
+    """
+
+    def __init__(self,
+                 min_evaluations: int,
+                 reduction_factor: int=3,
+                 max_evaluations: Optional[int]=None) -> None:
+        """
+        Args:
+            min_evaluations: The budget of evaluations of the first round.
+            reduction_factor: The factor by which the number of runs is
+                divided and the budget is multiplied after each round.
+            max_evaluations: The budget of evaluations of the last round.
+                The default behavior is to not limit the last round.
+        """
+        if min_evaluations < 1:
+            raise ValueError('The budget of evaluations must be positive.')
+        if reduction_factor < 2:
+            raise ValueError('The reduction factor must be at least 2.')
+        self.min_evaluations = min_evaluations
+        self.reduction_factor = reduction_factor
+        self.max_evaluations = max_evaluations
+
+    def rounds(self, num_runs: int) -> Iterator[Tuple[Optional[int], int]]:
+        """The budget of evaluations and the number of runs of each round.
+
+        Args:
+            num_runs: The number of runs in the sweep.
+        """
+        budget = self.min_evaluations
+        while (num_runs > 1 and
+               (self.max_evaluations is None or
+                budget < self.max_evaluations)):
+            yield budget, num_runs
+            num_runs = -(-num_runs // self.reduction_factor)
+            budget *= self.reduction_factor
+        yield self.max_evaluations, num_runs
+
+
+# The study context of a worker process, set by _initialize_worker
+_worker_process_context = None  # type: Optional[Tuple]
+
+
+def _initialize_worker(context: Tuple) -> None:
+    """Store the study context in a newly started worker process."""
+    global _worker_process_context
+    _worker_process_context = context
+
+
+def _run_optimization_task(task: Tuple) -> OptimizationResult:
+    """Perform an optimization run in an initialized worker process."""
+    return _run_optimization(_worker_process_context, *task)
+
+
+def _run_optimization(context: Tuple,
+                      optimization_params: OptimizationParams,
+                      reevaluate_final_params: bool,
+                      save_x_vals: bool,
+                      seed: int,
+                      max_evaluations: Optional[int]=None
+                      ) -> OptimizationResult:
+    """Perform an optimization run and return the result.
+
+    If `max_evaluations` is given, the run is cut short once the black box
+    has been evaluated that many times, and the best point evaluated so far
+    is returned.
+    """
     (
             ansatz,
             objective,
             preparation_circuit,
             initial_state,
-            optimization_params,
-            reevaluate_final_params,
-            save_x_vals,
-            seed,
             default_initial_params,
-            black_box_type
-    ) = args
+            black_box_type,
+            profile,
+            trace_prefix
+    ) = context
 
     stateful = issubclass(black_box_type, StatefulBlackBox)
 
@@ -598,29 +1229,54 @@ def _run_optimization(args) -> OptimizationResult:
                 preparation_circuit=preparation_circuit,
                 initial_state=initial_state,
                 cost_of_evaluate=optimization_params.cost_of_evaluate,
-                save_x_vals=save_x_vals)
+                noiseless_cache_size=optimization_params.cache_size,
+                save_x_vals=save_x_vals,
+                max_evaluations=max_evaluations)
     else:
         black_box = black_box_type(  # type: ignore
                 ansatz=ansatz,
                 objective=objective,
                 preparation_circuit=preparation_circuit,
                 initial_state=initial_state,
-                cost_of_evaluate=optimization_params.cost_of_evaluate)
+                cost_of_evaluate=optimization_params.cost_of_evaluate,
+                noiseless_cache_size=optimization_params.cache_size)
 
     initial_guess = optimization_params.initial_guess
     initial_guess_array = optimization_params.initial_guess_array
+    # An initial guess given without an array is not overridden by a
+    # default array, since algorithms may prefer the array
+    if initial_guess_array is None and initial_guess is None:
+        initial_guess_array = numpy.array([default_initial_params])
     if initial_guess is None:
         initial_guess = default_initial_params
-    if initial_guess_array is None:
-        initial_guess_array = numpy.array([default_initial_params])
+
+    profiler = None  # type: Optional[Profiler]
+    if profile:
+        profiler = Profiler(record_events=trace_prefix is not None)
 
     numpy.random.seed(seed)
     t0 = time.time()
-    result = optimization_params.algorithm.optimize(black_box,
-                                                    initial_guess,
-                                                    initial_guess_array)
+    with profiling.profile(profiler):
+        try:
+            result = optimization_params.algorithm.optimize(
+                    black_box, initial_guess, initial_guess_array)
+        except EvaluationBudgetExhausted:
+            if black_box.best_point is None:
+                raise
+            result = OptimizationResult(
+                    optimal_value=black_box.best_value,
+                    optimal_parameters=black_box.best_point,
+                    message='The budget of evaluations was exhausted.')
     t1 = time.time()
 
+    if profiler is not None:
+        profiler.record('optimization', t0, t1 - t0)
+        result.profile = profiler.histograms
+        if trace_prefix is not None:
+            os.makedirs(os.path.dirname(trace_prefix), exist_ok=True)
+            profiler.export_chrome_trace(
+                    '{}.{}.trace.json'.format(trace_prefix, os.getpid()))
+
     result.seed = seed
     result.time = t1 - t0
     if stateful:
@@ -629,7 +1285,10 @@ def _run_optimization(args) -> OptimizationResult:
         result.function_values = black_box.function_values
         result.wait_times = black_box.wait_times
     if reevaluate_final_params:
-        result.optimal_value = black_box.evaluate_noiseless(
+        result.optimal_value = black_box.cached_evaluate_noiseless(
                 result.optimal_parameters)
+    if black_box.noiseless_cache is not None:
+        result.cache_hits = black_box.noiseless_cache.hits
+        result.cache_misses = black_box.noiseless_cache.misses
 
     return result
@@ -10,19 +10,29 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import concurrent.futures
+import json
 import os
 
 import numpy
 import cirq
 import pytest
 
-from openfermioncirq import VariationalObjective, VariationalStudy
+from openfermioncirq import (
+        ClusterExecutor, VariationalObjective, VariationalStudy)
 from openfermioncirq.optimization import (
+        CMAES,
+        COBYLA,
+        FunctionValueTrace,
         OptimizationParams,
+        OptimizationResult,
         OptimizationTrialResult,
         ScipyOptimizationAlgorithm)
 from openfermioncirq.variational import variational_black_box
+from openfermioncirq.variational.shared_memory import SharedArray
 from openfermioncirq.variational.study import (
+        StoppingPolicy,
+        SuccessiveHalving,
         VariationalStudy)
 from openfermioncirq.variational.variational_black_box import (
         UnitarySimulateVariationalBlackBox,
@@ -144,6 +154,431 @@ def test_variational_study_optimize_and_extend_and_summary():
     assert str(study).startswith('This study contains')
 
 
+def test_variational_study_cache():
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    result = study.optimize(
+            OptimizationParams(LazyAlgorithm(), cache_size=10),
+            reevaluate_final_params=True).results[0]
+    assert result.num_evaluations == 1
+    assert result.cache_hits == 1
+    assert result.cache_misses == 1
+
+    result = study.optimize(OptimizationParams(LazyAlgorithm())).results[0]
+    assert result.cache_hits is None
+
+
+def test_variational_study_persistent_workers():
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+
+    with study:
+        study.start_workers(num_processes=2)
+        pool = study._worker_pool
+        assert pool is not None
+
+        study.optimize(OptimizationParams(test_algorithm),
+                       'run',
+                       repetitions=3,
+                       use_multiprocessing=True)
+        study.extend_result('run',
+                            repetitions=2,
+                            use_multiprocessing=True)
+        study.optimize_sweep(
+                [OptimizationParams(test_algorithm),
+                    OptimizationParams(LazyAlgorithm())],
+                identifiers=['test', 'lazy'],
+                use_multiprocessing=True)
+        assert study._worker_pool is pool
+
+    assert study._worker_pool is None
+    assert study.trial_results['run'].repetitions == 5
+    assert study.trial_results['lazy'].optimal_value == 0.0
+    for result in study.trial_results['run'].results:
+        assert result.num_evaluations == 5
+
+
+def test_stopping_policy():
+    params = OptimizationParams(LazyAlgorithm())
+    results = [OptimizationResult(value, numpy.zeros(2))
+               for value in [1.0, 0.5, 0.5 + 1e-8, 2.0]]
+
+    policy = StoppingPolicy(num_agreeing=2)
+    assert not policy.should_stop(OptimizationTrialResult([], params))
+    assert not policy.should_stop(
+            OptimizationTrialResult(results[:2], params))
+    assert policy.should_stop(OptimizationTrialResult(results[:3], params))
+    assert not StoppingPolicy(num_agreeing=2, tolerance=1e-9).should_stop(
+            OptimizationTrialResult(results, params))
+
+    trial_result = OptimizationTrialResult(results[:1], params)
+    assert StoppingPolicy().should_stop(trial_result, target=1.0)
+    assert not StoppingPolicy().should_stop(trial_result, target=0.9)
+    assert not StoppingPolicy().should_stop(trial_result)
+    assert not StoppingPolicy(stop_at_target=False).should_stop(
+            trial_result, target=1.0)
+
+    with pytest.raises(ValueError):
+        _ = StoppingPolicy(num_agreeing=0)
+
+
+def test_variational_study_stopping_policy_and_progress():
+    study = VariationalStudy('study', test_ansatz, test_objective)
+    progress = []
+
+    def progress_callback(identifier, trial_result):
+        progress.append((identifier, trial_result.repetitions))
+
+    # Repetitions of the lazy algorithm always agree
+    study.optimize(OptimizationParams(LazyAlgorithm()),
+                   'agree',
+                   repetitions=10,
+                   stopping_policy=StoppingPolicy(num_agreeing=3),
+                   progress_callback=progress_callback)
+    assert progress == [('agree', 1), ('agree', 2), ('agree', 3)]
+    assert study.trial_results['agree'].repetitions == 3
+
+    # Already satisfied
+    study.extend_result('agree',
+                        repetitions=2,
+                        stopping_policy=StoppingPolicy(num_agreeing=3))
+    assert study.trial_results['agree'].repetitions == 3
+
+    study.target = study.trial_results['agree'].optimal_value
+    for identifier, num_processes in [('target', 2), ('sweep', 3)]:
+        study.optimize(OptimizationParams(LazyAlgorithm()),
+                       identifier,
+                       repetitions=6,
+                       use_multiprocessing=True,
+                       num_processes=num_processes,
+                       stopping_policy=StoppingPolicy())
+        assert study.trial_results[identifier].repetitions == 1
+
+    with study:
+        study.start_workers(num_processes=2)
+        study.optimize_sweep(
+                [OptimizationParams(LazyAlgorithm()),
+                    OptimizationParams(test_algorithm)],
+                identifiers=['lazy', 'test'],
+                repetitions=4,
+                use_multiprocessing=True,
+                stopping_policy=StoppingPolicy(stop_at_target=False,
+                                               num_agreeing=2),
+                progress_callback=progress_callback)
+    assert study.trial_results['lazy'].repetitions == 2
+    assert 2 <= study.trial_results['test'].repetitions <= 4
+    assert len([identifier for identifier, _ in progress
+                if identifier in ('lazy', 'test')]) == (
+            study.trial_results['lazy'].repetitions
+            + study.trial_results['test'].repetitions)
+
+
+def test_successive_halving_rounds():
+    assert list(SuccessiveHalving(5, 2, 40).rounds(4)) == [
+            (5, 4), (10, 2), (40, 1)]
+    assert list(SuccessiveHalving(5, 3).rounds(10)) == [
+            (5, 10), (15, 4), (45, 2), (None, 1)]
+    assert list(SuccessiveHalving(5, 2, 8).rounds(10)) == [
+            (5, 10), (8, 5)]
+    assert list(SuccessiveHalving(5).rounds(1)) == [(None, 1)]
+
+    with pytest.raises(ValueError):
+        _ = SuccessiveHalving(0)
+    with pytest.raises(ValueError):
+        _ = SuccessiveHalving(5, reduction_factor=1)
+
+
+def test_variational_study_successive_halving():
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    param_sweep = [OptimizationParams(COBYLA, initial_guess=numpy.array(x))
+                   for x in [[0.5, 0.5], [0.0, 0.0], [1.0, 0.0], [0.1, 0.0]]]
+    identifiers = ['a', 'b', 'c', 'd']
+    progress = []
+
+    def progress_callback(identifier, trial_result):
+        progress.append((identifier,
+                         trial_result.results[-1].num_evaluations))
+
+    results = study.optimize_sweep(
+            param_sweep,
+            identifiers,
+            repetitions=2,
+            progress_callback=progress_callback,
+            successive_halving=SuccessiveHalving(5, 2, 40))
+
+    assert [result.repetitions for result in results] == [2, 2, 2, 2]
+    # Every run takes part in the first round
+    assert [identifier for identifier, _ in progress[:8]] == [
+            'a', 'a', 'b', 'b', 'c', 'c', 'd', 'd']
+    assert all(num_evaluations <= 5 for _, num_evaluations in progress[:8])
+    # Two runs are repeated with 10 evaluations, then one with 40
+    survivors = [identifier for identifier, _ in progress[8:12]]
+    assert len(set(survivors)) == 2
+    assert all(num_evaluations <= 10 for _, num_evaluations in progress[8:12])
+    winner = progress[12][0]
+    assert winner in survivors
+    assert [identifier for identifier, _ in progress[12:]] == [winner] * 2
+    assert 10 < max(num_evaluations for _, num_evaluations in progress[12:])
+    assert all(num_evaluations <= 40 for _, num_evaluations in progress[12:])
+    assert len(progress) == 14
+    eliminated = [identifier for identifier in identifiers
+                  if identifier not in survivors]
+    assert all(study.trial_results[identifier].optimal_value >=
+               study.trial_results[winner].optimal_value
+               for identifier in eliminated)
+    assert (study.trial_results[eliminated[0]].results[0].message ==
+            'The budget of evaluations was exhausted.')
+    # Every round uses the same seeds
+    assert (study.trial_results[winner].data_frame['seed'].tolist() ==
+            study.trial_results[eliminated[0]].data_frame['seed'].tolist())
+
+    # Batches larger than the first round's budget are cut short
+    initial_guess_array = numpy.array([[0.5, 0.5], [0.0, 1.0], [1.0, 0.0]])
+    results = study.optimize_sweep(
+            [OptimizationParams(CMAES(options={'seed': seed}),
+                                initial_guess_array=initial_guess_array)
+             for seed in range(3)],
+            successive_halving=SuccessiveHalving(2, 2, 40))
+    for result in results:
+        assert result.results[0].optimal_parameters is not None
+    assert sorted(result.results[0].num_evaluations
+                  for result in results) == [2, 4, 40]
+
+    with pytest.raises(ValueError):
+        study.optimize_sweep(param_sweep, identifiers, resume=True,
+                             successive_halving=SuccessiveHalving(5))
+    with pytest.raises(ValueError):
+        test_study.optimize_sweep(param_sweep,
+                                  successive_halving=SuccessiveHalving(5))
+
+
+@pytest.mark.parametrize('executor_type', [
+    concurrent.futures.ThreadPoolExecutor,
+    concurrent.futures.ProcessPoolExecutor,
+    ClusterExecutor,
+])
+def test_variational_study_executor(executor_type):
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    if executor_type is ClusterExecutor:
+        executor = ClusterExecutor(num_local_workers=2)
+    else:
+        executor = executor_type(2)
+
+    with executor:
+        study.optimize(OptimizationParams(test_algorithm),
+                       'run',
+                       repetitions=3,
+                       seeds=[2, 3, 4],
+                       executor=executor)
+        study.extend_result('run',
+                            repetitions=2,
+                            executor=executor)
+        study.optimize_sweep(
+                [OptimizationParams(LazyAlgorithm())] * 2,
+                identifiers=['lazy0', 'lazy1'],
+                repetitions=5,
+                executor=executor,
+                stopping_policy=StoppingPolicy(num_agreeing=2))
+
+    assert study.trial_results['run'].repetitions == 5
+    assert sorted(study.trial_results['run'].data_frame['seed'][:3]) == [
+            2, 3, 4]
+    for result in study.trial_results['run'].results:
+        assert result.num_evaluations == 5
+    assert study.trial_results['lazy0'].repetitions == 2
+    assert study.trial_results['lazy1'].repetitions == 2
+
+
+def test_variational_study_save_load_columnar_traces(tmpdir):
+    datadir = str(tmpdir)
+    study = VariationalStudy(
+            'columnar_study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL,
+            datadir=datadir)
+    study.optimize(OptimizationParams(test_algorithm), 'run',
+                   repetitions=2, save_x_vals=True)
+    study.save(columnar_traces=True)
+    study.save(columnar_traces=True)
+    assert sorted(os.listdir(datadir)) == ['columnar_study.study',
+                                           'columnar_study.traces.2']
+
+    loaded_study = VariationalStudy.load('columnar_study', datadir=datadir)
+    trial_result = loaded_study.trial_results['run']
+    assert trial_result.repetitions == 2
+    assert list(trial_result.data_frame['optimal_value']) == list(
+            study.trial_results['run'].data_frame['optimal_value'])
+    for result, loaded_result in zip(study.trial_results['run'].results,
+                                     trial_result.results):
+        assert isinstance(loaded_result.function_values, FunctionValueTrace)
+        assert loaded_result.function_values == result.function_values
+        numpy.testing.assert_allclose(loaded_result.wait_times,
+                                      result.wait_times)
+
+    # Saving without columnar traces pickles the loaded traces
+    loaded_study.save()
+    assert sorted(os.listdir(datadir)) == ['columnar_study.study']
+    reloaded_study = VariationalStudy.load('columnar_study', datadir=datadir)
+    assert (reloaded_study.trial_results['run'].results[0].function_values
+            == study.trial_results['run'].results[0].function_values)
+
+
+def test_variational_study_cma_es_initial_guess_array():
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    initial_guess_array = numpy.array([[0.9, 0.9],
+                                       [0.1, 0.2],
+                                       [-0.8, 0.9]])
+    result = study.optimize(
+            OptimizationParams(CMAES(options={'maxfev': 3}),
+                               initial_guess_array=initial_guess_array),
+            save_x_vals=True).results[0]
+    # Only the rows of the array were evaluated, and the best is returned
+    X = numpy.array([x for _, _, x in result.function_values])
+    vals = [val for val, _, _ in result.function_values]
+    numpy.testing.assert_allclose(X, initial_guess_array)
+    numpy.testing.assert_allclose(result.optimal_parameters,
+                                  initial_guess_array[numpy.argmin(vals)])
+
+
+class RecordingCMAES(CMAES):
+    """Records the initial guesses that it is called with."""
+
+    calls = []  # type: list
+
+    def optimize(self, black_box, initial_guess=None,
+                 initial_guess_array=None):
+        RecordingCMAES.calls.append((initial_guess, initial_guess_array))
+        return super().optimize(black_box, initial_guess, initial_guess_array)
+
+
+def test_variational_study_cma_es_initial_guess():
+    study = VariationalStudy(
+            'study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    initial_guess = numpy.array([0.3, -0.7])
+    RecordingCMAES.calls = []
+    result = study.optimize(
+            OptimizationParams(RecordingCMAES(options={'maxfev': 13,
+                                                       'seed': 0,
+                                                       'sigma': 1e-3}),
+                               initial_guess=initial_guess),
+            save_x_vals=True).results[0]
+    # No default array overrides the initial guess
+    (guess, guess_array), = RecordingCMAES.calls
+    numpy.testing.assert_allclose(guess, initial_guess)
+    assert guess_array is None
+    # The first evaluated point is sampled close to the initial guess
+    first_point = result.function_values[0][2]
+    numpy.testing.assert_allclose(first_point, initial_guess, atol=1e-2)
+
+
+def test_variational_study_profile(tmpdir):
+    trace_dir = os.path.join(str(tmpdir), 'traces')
+    study = VariationalStudy(
+            'profiled_study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL,
+            trace_dir=trace_dir)
+    assert study.profile
+    study.optimize(OptimizationParams(test_algorithm), 'run', repetitions=2)
+    trial_result = study.trial_results['run']
+    for result in trial_result.results:
+        assert result.profile['optimization'].count == 1
+        assert result.profile['simulate'].count == result.num_evaluations
+    assert trial_result.profile['optimization'].count == 2
+
+    filename = 'profiled_study.{}.trace.json'.format(os.getpid())
+    assert os.listdir(trace_dir) == [filename]
+    with open(os.path.join(trace_dir, filename)) as f:
+        events = json.loads(f.read().rstrip().rstrip(',') + ']')
+    assert {event['name'] for event in events} >= {'optimization', 'simulate'}
+
+    # Results are not profiled by default
+    result = test_study.optimize(OptimizationParams(test_algorithm)).results[0]
+    assert result.profile is None
+
+
+def test_variational_study_extend_loaded_result_without_cache_size(tmpdir):
+    datadir = str(tmpdir)
+    study = VariationalStudy(
+            'old_study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL,
+            datadir=datadir)
+    study.optimize(OptimizationParams(test_algorithm), 'run')
+    # Parameters saved before the cache size was added
+    del study.trial_results['run'].params.cache_size
+    study.save()
+
+    loaded_study = VariationalStudy.load('old_study', datadir=datadir)
+    assert loaded_study.trial_results['run'].params.cache_size == 0
+    loaded_study.extend_result('run', repetitions=2)
+    assert loaded_study.trial_results['run'].repetitions == 3
+
+
+class FailingAlgorithm(LazyAlgorithm):
+    """Raises an error, like an optimization that was interrupted."""
+
+    def optimize(self, black_box, initial_guess=None, initial_guess_array=None):
+        raise KeyboardInterrupt
+
+
+def test_variational_study_journal_and_resume(tmpdir):
+    datadir = str(tmpdir)
+    study = VariationalStudy(
+            'journal_study', test_ansatz, test_objective,
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL,
+            datadir=datadir,
+            journal=True)
+
+    study.optimize(OptimizationParams(test_algorithm), 'first',
+                   repetitions=2, seeds=[1, 2])
+    with pytest.raises(KeyboardInterrupt):
+        study.optimize_sweep(
+                [OptimizationParams(test_algorithm),
+                    OptimizationParams(FailingAlgorithm())],
+                identifiers=['a', 'b'],
+                repetitions=2,
+                seeds=[3, 4])
+
+    # The study was never saved, but its results are in the journal
+    assert not os.path.isfile(os.path.join(datadir, 'journal_study.study'))
+    loaded_study = VariationalStudy.load('journal_study', datadir=datadir)
+    assert loaded_study.journal
+    assert loaded_study.trial_results['first'].repetitions == 2
+    assert loaded_study.trial_results['a'].repetitions == 2
+    assert loaded_study.trial_results['b'].repetitions == 0
+    numpy.testing.assert_allclose(
+            loaded_study.trial_results['a'].optimal_value,
+            study.trial_results['a'].optimal_value)
+
+    # Resuming only performs the missing repetitions
+    loaded_study.optimize_sweep(
+            [OptimizationParams(test_algorithm),
+                OptimizationParams(LazyAlgorithm())],
+            identifiers=['a', 'b'],
+            repetitions=3,
+            seeds=[3, 4, 5],
+            resume=True)
+    assert loaded_study.trial_results['a'].repetitions == 3
+    assert loaded_study.trial_results['b'].repetitions == 3
+    assert [result.seed for result in
+            loaded_study.trial_results['a'].results] == [3, 4, 5]
+
+    # Saving compacts the journal
+    loaded_study.save()
+    loaded_study.extend_result('first', repetitions=1)
+    reloaded_study = VariationalStudy.load('journal_study', datadir=datadir)
+    assert reloaded_study.trial_results['first'].repetitions == 3
+    assert reloaded_study.trial_results['a'].repetitions == 3
+    assert reloaded_study.trial_results['b'].repetitions == 3
+
+
 def test_variational_study_initial_state():
     preparation_circuit = cirq.Circuit(cirq.X(test_ansatz.qubits[0]))
     initial_state = numpy.array([0.0, 0.0, 1.0, 0.0])
@@ -175,6 +610,20 @@ def test_variational_study_initial_state():
 
     numpy.testing.assert_allclose(result1.optimal_value, result2.optimal_value)
 
+    study3 = VariationalStudy(
+            'study3',
+            test_ansatz,
+            TestObjective(),
+            initial_state=SharedArray(initial_state),
+            black_box_type=variational_black_box.UNITARY_SIMULATE_STATEFUL)
+    result3 = study3.optimize(
+            OptimizationParams(
+                LazyAlgorithm(), initial_guess=initial_guess),
+            use_multiprocessing=True,
+            num_processes=1)
+
+    numpy.testing.assert_allclose(result1.optimal_value, result3.optimal_value)
+
 
 def test_variational_study_run_too_few_seeds_raises_error():
     with pytest.raises(ValueError):
@@ -12,41 +12,68 @@
 
 """Black boxes for variational studies"""
 
-from typing import Optional, Sequence, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union, cast
 
 import abc
 
 import numpy
+import scipy.special
 
 import cirq
 
 from openfermioncirq.variational.ansatz import VariationalAnsatz
+from openfermioncirq.variational.hamiltonian_objective import (
+        HamiltonianObjective)
 from openfermioncirq.variational.objective import VariationalObjective
+from openfermioncirq.variational.shared_memory import SharedArray
+from openfermioncirq.variational.simulation import (
+        CompiledCircuit,
+        particle_number)
 from openfermioncirq.optimization import (
         BlackBox,
-        StatefulBlackBox)
+        EvaluationCache,
+        StatefulBlackBox,
+        profiling)
 
 
 class VariationalBlackBox(BlackBox):
     """A black box encapsulating a variational ansatz objective function.
 
+    The phases of an evaluation are timed by the active profiler (see
+    `openfermioncirq.optimization.profiling`) as the spans 'build_circuit',
+    'prepare_state', 'simulate', 'gradient', 'expectation_value' and, for
+    black boxes that sample, 'resolve_parameters', 'sample' and 'estimate'.
+
     Attributes:
         ansatz: The variational ansatz circuit.
         objective: The objective function.
         preparation_circuit: An optional circuit used to prepare the
             initial state
+        initial_state: The initial state of the simulation, given either as
+            the index of a computational basis state or as a state vector.
+            A state vector may be stored in shared memory as a SharedArray.
+        prepared_state: The state obtained by applying the preparation
+            circuit to the initial state. It is simulated the first time it
+            is needed and cached for later evaluations.
+        noiseless_cache: An EvaluationCache storing the results of noiseless
+            simulations, or None if caching is disabled. The artificial noise
+            of evaluations with a cost is added to the cached values.
     """
 
     def __init__(self,
                  ansatz: VariationalAnsatz,
                  objective: VariationalObjective,
                  preparation_circuit: Optional[cirq.Circuit]=None,
-                 initial_state: Union[int, numpy.ndarray]=0,
+                 initial_state: Union[int, numpy.ndarray, SharedArray]=0,
+                 noiseless_cache_size: int=0,
                  **kwargs) -> None:
         self.ansatz = ansatz
         self.objective = objective
         self.preparation_circuit = preparation_circuit or cirq.Circuit()
         self.initial_state = initial_state
+        self.noiseless_cache = (EvaluationCache(noiseless_cache_size)
+                                if noiseless_cache_size > 0 else None)
+        self._prepared_state = None  # type: Optional[numpy.ndarray]
         super().__init__(**kwargs)
 
     @property
@@ -59,16 +86,65 @@ class VariationalBlackBox(BlackBox):
         """Optional bounds on the inputs to the objective function."""
         return self.ansatz.param_bounds()
 
+    def prepared_state(self, copy: bool=True) -> numpy.ndarray:
+        """The initial state after the preparation circuit has been applied.
+
+        Args:
+            copy: Whether to return a copy of the cached state vector. Set
+                this to False to avoid the copy when the caller will not
+                modify the returned array, for instance because it only
+                reads from it or hands it to a simulator that does not write
+                to its input.
+        """
+        if self._prepared_state is None:
+            with profiling.span('prepare_state'):
+                self._prepared_state = self._prepare_state()
+        if copy:
+            return self._prepared_state.copy()
+        return self._prepared_state
+
+    def _prepare_state(self) -> numpy.ndarray:
+        """Simulate the parts of the circuit that have no parameters."""
+        initial_state = self.initial_state
+        if isinstance(initial_state, SharedArray):
+            initial_state = initial_state.array
+        return self.preparation_circuit.final_wavefunction(
+                initial_state,
+                qubit_order=self.ansatz.qubit_permutation(self.ansatz.qubits),
+                qubits_that_should_be_present=self.ansatz.qubits)
+
     @abc.abstractmethod
     def evaluate_noiseless(self,
                            x: numpy.ndarray) -> float:
         """Evaluate parameters with a noiseless simulation."""
 
+    def evaluate_noiseless_batch(self,
+                                 X: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate many parameter settings with noiseless simulations.
+
+        Args:
+            X: A 2d array whose rows are the parameter settings.
+        """
+        # Default: defer to evaluate_noiseless
+        return numpy.array([self.evaluate_noiseless(x) for x in X])
+
+    def cached_evaluate_noiseless(self,
+                                  x: numpy.ndarray) -> float:
+        """Evaluate parameters with a noiseless simulation.
+
+        If the black box has a noiseless cache and the parameters were
+        evaluated recently, the cached value is returned instead of running
+        the simulation again.
+        """
+        if self.noiseless_cache is None:
+            return self.evaluate_noiseless(x)
+        return self.noiseless_cache.evaluate(x, self.evaluate_noiseless)
+
     def _evaluate(self,
                   x: numpy.ndarray) -> float:
         """Determine the value of some parameters."""
         # Default: defer to evaluate_noiseless
-        return self.evaluate_noiseless(x)
+        return self.cached_evaluate_noiseless(x)
 
     def _evaluate_with_cost(self,
                             x: numpy.ndarray,
@@ -77,6 +153,23 @@ class VariationalBlackBox(BlackBox):
         # Default: add artifical noise with the specified cost
         return self._evaluate(x) + self.objective.noise(cost)
 
+    def _evaluate_batch(self,
+                        X: numpy.ndarray) -> numpy.ndarray:
+        """Determine the values of many parameter settings."""
+        # Default: defer to evaluate_noiseless_batch
+        if self.noiseless_cache is None:
+            return self.evaluate_noiseless_batch(X)
+        return self.noiseless_cache.evaluate_batch(
+                X, self.evaluate_noiseless_batch)
+
+    def _evaluate_batch_with_cost(self,
+                                  X: numpy.ndarray,
+                                  cost: float) -> numpy.ndarray:
+        """Evaluate many parameter settings with a specified cost."""
+        # Default: add artifical noise with the specified cost
+        return self._evaluate_batch(X) + numpy.array(
+                [self.objective.noise(cost) for _ in range(len(X))])
+
     def noise_bounds(self,
                      cost: float,
                      confidence: Optional[float]=None
@@ -86,18 +179,97 @@ class VariationalBlackBox(BlackBox):
 
 
 class UnitarySimulateVariationalBlackBox(VariationalBlackBox):
+    """A black box that simulates the ansatz circuit as a unitary.
+
+    The preparation circuit and the ansatz circuit are compiled into a
+    CompiledCircuit the first time the black box is evaluated, so that each
+    evaluation only maps the parameter array onto the compiled gates. The
+    preparation circuit and the leading gates of the ansatz that have no
+    parameters are simulated only once.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._compiled_circuit = None  # type: Optional[CompiledCircuit]
+        super().__init__(*args, **kwargs)
+
+    @property
+    def compiled_circuit(self) -> CompiledCircuit:
+        """The preparation and ansatz circuits compiled for simulation."""
+        if self._compiled_circuit is None:
+            with profiling.span('build_circuit'):
+                self._compiled_circuit = self._compile()
+        return self._compiled_circuit
+
+    def _compile(self) -> CompiledCircuit:
+        return CompiledCircuit(
+                self.preparation_circuit + self.ansatz.circuit,
+                list(self.ansatz.params()),
+                self.ansatz.qubit_permutation(self.ansatz.qubits),
+                list(self.ansatz.param_scale_factors()))
+
+    def _initial_state_vector(self) -> Union[int, numpy.ndarray]:
+        initial_state = self.initial_state
+        if isinstance(initial_state, SharedArray):
+            initial_state = initial_state.array
+        return initial_state
+
+    def _prepare_state(self) -> numpy.ndarray:
+        return self.compiled_circuit.prepare(self._initial_state_vector())
+
+    def _value(self, state: numpy.ndarray) -> float:
+        return self.objective.value(state)
+
+    def _value_batch(self, states: numpy.ndarray) -> numpy.ndarray:
+        return self.objective.value_batch(states)
+
+    def _apply_hamiltonian(self, state: numpy.ndarray) -> numpy.ndarray:
+        return cast(HamiltonianObjective,
+                    self.objective).apply_hamiltonian(state)
 
     def evaluate_noiseless(self,
                            x: numpy.ndarray) -> float:
         """Evaluate parameters with a noiseless simulation."""
-        # Default: evaluate using final_wavefunction
-        circuit = cirq.resolve_parameters(
-                self.preparation_circuit + self.ansatz.circuit,
-                self.ansatz.param_resolver(x))
-        final_state = circuit.final_wavefunction(
-                self.initial_state,
-                qubit_order=self.ansatz.qubit_permutation(self.ansatz.qubits))
-        return self.objective.value(final_state)
+        prepared_state = self.prepared_state(copy=False)
+        with profiling.span('simulate'):
+            final_state = self.compiled_circuit.final_state(
+                    prepared_state, x, prepared=True)
+        return self._value(final_state)
+
+    @property
+    def has_gradient(self) -> bool:
+        """Whether gradients can be computed.
+
+        They are available when the objective is a HamiltonianObjective.
+        """
+        return isinstance(self.objective, HamiltonianObjective)
+
+    def _evaluate_with_gradient(self,
+                                x: numpy.ndarray
+                                ) -> Tuple[float, numpy.ndarray]:
+        """Compute the energy and its gradient with the adjoint method."""
+        if not self.has_gradient:
+            return super()._evaluate_with_gradient(x)
+        prepared_state = self.prepared_state(copy=False)
+        with profiling.span('gradient'):
+            return self.compiled_circuit.value_and_gradient(
+                    prepared_state,
+                    x,
+                    self._apply_hamiltonian,
+                    prepared=True)
+
+    def evaluate_noiseless_batch(self,
+                                 X: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate many parameter settings with noiseless simulations.
+
+        The states for all of the parameter settings are evolved together,
+        and their values are computed with a single call to the
+        `value_batch` method of the objective.
+        """
+        prepared_state = self.prepared_state(copy=False)
+        with profiling.span('simulate'):
+            final_states = self.compiled_circuit.final_states(
+                    prepared_state, X, prepared=True)
+        return self._value_batch(final_states)
 
 
 class UnitarySimulateVariationalStatefulBlackBox(
@@ -106,5 +278,328 @@ class UnitarySimulateVariationalStatefulBlackBox(
     """A stateful black box encapsulating a variational objective function."""
 
 
+class NumberSectorSimulateVariationalBlackBox(
+        UnitarySimulateVariationalBlackBox):
+    """A black box that simulates the ansatz in a fixed particle number.
+
+    The preparation circuit is simulated once in the full space. Its output
+    must have a definite particle number N, and the ansatz circuit is then
+    simulated in the subspace of computational basis states with N qubits set
+    to 1. For n qubits, this reduces the length of the state vector from 2**n
+    to n choose N. Every gate of the ansatz must conserve particle number, as
+    the gates of the ansatzes in `openfermioncirq.variational.ansatzes` do;
+    otherwise a ValueError is raised when the circuit is simulated.
+
+    The objective must be a HamiltonianObjective, whose Hamiltonian is
+    assumed to conserve particle number. Its expectation values are computed
+    with the Hamiltonian restricted to the same subspace.
+    """
+
+    def __init__(self,
+                 ansatz: VariationalAnsatz,
+                 objective: VariationalObjective,
+                 *args,
+                 **kwargs) -> None:
+        if not isinstance(objective, HamiltonianObjective):
+            raise TypeError('Simulating in a fixed particle number requires '
+                            'a HamiltonianObjective.')
+        self._full_prepared_state = None  # type: Optional[numpy.ndarray]
+        super().__init__(ansatz, objective, *args, **kwargs)
+
+    def _compile(self) -> CompiledCircuit:
+        # The preparation circuit need not conserve particle number
+        self._full_prepared_state = VariationalBlackBox._prepare_state(self)
+        return CompiledCircuit(
+                self.ansatz.circuit,
+                list(self.ansatz.params()),
+                self.ansatz.qubit_permutation(self.ansatz.qubits),
+                list(self.ansatz.param_scale_factors()),
+                particle_number=particle_number(self._full_prepared_state))
+
+    def _prepare_state(self) -> numpy.ndarray:
+        compiled_circuit = self.compiled_circuit
+        prepared_state = compiled_circuit.prepare(self._full_prepared_state)
+        # Only the restricted state is kept
+        self._full_prepared_state = None
+        return prepared_state
+
+    def _hamiltonian_matrix(self):
+        return cast(HamiltonianObjective, self.objective).number_sector_matrix(
+                self.compiled_circuit.particle_number)
+
+    def _value(self, state: numpy.ndarray) -> float:
+        with profiling.span('expectation_value'):
+            return numpy.vdot(state, self._apply_hamiltonian(state)).real
+
+    def _value_batch(self, states: numpy.ndarray) -> numpy.ndarray:
+        with profiling.span('expectation_value'):
+            return numpy.real(numpy.sum(
+                    states.T.conj() * (self._hamiltonian_matrix() @ states.T),
+                    axis=0))
+
+    def _apply_hamiltonian(self, state: numpy.ndarray) -> numpy.ndarray:
+        return self._hamiltonian_matrix() @ state
+
+
+class NumberSectorSimulateVariationalStatefulBlackBox(
+        NumberSectorSimulateVariationalBlackBox,
+        StatefulBlackBox):
+    """A stateful black box that simulates in a fixed particle number."""
+
+
+class SampleVariationalBlackBox(UnitarySimulateVariationalBlackBox):
+    """A black box that estimates the energy from measurements.
+
+    Evaluations with a cost run the preparation circuit and the ansatz
+    circuit on a sampler, followed by the measurement circuit of the
+    objective, instead of adding artificial noise to the exact value. The
+    Pauli terms of the Hamiltonian are measured in qubit-wise commuting
+    groups, and the cost is the total number of measurements, which is
+    distributed among the groups by the objective's `shots_per_group`. The
+    circuits for all parameter settings and groups are submitted together
+    with a single call to `run_sweep` for each distinct number of
+    repetitions.
+
+    Evaluations without a cost are noiseless simulations, as in
+    UnitarySimulateVariationalBlackBox. The objective must be a
+    HamiltonianObjective, and the initial state must be a computational basis
+    state.
+
+    Attributes:
+        sampler: The sampler used to run the circuits.
+    """
+
+    def __init__(self,
+                 ansatz: VariationalAnsatz,
+                 objective: VariationalObjective,
+                 *args,
+                 sampler: Optional[cirq.Sampler]=None,
+                 **kwargs) -> None:
+        if not isinstance(objective, HamiltonianObjective):
+            raise TypeError('Estimating the energy from measurements '
+                            'requires a HamiltonianObjective.')
+        self.sampler = sampler or cirq.Simulator()
+        self._sampling_circuit = None  # type: Optional[cirq.Circuit]
+        super().__init__(ansatz, objective, *args, **kwargs)
+
+    @property
+    def sampling_circuit(self) -> cirq.Circuit:
+        """The circuit that is sampled, with the measurement parameters."""
+        if self._sampling_circuit is None:
+            if not isinstance(self.initial_state, (int, numpy.integer)):
+                raise ValueError('Sampling requires the initial state to be '
+                                 'a computational basis state.')
+            with profiling.span('build_circuit'):
+                qubits = self.ansatz.qubit_permutation(self.ansatz.qubits)
+                initial_state = cirq.Circuit(
+                        cirq.X(qubit) for i, qubit in enumerate(qubits)
+                        if self.initial_state >> (len(qubits) - 1 - i) & 1)
+                self._sampling_circuit = (
+                        initial_state
+                        + self.preparation_circuit
+                        + self.ansatz.circuit
+                        + cast(HamiltonianObjective,
+                               self.objective).measurement_circuit(qubits))
+        return self._sampling_circuit
+
+    def _evaluate_with_cost(self,
+                            x: numpy.ndarray,
+                            cost: float) -> float:
+        """Estimate the energy from `cost` measurements."""
+        return self._evaluate_batch_with_cost(
+                numpy.array([x]), cost)[0]
+
+    def _evaluate_batch_with_cost(self,
+                                  X: numpy.ndarray,
+                                  cost: float) -> numpy.ndarray:
+        """Estimate the energies of many parameter settings."""
+        objective = cast(HamiltonianObjective, self.objective)
+        group_resolvers = objective.measurement_resolvers()
+        shots = self._shots_per_group(cost)
+        resolvers = {}  # type: Dict[Tuple[int, int], cirq.ParamResolver]
+        with profiling.span('resolve_parameters'):
+            for i, x in enumerate(X):
+                param_dict = self.ansatz.param_resolver(x).param_dict
+                for j, group_resolver in enumerate(group_resolvers):
+                    resolver = dict(param_dict)
+                    resolver.update(group_resolver)
+                    resolvers[i, j] = cirq.ParamResolver(resolver)
+
+        samples = [[None] * len(group_resolvers) for _ in range(len(X))] \
+            # type: List[List[Optional[numpy.ndarray]]]
+        for repetitions in sorted(set(shots)):
+            indices = [(i, j) for i in range(len(X))
+                       for j in range(len(group_resolvers))
+                       if shots[j] == repetitions]
+            sampling_circuit = self.sampling_circuit
+            with profiling.span('sample'):
+                results = self.sampler.run_sweep(
+                        sampling_circuit,
+                        [resolvers[index] for index in indices],
+                        repetitions=int(repetitions))
+            for (i, j), result in zip(indices, results):
+                samples[i][j] = result.measurements['hamiltonian']
+
+        values = []
+        for point_samples in samples:
+            group_values = objective.group_sample_values(point_samples)
+            self._record_group_values(group_values)
+            values.append(objective.value_from_group_values(group_values))
+        return numpy.array(values)
+
+    def _shots_per_group(self, cost: float) -> numpy.ndarray:
+        return cast(HamiltonianObjective, self.objective).shots_per_group(cost)
+
+    def _record_group_values(self,
+                             group_values: Sequence[numpy.ndarray]) -> None:
+        pass
+
+
+class MeasurementStatistics:
+    """Running statistics of the per-shot values of measurement groups.
+
+    The means and variances are updated with each batch of values using the
+    parallel form of Welford's algorithm, so that no values are stored.
+
+    Attributes:
+        counts: The number of values of each group.
+        means: The mean value of each group.
+    """
+
+    def __init__(self, num_groups: int) -> None:
+        self.counts = numpy.zeros(num_groups, dtype=int)
+        self.means = numpy.zeros(num_groups)
+        self._sums_of_squares = numpy.zeros(num_groups)
+
+    def update(self, group_values: Sequence[numpy.ndarray]) -> None:
+        """Add a batch of values for each group."""
+        for j, values in enumerate(group_values):
+            count = len(values)
+            if not count:
+                continue
+            mean = numpy.mean(values)
+            total = self.counts[j] + count
+            delta = mean - self.means[j]
+            self._sums_of_squares[j] += (
+                    numpy.sum((values - mean)**2)
+                    + delta**2 * self.counts[j] * count / total)
+            self.means[j] += delta * count / total
+            self.counts[j] = total
+
+    @property
+    def variances(self) -> numpy.ndarray:
+        """The sample variance of each group, or NaN for fewer than 2 values.
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(self.counts > 1,
+                               self._sums_of_squares / (self.counts - 1),
+                               numpy.nan)
+
+    @property
+    def standard_deviations(self) -> numpy.ndarray:
+        """The sample standard deviation of each group."""
+        return numpy.sqrt(self.variances)
+
+
+class SampleVariationalStatefulBlackBox(
+        SampleVariationalBlackBox,
+        StatefulBlackBox):
+    """A stateful black box that estimates the energy from measurements.
+
+    The black box keeps running statistics of the per-shot values of each
+    measurement group over all of its evaluations with a cost. The shots of
+    each evaluation are distributed in proportion to the estimated standard
+    deviations of the groups, which minimizes the variance of the estimate
+    for the cost spent. Before a group has been measured twice, the sum of
+    the magnitudes of its coefficients is used in place of its standard
+    deviation. The noise bounds are computed from the estimated variance of
+    this allocation.
+
+    Evaluations are recorded with the number of measurements actually
+    taken, which differs from the requested cost if the cost is not an
+    integer or is less than the number of measurement groups.
+
+    Attributes:
+        measurement_statistics: The MeasurementStatistics of the groups, or
+            None before the first evaluation with a cost.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.measurement_statistics = None \
+            # type: Optional[MeasurementStatistics]
+        super().__init__(*args, **kwargs)
+
+    def _shots_per_group(self, cost: float) -> numpy.ndarray:
+        standard_deviations = None
+        if self.measurement_statistics is not None:
+            standard_deviations = (
+                    self.measurement_statistics.standard_deviations)
+        return cast(HamiltonianObjective, self.objective).shots_per_group(
+                cost, standard_deviations)
+
+    def evaluate_with_cost(self,
+                           x: numpy.ndarray,
+                           cost: float) -> float:
+        return super().evaluate_with_cost(x, self._measured_cost(cost))
+
+    def evaluate_batch_with_cost(self,
+                                 X: numpy.ndarray,
+                                 cost: float) -> numpy.ndarray:
+        return super().evaluate_batch_with_cost(X, self._measured_cost(cost))
+
+    def _measured_cost(self, cost: float) -> float:
+        """The number of measurements taken for a cost."""
+        return float(numpy.sum(self._shots_per_group(cost)))
+
+    def _record_group_values(self,
+                             group_values: Sequence[numpy.ndarray]) -> None:
+        if self.measurement_statistics is None:
+            self.measurement_statistics = MeasurementStatistics(
+                    len(group_values))
+        self.measurement_statistics.update(group_values)
+
+    def estimate_variance(self, cost: float) -> float:
+        """The estimated variance of an evaluation with the given cost.
+
+        It is the sum over the groups of the variance of a group's per-shot
+        values divided by its number of shots, where groups without enough
+        statistics use the square of the sum of the magnitudes of their
+        coefficients.
+        """
+        objective = cast(HamiltonianObjective, self.objective)
+        shots = self._shots_per_group(cost)
+        variances = numpy.array(
+                [numpy.sum(numpy.abs(group.coefficients))**2
+                 for group in objective.measurement_groups()])
+        if self.measurement_statistics is not None:
+            estimated = self.measurement_statistics.variances
+            variances = numpy.where(numpy.isnan(estimated),
+                                    variances, estimated)
+        return float(numpy.sum(variances / shots))
+
+    def noise_bounds(self,
+                     cost: float,
+                     confidence: Optional[float]=None
+                     ) -> Tuple[float, float]:
+        """Approximate bounds on the noise of an evaluation with a cost.
+
+        The noise is approximated as normally distributed with the variance
+        given by `estimate_variance`.
+        """
+        if confidence is None:
+            confidence = 0.99
+        if not 0 < confidence < 1:
+            raise ValueError('The confidence in the noise bound must be '
+                             'between 0 and 1.')
+        sigmas = scipy.special.erfinv(confidence) * numpy.sqrt(2)
+        magnitude_bound = sigmas * numpy.sqrt(self.estimate_variance(cost))
+        return -magnitude_bound, magnitude_bound
+
+
 UNITARY_SIMULATE = UnitarySimulateVariationalBlackBox
 UNITARY_SIMULATE_STATEFUL = UnitarySimulateVariationalStatefulBlackBox
+NUMBER_SECTOR_SIMULATE = NumberSectorSimulateVariationalBlackBox
+NUMBER_SECTOR_SIMULATE_STATEFUL = (
+        NumberSectorSimulateVariationalStatefulBlackBox)
+SAMPLE = SampleVariationalBlackBox
+SAMPLE_STATEFUL = SampleVariationalStatefulBlackBox
@@ -10,10 +10,23 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import cirq
+import numpy
+import openfermion
 import pytest
 
+import openfermioncirq as ofc
+from openfermioncirq import HamiltonianObjective, SwapNetworkTrotterAnsatz
+from openfermioncirq.optimization import Profiler, profiling
 from openfermioncirq.testing import ExampleAnsatz, ExampleVariationalObjective
 from openfermioncirq.variational.variational_black_box import (
+        MeasurementStatistics,
+        NUMBER_SECTOR_SIMULATE,
+        NUMBER_SECTOR_SIMULATE_STATEFUL,
+        SAMPLE,
+        SAMPLE_STATEFUL,
+        UNITARY_SIMULATE,
+        UNITARY_SIMULATE_STATEFUL,
         VariationalBlackBox)
 
 
@@ -37,3 +50,310 @@ def test_variational_black_box_is_abstract_can_implement():
 
     assert isinstance(Included(ExampleAnsatz(), ExampleVariationalObjective()),
                       VariationalBlackBox)
+
+
+def test_unitary_simulate_evaluate_batch():
+    black_box = UNITARY_SIMULATE(ExampleAnsatz(),
+                                 ExampleVariationalObjective())
+    X = numpy.random.RandomState(3562).randn(4, 2)
+    numpy.testing.assert_allclose(
+            black_box.evaluate_batch(X),
+            [black_box.evaluate(x) for x in X])
+
+
+def test_unitary_simulate_evaluate_batch_hamiltonian_objective():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            3, real=True, seed=4214)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    preparation_circuit = cirq.Circuit(
+            cirq.X(q) for q in ansatz.qubits[:2])
+    black_box = UNITARY_SIMULATE_STATEFUL(
+            ansatz, objective, preparation_circuit=preparation_circuit)
+
+    X = numpy.random.RandomState(6124).randn(5, len(list(ansatz.params())))
+    numpy.testing.assert_allclose(
+            black_box.evaluate_batch(X),
+            [black_box.evaluate_noiseless(x) for x in X],
+            atol=1e-8)
+    assert black_box.num_evaluations == 5
+
+    numpy.random.seed(2135)
+    noisy_vals = black_box.evaluate_batch_with_cost(X, 1e8)
+    numpy.testing.assert_allclose(
+            noisy_vals,
+            [black_box.evaluate_noiseless(x) for x in X],
+            atol=1e-2)
+    assert black_box.cost_spent == 5e8
+
+
+def test_variational_black_box_prepared_state():
+    ansatz = ExampleAnsatz()
+    preparation_circuit = cirq.Circuit(cirq.X(ansatz.qubits[0]))
+    black_box = UNITARY_SIMULATE(ansatz,
+                                 ExampleVariationalObjective(),
+                                 preparation_circuit=preparation_circuit)
+
+    prepared_state = black_box.prepared_state(copy=False)
+    assert black_box.prepared_state(copy=False) is prepared_state
+    copied_state = black_box.prepared_state()
+    assert copied_state is not prepared_state
+    numpy.testing.assert_allclose(copied_state, prepared_state)
+
+    x = numpy.array([0.3, -0.2])
+    expected = cirq.resolve_parameters(
+            preparation_circuit + ansatz.circuit,
+            ansatz.param_resolver(x)).final_wavefunction(
+                    qubit_order=ansatz.qubit_permutation(ansatz.qubits))
+    assert black_box.evaluate(x) == pytest.approx(
+            black_box.objective.value(expected))
+    assert black_box.prepared_state(copy=False) is prepared_state
+
+
+def test_variational_black_box_noiseless_cache():
+    black_box = UNITARY_SIMULATE_STATEFUL(ExampleAnsatz(),
+                                          ExampleVariationalObjective(),
+                                          noiseless_cache_size=4)
+    x = numpy.array([0.1, 0.4])
+    val = black_box.evaluate(x)
+    assert black_box.evaluate_with_cost(x, 1e6) == pytest.approx(val, abs=1e-2)
+    assert black_box.cached_evaluate_noiseless(x) == val
+    numpy.testing.assert_allclose(
+            black_box.evaluate_batch(numpy.array([x, 2 * x])),
+            [val, black_box.evaluate_noiseless(2 * x)])
+
+    assert black_box.num_evaluations == 4
+    assert black_box.cost_spent == 1e6
+    assert black_box.noiseless_cache.hits == 3
+    assert black_box.noiseless_cache.misses == 2
+
+
+def test_unitary_simulate_evaluate_with_gradient():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            3, real=True, seed=6213)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    preparation_circuit = cirq.Circuit(
+            cirq.X(q) for q in ansatz.qubits[:2])
+    black_box = UNITARY_SIMULATE_STATEFUL(
+            ansatz, HamiltonianObjective(hamiltonian),
+            preparation_circuit=preparation_circuit)
+    assert black_box.has_gradient
+
+    x = numpy.random.RandomState(2617).randn(black_box.dimension)
+    value, gradient = black_box.evaluate_with_gradient(x)
+    assert value == pytest.approx(black_box.evaluate_noiseless(x))
+    assert black_box.num_evaluations == 1
+
+    step = 1e-5
+    numerical_gradient = [
+            (black_box.evaluate_noiseless(x + step * e) -
+             black_box.evaluate_noiseless(x - step * e)) / (2 * step)
+            for e in numpy.eye(black_box.dimension)]
+    numpy.testing.assert_allclose(gradient, numerical_gradient, atol=1e-5)
+
+    black_box = UNITARY_SIMULATE(ExampleAnsatz(),
+                                 ExampleVariationalObjective())
+    assert not black_box.has_gradient
+    with pytest.raises(NotImplementedError):
+        _ = black_box.evaluate_with_gradient(numpy.zeros(2))
+
+
+def test_number_sector_simulate():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            4, real=True, seed=1253)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    preparation_circuit = cirq.Circuit(
+            cirq.X(ansatz.qubits[0]),
+            cirq.X(ansatz.qubits[2]),
+            ofc.XXYYPowGate(exponent=0.3).on(*ansatz.qubits[1:3]))
+    black_box = UNITARY_SIMULATE(
+            ansatz, objective, preparation_circuit=preparation_circuit)
+    sector_black_box = NUMBER_SECTOR_SIMULATE_STATEFUL(
+            ansatz, objective, preparation_circuit=preparation_circuit)
+
+    X = numpy.random.RandomState(3612).randn(3, black_box.dimension)
+    numpy.testing.assert_allclose(
+            sector_black_box.evaluate_batch(X),
+            black_box.evaluate_batch(X),
+            atol=1e-8)
+    assert sector_black_box.compiled_circuit.dimension == 6
+    assert sector_black_box.prepared_state().shape == (6,)
+    assert sector_black_box.evaluate(X[0]) == pytest.approx(
+            black_box.evaluate(X[0]))
+    value, gradient = sector_black_box.evaluate_with_gradient(X[1])
+    expected_value, expected_gradient = black_box.evaluate_with_gradient(
+            X[1])
+    assert value == pytest.approx(expected_value)
+    numpy.testing.assert_allclose(gradient, expected_gradient, atol=1e-8)
+    assert sector_black_box.num_evaluations == 5
+
+
+def test_number_sector_simulate_requires_hamiltonian_objective():
+    with pytest.raises(TypeError):
+        _ = NUMBER_SECTOR_SIMULATE(ExampleAnsatz(),
+                                   ExampleVariationalObjective())
+
+
+def test_sample_evaluate_with_cost():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            3, real=True, seed=4214)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    preparation_circuit = cirq.Circuit(cirq.X(ansatz.qubits[0]))
+    black_box = SAMPLE_STATEFUL(
+            ansatz,
+            objective,
+            preparation_circuit=preparation_circuit,
+            initial_state=0b010,
+            sampler=cirq.Simulator(seed=2818))
+
+    X = numpy.random.RandomState(6124).randn(3, len(list(ansatz.params())))
+    exact_vals = [black_box.evaluate_noiseless(x) for x in X]
+    numpy.testing.assert_allclose(black_box.evaluate(X[0]), exact_vals[0])
+
+    cost = 1e5
+    tolerance = 5 * numpy.sqrt(objective.variance_bound / cost)
+    numpy.testing.assert_allclose(
+            black_box.evaluate_with_cost(X[0], cost), exact_vals[0],
+            atol=tolerance)
+    numpy.testing.assert_allclose(
+            black_box.evaluate_batch_with_cost(X, cost), exact_vals,
+            atol=tolerance)
+    assert black_box.num_evaluations == 5
+    assert [cost for _, cost, _ in black_box.function_values] == [None] + [
+            cost] * 4
+
+    # The noise of a measured estimate is not artificial
+    values = [black_box.evaluate_with_cost(X[1], 100) for _ in range(5)]
+    assert len(set(values)) > 1
+
+
+def test_variational_black_box_profiling():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            3, real=True, seed=4214)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    X = numpy.random.RandomState(6124).randn(2, len(list(ansatz.params())))
+
+    profiler = Profiler()
+    with profiling.profile(profiler):
+        black_box = UNITARY_SIMULATE(ansatz, objective)
+        _ = black_box.evaluate(X[0])
+        _ = black_box.evaluate_batch(X)
+        _ = black_box.evaluate_with_gradient(X[0])
+    assert {name: histogram.count
+            for name, histogram in profiler.histograms.items()
+            if name != 'apply_hamiltonian'} == {
+            'build_circuit': 1,
+            'prepare_state': 1,
+            'simulate': 2,
+            'expectation_value': 2,
+            'gradient': 1}
+
+    profiler = Profiler()
+    with profiling.profile(profiler):
+        black_box = SAMPLE(ansatz, objective,
+                           sampler=cirq.Simulator(seed=2818))
+        _ = black_box.evaluate_batch_with_cost(X, 100)
+    for name in ['build_circuit', 'resolve_parameters', 'sample', 'estimate']:
+        assert profiler.histograms[name].count >= 1
+
+
+def test_measurement_statistics():
+    values = numpy.random.RandomState(3151).randn(2, 50)
+    stats = MeasurementStatistics(3)
+    numpy.testing.assert_equal(stats.variances, [numpy.nan] * 3)
+    stats.update([values[0][:20], values[1][:1], []])
+    stats.update([values[0][20:], values[1][1:], []])
+    numpy.testing.assert_equal(stats.counts, [50, 50, 0])
+    numpy.testing.assert_allclose(stats.means[:2], numpy.mean(values, axis=1))
+    numpy.testing.assert_allclose(stats.standard_deviations[:2],
+                                  numpy.std(values, axis=1, ddof=1))
+    assert numpy.isnan(stats.standard_deviations[2])
+
+
+def test_sample_stateful_adaptive_shots():
+    hamiltonian = openfermion.random_interaction_operator(3, real=True,
+                                                          seed=6021)
+    ansatz = SwapNetworkTrotterAnsatz(
+            openfermion.random_diagonal_coulomb_hamiltonian(
+                3, real=True, seed=6021),
+            iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    black_box = SAMPLE_STATEFUL(ansatz, objective, initial_state=0b011,
+                                sampler=cirq.Simulator(seed=4102))
+    cost = 1e4
+    x = numpy.random.RandomState(2210).randn(len(list(ansatz.params())))
+    assert black_box.measurement_statistics is None
+    numpy.testing.assert_allclose(black_box.noise_bounds(cost),
+                                  objective.noise_bounds(cost))
+    numpy.testing.assert_equal(black_box._shots_per_group(cost),
+                               objective.shots_per_group(cost))
+
+    _ = black_box.evaluate_with_cost(x, cost)
+    assert black_box.cost_spent == cost
+    stats = black_box.measurement_statistics
+    groups = objective.measurement_groups()
+    numpy.testing.assert_equal(stats.counts,
+                               objective.shots_per_group(cost))
+
+    # The shots follow the estimated standard deviations, which are at most
+    # the sums of the magnitudes of the coefficients
+    standard_deviations = stats.standard_deviations
+    weights = [numpy.sum(numpy.abs(group.coefficients)) for group in groups]
+    assert numpy.all(standard_deviations <= numpy.array(weights) + 1e-8)
+    numpy.testing.assert_equal(
+            black_box._shots_per_group(cost),
+            objective.shots_per_group(cost, standard_deviations))
+    expected_variance = numpy.sum(
+            stats.variances / black_box._shots_per_group(cost))
+    numpy.testing.assert_allclose(black_box.estimate_variance(cost),
+                                  expected_variance)
+
+    # The adaptive allocation spends exactly the cost, and evaluations are
+    # recorded with the number of measurements taken
+    assert numpy.sum(black_box._shots_per_group(cost)) == cost
+    counts = stats.counts.copy()
+    _ = black_box.evaluate_batch_with_cost(numpy.array([x, x]), 100.4)
+    assert numpy.sum(stats.counts - counts) == 200
+    assert black_box.cost_spent == cost + 200
+    _ = black_box.evaluate_with_cost(x, 1)
+    assert black_box.cost_spent == cost + 200 + len(groups)
+    assert [cost for _, cost, _ in black_box.function_values] == [
+            1e4, 100.0, 100.0, len(groups)]
+
+    # The allocation minimizes the variance, which is below the bound
+    a, b = black_box.noise_bounds(cost)
+    c, d = objective.noise_bounds(cost)
+    assert c < a < 0 < b < d
+    with pytest.raises(ValueError):
+        _ = black_box.noise_bounds(cost, 1.0)
+
+
+def test_sample_sampling_circuit():
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            2, real=True, seed=2132)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    objective = HamiltonianObjective(hamiltonian)
+    black_box = SAMPLE(ansatz, objective, initial_state=numpy.int64(1))
+    qubits = ansatz.qubit_permutation(ansatz.qubits)
+    assert black_box.sampling_circuit == (
+            cirq.Circuit(cirq.X(qubits[1]))
+            + ansatz.circuit
+            + objective.measurement_circuit(qubits))
+    assert isinstance(black_box.sampler, cirq.Simulator)
+
+
+def test_sample_requires_hamiltonian_objective_and_basis_state():
+    with pytest.raises(TypeError):
+        _ = SAMPLE(ExampleAnsatz(), ExampleVariationalObjective())
+
+    hamiltonian = openfermion.random_diagonal_coulomb_hamiltonian(
+            2, real=True, seed=2132)
+    ansatz = SwapNetworkTrotterAnsatz(hamiltonian, iterations=1)
+    black_box = SAMPLE(ansatz, HamiltonianObjective(hamiltonian),
+                       initial_state=numpy.array([0, 1, 0, 0], dtype=complex))
+    with pytest.raises(ValueError):
+        _ = black_box.evaluate_with_cost(
+                numpy.zeros(len(list(ansatz.params()))), 100)